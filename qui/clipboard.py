@@ -26,17 +26,25 @@
 via Qubes RPC '''
 # pylint: disable=invalid-name,wrong-import-position
 
+import argparse
 import asyncio
 import math
 import os
 import fcntl
+import stat
+import tempfile
+import time
 
 import gi
 gi.require_version('Gtk', '3.0')  # isort:skip
 from gi.repository import Gtk, Gio, Gdk  # isort:skip
 
 import gbulb
-import pyinotify
+
+from qui import clipboard_history
+from qui import inotify
+from qui import systemd_notify
+from qui import watchdog
 
 import gettext
 t = gettext.translation("desktop-linux-manager", localedir="/usr/locales",
@@ -48,17 +56,69 @@ gbulb.install()
 DATA = "/var/run/qubes/qubes-clipboard.bin"
 FROM = "/var/run/qubes/qubes-clipboard.bin.source"
 FROM_DIR = "/var/run/qubes/"
+FROM_NAME = os.path.basename(FROM)
 XEVENT = "/var/run/qubes/qubes-clipboard.bin.xevent"
 APPVIEWER_LOCK = "/var/run/qubes/appviewer.lock"
 
+# transfers listed in the menu
+MENU_HISTORY_ENTRIES = 5
+
+# seconds during which transfer notifications following one another are
+# coalesced into one
+NOTIFICATION_WINDOW = 1.0
+# id of the transfer notification, so that each replaces the previous one
+TRANSFER_NOTIFICATION_ID = "transfer"
+
 
-class EventHandler(pyinotify.ProcessEvent):
-    # pylint: disable=arguments-differ
-    def my_init(self, loop=None, gtk_app=None):
-        '''  This method is called from ProcessEvent.__init__(). '''
+class EventHandler:
+    ''' Watches the FROM file, which the GUI daemon writes after every
+    clipboard copy or paste. Only writes, removal and moves are watched, so
+    that the daemon merely reading the file does not wake us; FROM_DIR is
+    only watched while FROM is missing, for it to be created again. '''
+
+    def __init__(self, loop=None, gtk_app=None):
         self.gtk_app = gtk_app
         self.loop = loop if loop else asyncio.get_event_loop()
 
+        self.inotify = inotify.Inotify(self.loop, self.process_event)
+        self.source_wd = None
+        self.dir_wd = None
+        # the copy last recorded in the history, pending while the contents
+        # are hashed in a worker thread
+        self.copy_record = None
+        self.watch_source()
+
+    def watch_source(self):
+        ''' Watch FROM, or FROM_DIR if it is missing. The directory is
+        watched first, so that FROM created in between is not missed. '''
+        if self.source_wd is not None:
+            self.inotify.rm_watch(self.source_wd)
+            self.source_wd = None
+        if self.dir_wd is None:
+            self.dir_wd = self.inotify.add_watch(FROM_DIR, inotify.IN_CREATE)
+        try:
+            self.source_wd = self.inotify.add_watch(
+                FROM, inotify.IN_CLOSE_WRITE | inotify.IN_MOVE_SELF |
+                inotify.IN_DELETE_SELF)
+        except FileNotFoundError:
+            return
+        self.inotify.rm_watch(self.dir_wd)
+        self.dir_wd = None
+
+    def process_event(self, watch_descriptor, mask, name):
+        if watch_descriptor == self.source_wd:
+            if mask & inotify.IN_CLOSE_WRITE:
+                self.process_IN_CLOSE_WRITE()
+            elif mask & inotify.IN_MOVE_SELF:
+                self.process_IN_MOVE_SELF()
+            elif mask & inotify.IN_DELETE_SELF:
+                self.process_IN_DELETE()
+            elif mask & inotify.IN_IGNORED:
+                self.source_wd = None
+        elif watch_descriptor == self.dir_wd and name == FROM_NAME and \
+                mask & inotify.IN_CREATE:
+            self.process_IN_CREATE()
+
     def _copy(self, vmname: str = None):
         ''' Sends Copy notification via Gio.Notification
         '''
@@ -66,6 +126,13 @@ class EventHandler(pyinotify.ProcessEvent):
             with open(FROM, 'r') as vm_from_file:
                 vmname = vm_from_file.readline().strip('\n')
 
+        try:
+            file_size = os.path.getsize(DATA)
+        except OSError:
+            file_size = None
+        self.copy_record = self.loop.create_task(
+            self.record_copy(self.copy_record, vmname, file_size))
+
         size = clipboard_formatted_size()
 
         body = _("Qubes Clipboard fetched from qube: <b>'{0}'</b>\n"
@@ -81,9 +148,30 @@ class EventHandler(pyinotify.ProcessEvent):
         body = _("Qubes Clipboard has been copied to the qube and wiped.<i/>\n"
                  "<small>Trigger a paste operation (e.g. Ctrl-v) to insert "
                  "it into an application.</small>")
+        self.after_copy_recorded(self.gtk_app.history.record_paste)
         self.gtk_app.update_clipboard_contents(message=body)
 
-    def process_IN_CLOSE_WRITE(self, _unused):
+    async def record_copy(self, previous_copy, vmname, file_size):
+        ''' Records a copy in the history once DATA is hashed, in a worker
+        thread, and previous_copy is recorded '''
+        try:
+            digest = await self.loop.run_in_executor(
+                None, clipboard_history.hash_file, DATA)
+        except OSError:
+            digest = None
+        if previous_copy is not None:
+            await previous_copy
+        self.gtk_app.history.record_copy(vmname, file_size, digest)
+
+    def after_copy_recorded(self, record):
+        ''' Calls record once the last copy is recorded, so that the history
+        keeps the order of the transfers '''
+        if self.copy_record is None or self.copy_record.done():
+            record()
+        else:
+            self.copy_record.add_done_callback(lambda _task: record())
+
+    def process_IN_CLOSE_WRITE(self):
         ''' Reacts to modifications of the FROM file '''
         with open(FROM, 'r') as vm_from_file:
             vmname = vm_from_file.readline().strip('\n')
@@ -92,26 +180,36 @@ class EventHandler(pyinotify.ProcessEvent):
         else:
             self._copy(vmname=vmname)
 
-    def process_IN_MOVE_SELF(self, _unused):
-        ''' Stop loop if file is moved '''
-        self.loop.stop()
+    def process_IN_MOVE_SELF(self):
+        ''' Follow FROM, not the moved file; if it is already replaced the
+        new one is watched, otherwise it is once it is created '''
+        self.watch_source()
 
-    def process_IN_DELETE(self, _unused):
-        ''' Stop loop if file is deleted '''
-        self.loop.stop()
+    def process_IN_DELETE(self):
+        ''' Wait for FROM to be created again; the kernel has removed its
+        watch already '''
+        self.after_copy_recorded(self.gtk_app.history.record_wipe)
+        self.source_wd = None
+        self.watch_source()
 
-    def process_IN_CREATE(self, event):
-        if event.pathname == FROM:
-            self._copy()
-            self.gtk_app.setup_watcher()
+    def process_IN_CREATE(self):
+        ''' Watch the new FROM; the transfer is reported once its writer
+        closes it '''
+        self.watch_source()
 
 
 def clipboard_formatted_size() -> str:
-    units = ['B', 'KiB', 'MiB', 'GiB']
-
     try:
         file_size = os.path.getsize(DATA)
     except OSError:
+        file_size = None
+    return formatted_size(file_size)
+
+
+def formatted_size(file_size) -> str:
+    units = ['B', 'KiB', 'MiB', 'GiB']
+
+    if file_size is None:
         return _('? bytes')
     else:
         if file_size == 1:
@@ -129,8 +227,27 @@ def clipboard_formatted_size() -> str:
         return '%s' % (formatted_bytes)
 
 
+def write_clipboard_data(text: str) -> str:
+    ''' Writes text to a new file next to DATA, so that it can replace DATA
+    atomically. Returns the path of the file. '''
+    fd, path = tempfile.mkstemp(dir=os.path.dirname(DATA),
+                                prefix='.qubes-clipboard.bin.')
+    try:
+        with open(fd, 'w') as contents:
+            try:
+                os.fchmod(contents.fileno(),
+                          stat.S_IMODE(os.stat(DATA).st_mode))
+            except FileNotFoundError:
+                pass
+            contents.write(text)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
 class NotificationApp(Gtk.Application):
-    def __init__(self, wm, **properties):
+    def __init__(self, journal_path=None, **properties):
         super().__init__(**properties)
         self.set_application_id("org.qubes.qui.clipboard")
         self.register()  # register Gtk Application
@@ -144,27 +261,25 @@ class NotificationApp(Gtk.Application):
 
         self.menu = Gtk.Menu()
         self.clipboard_label = Gtk.Label(xalign=0)
+        self.history = clipboard_history.ClipboardHistory(journal_path)
+        self.history_menu = Gtk.Menu()
 
-        self.prepare_menu()
-
-        self.wm = wm
-        self.temporary_watch = None
+        # transfer notification waiting for the end of the current window
+        self.pending_notification = None
+        self.notification_timer = None
+        # transfer notifications replaced by a later one before being shown,
+        # in the current window and since start
+        self.window_suppressed = 0
+        self.suppressed_notifications = 0
 
-        if not os.path.exists(FROM):
-            # pylint: disable=no-member
-            self.temporary_watch = \
-                self.wm.add_watch(FROM_DIR, pyinotify.IN_CREATE, rec=False)
-        else:
-            self.setup_watcher()
+        self.prepare_menu()
 
-    def setup_watcher(self):
-        if self.temporary_watch:
-            for wd in self.temporary_watch.values():
-                self.wm.rm_watch(wd)
-        mask = pyinotify.ALL_EVENTS
-        self.wm.add_watch(FROM, mask)
+    def service_status(self):
+        return '{} clipboard notifications coalesced'.format(
+            self.suppressed_notifications)
 
     def show_menu(self, _unused, event):
+        self.update_history_menu()
         self.menu.show_all()
         self.menu.popup(None,  # parent_menu_shell
                         None,  # parent_menu_item
@@ -187,7 +302,7 @@ class NotificationApp(Gtk.Application):
             self.icon.set_from_icon_name("edit-copy")
 
         if message:
-            self.notify(message)
+            self.notify_transfer(message)
 
     def prepare_menu(self):
         self.menu = Gtk.Menu()
@@ -205,6 +320,10 @@ class NotificationApp(Gtk.Application):
         self.update_clipboard_contents()
         self.menu.append(clipboard_content_item)
 
+        history_item = Gtk.MenuItem(_("Recent transfers"))
+        history_item.set_submenu(self.history_menu)
+        self.menu.append(history_item)
+
         self.menu.append(Gtk.SeparatorMenuItem())
 
         help_label = Gtk.Label(xalign=0)
@@ -222,53 +341,140 @@ class NotificationApp(Gtk.Application):
         dom0_item.connect('activate', self.copy_dom0_clipboard)
         self.menu.append(dom0_item)
 
+    def update_history_menu(self):
+        ''' Lists recent transfers from the history, which holds everything
+        needed; the clipboard file is not read '''
+        for item in self.history_menu.get_children():
+            self.history_menu.remove(item)
+
+        states = {'copied': _("not pasted yet"),
+                  'pasted': _("pasted"),
+                  'wiped': _("wiped")}
+        transfers = self.history.recent(MENU_HISTORY_ENTRIES)
+        for transfer in transfers:
+            item = Gtk.MenuItem(_("{time}: {size} from {vm}, {state}").format(
+                time=time.strftime('%H:%M:%S', time.localtime(transfer.time)),
+                size=formatted_size(transfer.size),
+                vm=transfer.source,
+                state=states.get(transfer.state, transfer.state)))
+            item.set_sensitive(False)
+            if transfer.digest:
+                item.set_tooltip_text(
+                    _("SHA-256: {}").format(transfer.digest))
+            self.history_menu.append(item)
+        if not transfers:
+            item = Gtk.MenuItem(_("No transfers yet"))
+            item.set_sensitive(False)
+            self.history_menu.append(item)
+
     def copy_dom0_clipboard(self, *_args, **_kwargs):
+        ''' Requests the dom0 clipboard without waiting for it; the event
+        time is taken now, while the menu activation is the current event '''
         clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
-        text = clipboard.wait_for_text()
+        clipboard.request_text(self.received_dom0_clipboard,
+                               Gtk.get_current_event_time())
 
+    def received_dom0_clipboard(self, _clipboard, text, event_time):
         if not text:
             self.notify(_("dom0 clipboard is empty!"))
             return
 
+        asyncio.ensure_future(self.write_dom0_clipboard(text, event_time))
+
+    async def write_dom0_clipboard(self, text, event_time):
+        ''' Writes text to a temporary file and blocks on the lock in worker
+        threads. The lock, which the GUI daemon waits for, is only held to
+        rename the file over DATA and write the small FROM and XEVENT files.
+        '''
+        loop = asyncio.get_event_loop()
+        try:
+            path = await loop.run_in_executor(None, write_clipboard_data, text)
+        except Exception as ex:  # pylint: disable=broad-except
+            self.notify(_("Error while writing to "
+                          "Qubes clipboard!\n{0}").format(str(ex)))
+            return
+
         try:
             fd = os.open(APPVIEWER_LOCK, os.O_RDWR | os.O_CREAT, 0o0666)
         except Exception:  # pylint: disable=broad-except
             self.notify(_("Error while accessing Qubes clipboard!"))
-        else:
-            try:
-                fcntl.flock(fd, fcntl.LOCK_EX)
-            except Exception:  # pylint: disable=broad-except
-                self.notify(_("Error while locking Qubes clipboard!"))
-                os.close(fd)
-            else:
-                try:
-                    with open(DATA, "w") as contents:
-                        contents.write(text)
-                    with open(FROM, "w") as source:
-                        source.write("dom0")
-                    with open(XEVENT, "w") as timestamp:
-                        timestamp.write(str(Gtk.get_current_event_time()))
-                except Exception as ex:  # pylint: disable=broad-except
-                    self.notify(_("Error while writing to "
-                                  "Qubes clipboard!\n{0}").format(str(ex)))
-                fcntl.flock(fd, fcntl.LOCK_UN)
-                os.close(fd)
-
-    def notify(self, body):
+            os.unlink(path)
+            return
+
+        try:
+            await loop.run_in_executor(None, fcntl.flock, fd, fcntl.LOCK_EX)
+        except Exception:  # pylint: disable=broad-except
+            self.notify(_("Error while locking Qubes clipboard!"))
+            os.close(fd)
+            os.unlink(path)
+            return
+
+        try:
+            os.replace(path, DATA)
+            with open(FROM, "w") as source:
+                source.write("dom0")
+            with open(XEVENT, "w") as timestamp:
+                timestamp.write(str(event_time))
+        except Exception as ex:  # pylint: disable=broad-except
+            self.notify(_("Error while writing to "
+                          "Qubes clipboard!\n{0}").format(str(ex)))
+            if os.path.exists(path):
+                os.unlink(path)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def notify(self, body, notification_id=None):
         # pylint: disable=attribute-defined-outside-init
         notification = Gio.Notification.new(_("Qubes Clipboard"))
         notification.set_body(body)
         notification.set_priority(Gio.NotificationPriority.NORMAL)
-        self.send_notification(self.get_application_id(), notification)
+        self.send_notification(notification_id or self.get_application_id(),
+                               notification)
+
+    def notify_transfer(self, body):
+        ''' Shows a copy or paste notification. The first one is shown at
+        once; those following within NOTIFICATION_WINDOW are coalesced and
+        only the last is shown when the window ends, replacing the previous
+        notification. Errors use :meth:`notify` and are never coalesced. '''
+        if self.notification_timer is not None:
+            if self.pending_notification is not None:
+                self.window_suppressed += 1
+                self.suppressed_notifications += 1
+            self.pending_notification = body
+            return
+
+        if self.window_suppressed:
+            body += '\n' + _("<small>{} earlier clipboard notifications "
+                              "were skipped.</small>").format(
+                                  self.window_suppressed)
+            self.window_suppressed = 0
+        self.notify(body, TRANSFER_NOTIFICATION_ID)
+        self.notification_timer = asyncio.get_event_loop().call_later(
+            NOTIFICATION_WINDOW, self.notification_window_ended)
+
+    def notification_window_ended(self):
+        self.notification_timer = None
+        if self.pending_notification is not None:
+            body, self.pending_notification = self.pending_notification, None
+            self.notify_transfer(body)
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description=_("Notify about Qubes clipboard transfers."))
+    parser.add_argument(
+        '--history-journal', metavar='PATH',
+        help=_("also keep the transfer history (times, qubes, sizes and "
+               "hashes, never the contents) in this file"))
+    args = parser.parse_args()
+    watchdog.start_from_environment()
+
     loop = asyncio.get_event_loop()
-    wm = pyinotify.WatchManager()
-    gtk_app = NotificationApp(wm)
+    gtk_app = NotificationApp(journal_path=args.history_journal)
 
-    handler = EventHandler(loop=loop, gtk_app=gtk_app)
-    pyinotify.AsyncioNotifier(wm, loop, default_proc_fun=handler)
+    EventHandler(loop=loop, gtk_app=gtk_app)
+    systemd_notify.start(gtk_app.service_status)
     loop.run_forever()
 
 
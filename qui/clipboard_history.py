@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+''' Index of recent inter-qube clipboard transfers for qui-clipboard. Only
+metadata is kept: when, from which qube, how large and a hash of the
+contents, never the contents themselves. '''
+
+import collections
+import hashlib
+import json
+import os
+import time
+
+# transfers kept in memory, and read back from the journal on start
+MAX_ENTRIES = 20
+# the journal is rotated to <journal>.1 once it grows over this many bytes
+MAX_JOURNAL_SIZE = 64 * 1024
+
+READ_SIZE = 64 * 1024
+
+Transfer = collections.namedtuple(
+    'Transfer', ['time', 'source', 'size', 'digest', 'state'])
+Transfer.__doc__ = ''' A clipboard transfer. state is 'copied' while the
+clipboard waits to be pasted, then 'pasted' or 'wiped' if it was replaced
+or removed before being pasted. '''
+
+
+def hash_file(path):
+    ''' Hex SHA-256 digest of the file at path, read in chunks. '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as contents:
+        for chunk in iter(lambda: contents.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ClipboardHistory:
+    ''' Ring of the last MAX_ENTRIES transfers, newest last. If journal_path
+    is given, every change is also appended to that file as a JSON line and
+    the ring is restored from it on start. '''
+
+    def __init__(self, journal_path=None, max_entries=MAX_ENTRIES):
+        self.entries = collections.deque(maxlen=max_entries)
+        self.journal_path = journal_path
+        if journal_path:
+            self.load_journal()
+
+    def load_journal(self):
+        for path in (self.journal_path + '.1', self.journal_path):
+            try:
+                with open(path) as journal:
+                    for line in journal:
+                        try:
+                            self.apply(Transfer(**json.loads(line)))
+                        except (ValueError, TypeError):
+                            continue  # damaged line
+            except OSError:
+                pass
+
+    def apply(self, transfer):
+        # a transfer whose state changed is written again with its time
+        if self.entries and self.entries[-1].time == transfer.time:
+            self.entries[-1] = transfer
+        else:
+            self.entries.append(transfer)
+
+    def write_journal(self, transfer):
+        if not self.journal_path:
+            return
+        try:
+            if os.path.getsize(self.journal_path) > MAX_JOURNAL_SIZE:
+                os.replace(self.journal_path, self.journal_path + '.1')
+        except OSError:
+            pass
+        try:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            with open(self.journal_path, 'a') as journal:
+                journal.write(json.dumps(transfer._asdict()) + '\n')
+        except OSError:
+            pass  # the in-memory history is still complete
+
+    def update(self, transfer):
+        self.apply(transfer)
+        self.write_journal(transfer)
+
+    def finish_last(self, state):
+        if self.entries and self.entries[-1].state == 'copied':
+            self.update(self.entries[-1]._replace(state=state))
+
+    def record_copy(self, source, size, digest):
+        ''' The clipboard was filled from source. A notification for the
+        very same transfer repeated is ignored. '''
+        if self.entries:
+            last = self.entries[-1]
+            if last.state == 'copied' and \
+                    (last.source, last.size, last.digest) == \
+                    (source, size, digest):
+                return
+        self.finish_last('wiped')
+        self.update(Transfer(time.time(), source, size, digest, 'copied'))
+
+    def record_paste(self):
+        ''' The clipboard was pasted into a qube, which empties it. '''
+        self.finish_last('pasted')
+
+    def record_wipe(self):
+        ''' The clipboard was removed without being pasted. '''
+        self.finish_last('wiped')
+
+    def recent(self, count):
+        ''' The last count transfers, newest first. '''
+        return list(reversed(self.entries))[:count]
@@ -8,6 +8,7 @@ import gi  # isort:skip
 gi.require_version('Gtk', '3.0')  # isort:skip
 from gi.repository import Gtk, Pango  # isort:skip
 from qubesadmin import exc
+from qui import icon_cache
 
 import gettext
 t = gettext.translation("desktop-linux-manager", localedir="/usr/locales",
@@ -95,13 +96,7 @@ class DomainDecorator(PropertiesDecorator):
             if self.vm is None:
                 return
 
-            tooltip = "<b>{vmname}</b>".format(vmname=self.vm.name)
-
-            if self.vm.klass == 'AdminVM':
-
-                tooltip += _("\nAdministrative domain")
-
-            else:
+            if self.vm.klass != 'AdminVM':
                 if not self.template_name:
                     self.template_name = getattr(self.vm, 'template', None)
                     self.template_name = "None" if not self.template_name \
@@ -113,43 +108,15 @@ class DomainDecorator(PropertiesDecorator):
                         else str(self.netvm_name)
 
                 if not self.cur_storage or storage_changed:
-                    try:
-                        self.cur_storage = \
-                            self.vm.get_disk_utilization() / 1024 ** 3
-                    except (exc.QubesDaemonNoResponseError, KeyError):
-                        self.cur_storage = 0
+                    self.cur_storage = get_storage_usage(self.vm)
 
                 if not self.max_storage or storage_changed:
-                    try:
-                        self.max_storage = \
-                            self.vm.volumes['private'].size / 1024 ** 3
-                    except (exc.QubesDaemonNoResponseError, KeyError):
-                        self.max_storage = 0
-
-                if self.max_storage == 0:
-                    perc_storage = 0
-                else:
-                    perc_storage = self.cur_storage / self.max_storage
-
-                tooltip += \
-                    _("\nTemplate: <b>{template}</b>"
-                      "\nNetworking: <b>{netvm}</b>"
-                      "\nPrivate storage: <b>{current_storage:.2f}GB/"
-                      "{max_storage:.2f}GB ({perc_storage:.1%})</b>").format(
-                        template=self.template_name,
-                        netvm=self.netvm_name,
-                        current_storage=self.cur_storage,
-                        max_storage=self.max_storage,
-                        perc_storage=perc_storage)
-
-                if self.outdated:
-                    tooltip += _("\n\nRestart qube to "
-                                 "apply changes in template.")
-
-                if self.updates_available:
-                    tooltip += _("\n\nUpdates available.")
-
-            self.label.set_tooltip_markup(tooltip)
+                    self.max_storage = get_storage_size(self.vm)
+
+            self.label.set_tooltip_markup(domain_tooltip(
+                self.vm, self.template_name, self.netvm_name,
+                self.cur_storage, self.max_storage,
+                self.outdated, self.updates_available))
 
     def name(self):
         namebox = DomainDecorator.VMName(self.vm)
@@ -202,20 +169,20 @@ class DomainDecorator(PropertiesDecorator):
         return cpu_widget
 
 
-    def icon(self) -> Gtk.Image:
-        ''' Returns a `Gtk.Image` containing the colored lock icon '''
-        if self.vm is None:   # should not be called
-            return None
+    def icon_name(self) -> str:
+        ''' Name of the colored lock icon of the domain's label '''
         try:
             # this is a temporary, emergency fix for unexecpected conflict with
             # qui-devices rewrite
-            icon = self.vm.icon
+            return self.vm.icon
         except AttributeError:
-            icon = self.vm.label.icon
-        icon_vm = Gtk.IconTheme.get_default().load_icon(
-            icon, 16, 0)
-        icon_img = Gtk.Image.new_from_pixbuf(icon_vm)
-        return icon_img
+            return self.vm.label.icon
+
+    def icon(self) -> Gtk.Image:
+        ''' Returns a `Gtk.Image` containing the colored lock icon '''
+        if self.vm is None:   # should not be called
+            return None
+        return icon_cache.get_image(self.icon_name())
 
     def netvm(self) -> Gtk.Label:
         netvm = self.vm.netvm
@@ -228,6 +195,56 @@ class DomainDecorator(PropertiesDecorator):
         return label
 
 
+def get_storage_usage(vm) -> float:
+    ''' GB of private storage used by vm, 0 if unknown '''
+    try:
+        return vm.get_disk_utilization() / 1024 ** 3
+    except (exc.QubesDaemonNoResponseError, KeyError):
+        return 0
+
+
+def get_storage_size(vm) -> float:
+    ''' GB of private storage of vm, 0 if unknown '''
+    try:
+        return vm.volumes['private'].size / 1024 ** 3
+    except (exc.QubesDaemonNoResponseError, KeyError):
+        return 0
+
+
+def domain_tooltip(vm, template_name, netvm_name, cur_storage, max_storage,
+                   outdated, updates_available) -> str:
+    ''' Tooltip markup describing a domain '''
+    tooltip = "<b>{vmname}</b>".format(vmname=vm.name)
+
+    if vm.klass == 'AdminVM':
+        return tooltip + _("\nAdministrative domain")
+
+    if max_storage == 0:
+        perc_storage = 0
+    else:
+        perc_storage = cur_storage / max_storage
+
+    tooltip += \
+        _("\nTemplate: <b>{template}</b>"
+          "\nNetworking: <b>{netvm}</b>"
+          "\nPrivate storage: <b>{current_storage:.2f}GB/"
+          "{max_storage:.2f}GB ({perc_storage:.1%})</b>").format(
+            template=template_name,
+            netvm=netvm_name,
+            current_storage=cur_storage,
+            max_storage=max_storage,
+            perc_storage=perc_storage)
+
+    if outdated:
+        tooltip += _("\n\nRestart qube to "
+                     "apply changes in template.")
+
+    if updates_available:
+        tooltip += _("\n\nUpdates available.")
+
+    return tooltip
+
+
 def device_hbox(device) -> Gtk.Box:
     ''' Returns a :class:`Gtk.Box` containing the device name & icon.. '''
     if device.devclass == 'block':
@@ -281,5 +298,4 @@ def device_domain_hbox(vm, attached: bool) -> Gtk.Box:
 
 def create_icon(name) -> Gtk.Image:
     ''' Create an icon from string '''
-    icon_dev = Gtk.IconTheme.get_default().load_icon(name, 16, 0)
-    return Gtk.Image.new_from_pixbuf(icon_dev)
+    return icon_cache.get_image(name)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=import-error
+''' Fan-out of qubesd events to the widgets of a session. qui-events holds
+the only admin.Events stream and re-publishes every event, already parsed,
+to local subscribers over a unix socket, each receiving only the events
+matching its filters. Widgets subscribe with
+:class:`LocalEventsDispatcher`, a drop-in for
+:class:`qubesadmin.events.EventsDispatcher`.
+
+The protocol is newline-delimited JSON. A subscriber sends
+``{"events": [pattern, ...]}`` (fnmatch patterns, as used for handlers)
+whenever its filters change; it receives
+``{"subject": name-or-null, "event": name, "kwargs": {...}}`` objects. '''
+
+import asyncio
+import fnmatch
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+
+import qubesadmin
+import qubesadmin.events
+
+from qui import event_stream
+
+SOCKET_PATH = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR', '/run/user/{}'.format(os.getuid())),
+    'qui-events.sock')
+
+# a subscriber this far behind is disconnected, and has to reconnect
+MAX_SUBSCRIBER_BUFFER = 4 * 1024 * 1024
+
+# seconds between attempts to connect to qui-events
+RECONNECT_DELAY = 1.0
+
+# connections to qui-events refused in a row before a widget opens its own
+# stream from qubesd instead
+MAX_REFUSED_CONNECTIONS = 3
+
+# events qubesadmin.events.EventsDispatcher.handle uses to keep the caches of
+# the Qubes objects up to date, subscribed to whatever the handlers are
+CACHE_EVENTS = ('property-set:*', 'property-reset:*', 'domain-add',
+                'domain-delete', 'domain-pre-start', 'domain-start',
+                'domain-start-failed', 'domain-shutdown', 'domain-paused',
+                'domain-unpaused')
+
+log = logging.getLogger('qui-events')
+
+
+class Subscriber:
+    ''' A connected client and the event patterns it wants. '''
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.patterns = []
+
+    def wants(self, event):
+        return any(fnmatch.fnmatchcase(event, pattern)
+                   for pattern in self.patterns)
+
+
+class FanoutDispatcher(qubesadmin.events.EventsDispatcher):
+    ''' Reads admin.Events like any dispatcher, but instead of calling
+    handlers, serializes each event once and writes it to every subscriber
+    interested in it. '''
+
+    def __init__(self, app, **kwargs):
+        super().__init__(app, **kwargs)
+        self.subscribers = set()
+
+    def handle(self, subject, event, **kwargs):
+        line = None
+        for subscriber in list(self.subscribers):
+            if not subscriber.wants(event):
+                continue
+            if line is None:
+                line = (json.dumps({'subject': subject or None,
+                                    'event': event,
+                                    'kwargs': kwargs}) + '\n').encode()
+            transport = subscriber.writer.transport
+            if transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+                log.warning('Dropping a subscriber not reading events')
+                self.subscribers.discard(subscriber)
+                transport.abort()
+                continue
+            subscriber.writer.write(line)
+
+    async def serve_client(self, reader, writer):
+        subscriber = Subscriber(writer)
+        self.subscribers.add(subscriber)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    subscriber.patterns = [
+                        str(pattern) for pattern in
+                        json.loads(line.decode())['events']]
+                except (ValueError, KeyError, TypeError):
+                    log.warning('Invalid subscription: %r', line)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            writer.close()
+
+
+class LocalEventsDispatcher(qubesadmin.events.EventsDispatcher):
+    ''' Drop-in for :class:`qubesadmin.events.EventsDispatcher` (of
+    admin.Events) receiving events from qui-events instead of qubesd. Events
+    go through the same :meth:`handle`, and those in CACHE_EVENTS are always
+    subscribed to, so the Qubes object caches are kept up to date the same
+    way. If qui-events is gone (its socket is missing,
+    or keeps refusing connections), events are read directly from qubesd,
+    until qui-events runs again. '''
+
+    def __init__(self, app, socket_path=SOCKET_PATH, **kwargs):
+        super().__init__(app, **kwargs)
+        self.socket_path = socket_path
+        self.writer = None
+        self.refused_connections = 0
+        self.direct = False
+
+    def add_handler(self, event, handler):
+        new_pattern = event not in self.handlers
+        super().add_handler(event, handler)
+        if new_pattern:
+            self.send_subscription()
+
+    def send_subscription(self):
+        if self.writer is not None:
+            patterns = set(self.handlers).union(CACHE_EVENTS)
+            self.writer.write((json.dumps(
+                {'events': sorted(patterns)}) + '\n').encode())
+
+    async def listen_for_events(self, vm=None, reconnect=True):
+        ''' Handle events until the connection to qui-events (or to qubesd,
+        without qui-events) is closed; with reconnect, connect again,
+        forever. Only events of vm are handled if it is given. '''
+        while True:
+            if self.direct and fanout_running(self.socket_path):
+                log.info('Receiving events from qui-events again')
+                self.direct = False
+                self.refused_connections = 0
+            if self.direct:
+                # connection errors are for the caller, as for any
+                # dispatcher reading from qubesd
+                await super().listen_for_events(vm, reconnect=False)
+            else:
+                try:
+                    await self._listen_for_local_events(vm)
+                except OSError:
+                    pass
+            if not reconnect:
+                break
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _listen_for_local_events(self, vm=None):
+        try:
+            reader, self.writer = await asyncio.open_unix_connection(
+                self.socket_path)
+        except OSError as ex:
+            self.refused_connections += 1
+            if isinstance(ex, FileNotFoundError) or \
+                    self.refused_connections >= MAX_REFUSED_CONNECTIONS:
+                log.warning('qui-events is not running (%s), receiving '
+                            'events from qubesd', ex)
+                self.direct = True
+            raise
+        self.refused_connections = 0
+        try:
+            self.send_subscription()
+            # as qubesd does on admin.Events; events may have been missed
+            self.handle(None, 'connection-established')
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                event = json.loads(line.decode())
+                if vm is not None and event['subject'] != vm.name:
+                    continue
+                self.handle(event['subject'], event['event'],
+                            **event['kwargs'])
+        finally:
+            self.writer.close()
+            self.writer = None
+
+
+def fanout_running(socket_path=SOCKET_PATH):
+    ''' Whether qui-events accepts connections on socket_path; a socket
+    file may be left behind by a qui-events that was killed. '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+def get_events_dispatcher(app):
+    ''' A dispatcher of admin.Events for app: through qui-events if it is
+    running, otherwise directly from qubesd. '''
+    if fanout_running():
+        return LocalEventsDispatcher(app)
+    return qubesadmin.events.EventsDispatcher(app)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    dispatcher = FanoutDispatcher(qubesadmin.Qubes())
+
+    if fanout_running():
+        log.error('qui-events is already running')
+        return 1
+    if os.path.exists(SOCKET_PATH):
+        # left behind by a qui-events that was killed
+        os.unlink(SOCKET_PATH)
+    old_umask = os.umask(0o077)
+    try:
+        server = loop.run_until_complete(asyncio.start_unix_server(
+            dispatcher.serve_client, SOCKET_PATH))
+    finally:
+        os.umask(old_umask)
+
+    listener = asyncio.ensure_future(
+        event_stream.listen_for_events(dispatcher))
+    # systemd stops the service with SIGTERM, which would otherwise end the
+    # process without removing the socket
+    loop.add_signal_handler(signal.SIGTERM, listener.cancel)
+    try:
+        loop.run_until_complete(listener)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        server.close()
+        os.unlink(SOCKET_PATH)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=import-error
+''' Recording of the admin.Events and admin.vm.Stats streams, and their
+replay into the dispatchers of a widget, to reproduce event storms (mass
+shutdowns, USB hub hotplugs, DispVM churn) when testing widgets.
+
+A recording is a gzip-compressed file of JSON lines: a header, then for
+every event ``[seconds since start, stream, subject, event, kwargs]``, with
+the subject and arguments as qubesd sent them. Record in dom0 with::
+
+    python3 -m qui.event_recording storm.json.gz --duration 60
+'''
+
+import argparse
+import asyncio
+import collections
+import gzip
+import json
+import sys
+import time
+
+import qubesadmin
+import qubesadmin.events
+
+from qui import event_stream
+
+VERSION = 1
+
+STREAMS = ('admin.Events', 'admin.vm.Stats')
+
+Record = collections.namedtuple(
+    'Record', ['time', 'stream', 'subject', 'event', 'kwargs'])
+
+
+class EventRecorder:
+    ''' Writes the events of one or more streams to path '''
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt')
+        self.file.write(json.dumps({'version': VERSION,
+                                    'start': time.time()}) + '\n')
+        self.start = time.monotonic()
+        self.count = 0
+
+    def record(self, stream, subject, event, kwargs):
+        self.file.write(json.dumps(
+            [round(time.monotonic() - self.start, 4), stream, subject,
+             event, kwargs], separators=(',', ':')) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+class RecordingDispatcher(qubesadmin.events.EventsDispatcher):
+    ''' Records every event of its stream instead of handling it '''
+
+    def __init__(self, app, recorder, api_method='admin.Events'):
+        super().__init__(app, api_method=api_method)
+        self.recorder = recorder
+        self.stream = api_method
+
+    def handle(self, subject, event, **kwargs):
+        self.recorder.record(self.stream, subject, event, kwargs)
+
+
+def load(path):
+    ''' The records of the recording at path, oldest first '''
+    with gzip.open(path, 'rt') as recording:
+        header = json.loads(recording.readline())
+        if header.get('version') != VERSION:
+            raise ValueError(
+                'Unsupported recording version: {}'.format(
+                    header.get('version')))
+        return [Record(*json.loads(line)) for line in recording]
+
+
+async def replay(records, handlers, speed=1.0):
+    ''' Feed records to handlers, by stream name, as
+    ``handler(subject, event, **kwargs)``: usually the :meth:`handle` of a
+    dispatcher. Events are spaced as recorded, speed times faster, or sent
+    as fast as possible if speed is 0 (still letting the event loop run
+    between events, as when they come from qubesd). Events of streams
+    without a handler are skipped. Returns [(event, seconds taken by the
+    handler)]. '''
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    latencies = []
+    for record in records:
+        handler = handlers.get(record.stream)
+        if handler is None:
+            continue
+        delay = start + record.time / speed - loop.time() if speed else 0
+        await asyncio.sleep(max(0, delay))
+        handler_start = time.perf_counter()
+        handler(record.subject, record.event, **record.kwargs)
+        latencies.append(
+            (record.event, time.perf_counter() - handler_start))
+    return latencies
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Record the events of qubesd, to replay them later.")
+    parser.add_argument('output', metavar='FILE',
+                        help="recording to write (gzip-compressed)")
+    parser.add_argument('--duration', type=float, metavar='SECONDS',
+                        help="stop after that long (default: on Ctrl-C)")
+    parser.add_argument('--no-stats', action='store_true',
+                        help="do not record admin.vm.Stats")
+    args = parser.parse_args(args)
+
+    qapp = qubesadmin.Qubes()
+    recorder = EventRecorder(args.output)
+    streams = STREAMS[:1] if args.no_stats else STREAMS
+    tasks = [
+        asyncio.ensure_future(event_stream.listen_for_events(
+            RecordingDispatcher(qapp, recorder, api_method=stream)))
+        for stream in streams]
+
+    loop = asyncio.get_event_loop()
+    try:
+        done, _unused = loop.run_until_complete(asyncio.wait(
+            tasks, timeout=args.duration,
+            return_when=asyncio.FIRST_EXCEPTION))
+        for task in done:
+            task.result()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+    print('{} events recorded'.format(recorder.count), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=import-error
+''' Keeping the widgets' event streams alive. When qubesd (or qui-events)
+restarts, the stream is reconnected with backoff, and widgets resynchronize
+their state with what changed meanwhile, instead of exiting. '''
+
+import asyncio
+import logging
+
+import qubesadmin.exc
+
+# seconds before reconnecting, doubled after every short-lived connection
+RECONNECT_DELAY_MIN = 1.0
+RECONNECT_DELAY_MAX = 60.0
+
+# errors of the connection itself; any other exception comes from a handler
+CONNECTION_ERRORS = (OSError, EOFError,
+                     qubesadmin.exc.QubesDaemonCommunicationError)
+
+log = logging.getLogger('qui')
+
+
+async def listen_for_events(dispatcher, min_delay=RECONNECT_DELAY_MIN,
+                            max_delay=RECONNECT_DELAY_MAX):
+    ''' Handle the events of dispatcher forever, connecting again whenever
+    the connection is lost. The delay before connecting again doubles, up to
+    max_delay, while connections do not last longer than max_delay. '''
+    loop = asyncio.get_event_loop()
+    delay = min_delay
+    while True:
+        started = loop.time()
+        try:
+            await dispatcher.listen_for_events(reconnect=False)
+        except CONNECTION_ERRORS as ex:
+            log.warning('Connection to qubesd lost: %s', ex)
+        if loop.time() - started > max_delay:
+            delay = min_delay
+        log.warning('Reconnecting to qubesd in %.0f seconds', delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def on_reconnect(dispatcher, callback):
+    ''' Call callback() every time dispatcher is connected again. The events
+    missed in between are lost, so callback should read the live state and
+    apply the differences. The first connection is skipped: widgets read the
+    live state when they start. '''
+    connected = False
+
+    def connection_established(*_args, **_kwargs):
+        nonlocal connected
+        if connected:
+            callback()
+        connected = True
+
+    dispatcher.add_handler('connection-established', connection_established)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position,import-error
+''' Process-wide cache of icon pixbufs, shared by all qui widgets, so that
+an icon shown in many menu items is loaded from the theme only once. '''
+
+import collections
+import os
+
+import gi  # isort:skip
+gi.require_version('Gtk', '3.0')  # isort:skip
+from gi.repository import Gtk, GdkPixbuf, GLib  # isort:skip
+
+# pixbufs kept; label, device and action icons in two sizes fit easily
+MAX_ICONS = 128
+
+DEFAULT_SIZE = 16
+
+
+class PixbufCache:
+    ''' Pixbufs by (icon name or absolute file path, size), evicting the
+    least recently used ones. Emptied when the icon theme changes. Only to be
+    used from the Gtk main thread. '''
+
+    def __init__(self, max_icons=MAX_ICONS):
+        self.max_icons = max_icons
+        self.pixbufs = collections.OrderedDict()
+        self.theme = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_theme(self):
+        if self.theme is None:
+            self.theme = Gtk.IconTheme.get_default()
+            self.theme.connect('changed', self.invalidate)
+        return self.theme
+
+    def invalidate(self, *_args):
+        self.pixbufs.clear()
+        self.invalidations += 1
+
+    def get_pixbuf(self, name, size=DEFAULT_SIZE):
+        ''' Pixbuf of the icon name from the current theme, or of the image
+        file at name if it is an absolute path. Raises
+        :class:`GLib.Error` if it cannot be loaded. '''
+        key = (name, size)
+        try:
+            pixbuf = self.pixbufs[key]
+        except KeyError:
+            pass
+        else:
+            self.pixbufs.move_to_end(key)
+            self.hits += 1
+            return pixbuf
+
+        self.misses += 1
+        if os.path.isabs(name):
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(name, size, size)
+        else:
+            pixbuf = self.get_theme().load_icon(name, size, 0)
+
+        self.pixbufs[key] = pixbuf
+        if len(self.pixbufs) > self.max_icons:
+            self.pixbufs.popitem(last=False)
+            self.evictions += 1
+        return pixbuf
+
+    def get_image(self, name, size=DEFAULT_SIZE) -> Gtk.Image:
+        ''' New :class:`Gtk.Image` showing the cached pixbuf; a "missing
+        image" icon if the icon cannot be loaded. '''
+        try:
+            return Gtk.Image.new_from_pixbuf(self.get_pixbuf(name, size))
+        except GLib.Error:
+            return Gtk.Image.new_from_icon_name('image-missing',
+                                                Gtk.IconSize.MENU)
+
+    def stats(self):
+        return {'size': len(self.pixbufs),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+
+# the cache shared by the whole process
+CACHE = PixbufCache()
+
+
+def get_pixbuf(name, size=DEFAULT_SIZE):
+    return CACHE.get_pixbuf(name, size)
+
+
+def get_image(name, size=DEFAULT_SIZE) -> Gtk.Image:
+    return CACHE.get_image(name, size)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+''' Minimal inotify binding whose events are read directly from an asyncio
+event loop, without a separate notifier thread or per-event objects. '''
+
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+# the watch was removed, explicitly or because the file is gone
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# struct inotify_event, followed by len bytes of NUL-padded name
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                    use_errno=True)
+
+
+def _check(result):
+    if result < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
+
+
+class Inotify:
+    ''' An inotify instance registered with loop. For every event,
+    callback(watch_descriptor, mask, name) is called from the loop; name is
+    the name of the file within a watched directory, or None for events on
+    the watched path itself. '''
+
+    def __init__(self, loop, callback):
+        self.loop = loop
+        self.callback = callback
+        self.inotify_fd = _check(
+            _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self.loop.add_reader(self.inotify_fd, self.read_events)
+
+    def add_watch(self, path, mask):
+        ''' Watch path for events in mask. Returns the watch descriptor,
+        which is the same for every path of the same file. '''
+        return _check(_libc.inotify_add_watch(
+            self.inotify_fd, os.fsencode(path), ctypes.c_uint32(mask)))
+
+    def rm_watch(self, watch_descriptor):
+        ''' Stop watching; ignores watches already removed by the kernel. '''
+        try:
+            _check(_libc.inotify_rm_watch(self.inotify_fd, watch_descriptor))
+        except OSError:
+            pass
+
+    def read_events(self):
+        try:
+            data = os.read(self.inotify_fd, READ_SIZE)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _cookie, length = \
+                EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            self.callback(watch_descriptor, mask,
+                          os.fsdecode(name) if name else None)
+
+    def close(self):
+        self.loop.remove_reader(self.inotify_fd)
+        os.close(self.inotify_fd)
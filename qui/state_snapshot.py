@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position,import-error
+''' Snapshots of what the widgets show, saved periodically and when they are
+terminated, so that after a login or a restart a widget can be drawn at once
+from its snapshot while the live state is fetched from qubesd. '''
+
+import json
+import os
+import signal
+import time
+
+import gi  # isort:skip
+gi.require_version('Gtk', '3.0')  # isort:skip
+from gi.repository import GLib  # isort:skip
+
+SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'qui')
+
+# seconds between periodic saves
+SAVE_INTERVAL = 60
+
+# snapshots in another format are ignored
+VERSION = 1
+
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+# save functions of the snapshots to write on SIGTERM
+_SAVERS = []
+
+
+def get_boot_id(path=BOOT_ID_PATH):
+    try:
+        with open(path) as boot_id:
+            return boot_id.read().strip()
+    except OSError:
+        return None
+
+
+class StateSnapshot:
+    ''' The state of widget name, stored as JSON in directory. A missing or
+    damaged file means there is no snapshot. '''
+
+    def __init__(self, name, directory=SNAPSHOT_DIR,
+                 boot_id_path=BOOT_ID_PATH):
+        self.path = os.path.join(directory, name + '.json')
+        self.boot_id_path = boot_id_path
+
+    def load(self, any_boot=False):
+        ''' The saved state, or None if there is none. Unless any_boot, a
+        snapshot saved before the last boot is ignored too: the qubes
+        running then, and their devices, are gone. '''
+        try:
+            with open(self.path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(snapshot, dict) or \
+                snapshot.get('version') != VERSION:
+            return None
+        if not any_boot and \
+                snapshot.get('boot_id') != get_boot_id(self.boot_id_path):
+            return None
+        return snapshot.get('state')
+
+    def save(self, state):
+        data = json.dumps({'version': VERSION,
+                           'boot_id': get_boot_id(self.boot_id_path),
+                           'time': time.time(),
+                           'state': state})
+        temp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, 'w') as snapshot_file:
+                snapshot_file.write(data)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass  # the next start just waits for the live state
+
+
+def save_periodically(snapshot, get_state, interval=SAVE_INTERVAL):
+    ''' Save get_state() to snapshot every interval seconds, and when the
+    process gets SIGTERM (as from systemd) before it terminates. '''
+    def save():
+        snapshot.save(get_state())
+        return True
+
+    if not _SAVERS:
+        GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM,
+                             _save_all_and_terminate)
+    _SAVERS.append(save)
+    GLib.timeout_add_seconds(interval, save)
+
+
+def _save_all_and_terminate():
+    for save in _SAVERS:
+        save()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+    return False
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position,import-error
+''' Notifications to systemd from widgets run by qubes-widget@.service
+(Type=notify): readiness once the widget shows its initial state, watchdog
+keep-alives sent from the main loop, so that a widget stuck in a blocking
+call is restarted, and a status line for ``systemctl status``. Nothing is
+sent when not run by systemd. '''
+
+import os
+import time
+
+from systemd import daemon
+
+import gi  # isort:skip
+gi.require_version('Gtk', '3.0')  # isort:skip
+from gi.repository import GLib  # isort:skip
+
+# seconds between status updates, if the watchdog does not need more
+STATUS_INTERVAL = 10
+
+
+def get_watchdog_interval():
+    ''' Seconds between keep-alives the watchdog needs, or None. WATCHDOG_PID
+    is ignored: it is the pid of widget-wrapper, which runs the widget. '''
+    try:
+        return int(os.environ['WATCHDOG_USEC']) / 1000000 / 2
+    except (KeyError, ValueError):
+        return None
+
+
+class ServiceNotifier:
+    ''' Reports to systemd, once the main loop is idle (so after the idle
+    callbacks already added, which load the initial state of the widgets),
+    that the service is ready, and then keeps the watchdog alive and the
+    status up to date: get_status() followed by the rate of events received
+    by dispatchers. '''
+
+    def __init__(self, get_status=None, dispatchers=()):
+        self.get_status = get_status
+        self.events = 0
+        self.last_update = time.monotonic()
+        for dispatcher in dispatchers:
+            self.count_events(dispatcher)
+
+        self.watchdog_interval = get_watchdog_interval()
+        interval = STATUS_INTERVAL
+        if self.watchdog_interval:
+            interval = min(interval, self.watchdog_interval)
+        GLib.idle_add(self.ready)
+        GLib.timeout_add(int(interval * 1000), self.keep_alive)
+
+    def count_events(self, dispatcher):
+        # not a '*' handler, which would subscribe a dispatcher of
+        # qui-events to every event
+        handle = dispatcher.handle
+
+        def counting_handle(subject, event, **kwargs):
+            self.events += 1
+            return handle(subject, event, **kwargs)
+
+        dispatcher.handle = counting_handle
+
+    def status(self):
+        now = time.monotonic()
+        rate = self.events / max(now - self.last_update, 0.001)
+        self.events = 0
+        self.last_update = now
+        status = '{:.1f} events/s'.format(rate)
+        if self.get_status:
+            status = '{}, {}'.format(self.get_status(), status)
+        return status
+
+    def ready(self):
+        daemon.notify('READY=1\nSTATUS=' + self.status())
+        return False
+
+    def keep_alive(self):
+        message = 'STATUS=' + self.status()
+        if self.watchdog_interval:
+            message = 'WATCHDOG=1\n' + message
+        daemon.notify(message)
+        return True
+
+
+def start(get_status=None, dispatchers=()):
+    ''' Start notifying systemd if the process is run by it; returns the
+    :class:`ServiceNotifier`, or None '''
+    if not os.environ.get('NOTIFY_SOCKET'):
+        return None
+    return ServiceNotifier(get_status, dispatchers)
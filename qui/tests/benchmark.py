@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+# pylint: disable=wrong-import-position,import-error
+# pylint: disable=attribute-defined-outside-init
+''' Benchmarks of the widgets against the fake qubesd of
+:mod:`fake_qubesadmin`. They need Gtk (a display, e.g. Xvfb, and a session
+bus) but no dom0:
+
+    PYTHONPATH=. python3 qui/tests/benchmark.py \\
+        --domains 200 --devices 30 --latency 0.0005 --output results.json
+
+Every benchmark reports its duration, the qubesd calls made (in total and by
+method) and the peak of memory allocated by Python (measured in a second,
+separate run, as tracing allocations slows everything down). Event
+benchmarks report the handler latency of every event. The results are
+written as JSON, to compare runs and spot regressions.
+
+With --replay, a recording made with :mod:`qui.event_recording` is replayed
+instead, into the domains, devices and updates widgets sharing one stream
+as in qui-widgets; --speed 1 keeps the recorded pace, the default of 0
+sends the events as fast as possible. '''
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+import unittest.mock
+
+import gi  # isort:skip
+gi.require_version('Gtk', '3.0')  # isort:skip
+from gi.repository import GLib  # isort:skip
+
+import fake_qubesadmin
+from qui import event_recording
+from qui import state_snapshot
+from qui import updater
+from qui.tray import devices
+from qui.tray import disk_space
+from qui.tray import domains
+from qui.tray import updates
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def run_main_loop():
+    ''' Dispatch everything pending, including idle callbacks '''
+    context = GLib.MainContext.default()
+    while context.iteration(False):
+        pass
+
+
+class Benchmark:
+    ''' A benchmark with a fresh fake backend, made by setup and measured
+    in run; run may return a list of event latencies. '''
+
+    def __init__(self, config):
+        self.config = config
+        self.app = None
+
+    def new_app(self):
+        return fake_qubesadmin.FakeQubes(
+            domains=self.config.domains, devices=self.config.devices,
+            pools=self.config.pools, latency=self.config.latency)
+
+    def setup(self):
+        self.app = self.new_app()
+
+    def run(self):
+        raise NotImplementedError
+
+    def measure(self):
+        self.setup()
+        self.app.reset_calls()
+        start = time.perf_counter()
+        latencies = self.run()
+        result = {'seconds': time.perf_counter() - start,
+                  'qubesd_calls': sum(self.app.calls.values()),
+                  'calls_by_method': dict(self.app.calls)}
+        if latencies:
+            result['events'] = len(latencies)
+            result['event_latency'] = {
+                'mean': statistics.mean(latencies),
+                'median': statistics.median(latencies),
+                'p95': sorted(latencies)[int(len(latencies) * 0.95)],
+                'max': max(latencies)}
+            result['qubesd_calls_per_event'] = \
+                result['qubesd_calls'] / len(latencies)
+
+        if self.config.memory:
+            self.setup()
+            tracemalloc.start()
+            self.run()
+            result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return result
+
+
+def domain_cycle(app):
+    ''' A start and shutdown, with stats, of the AppVMs, as qubesd sends
+    them; yields (dispatcher name, subject, event, kwargs). '''
+    for domain in list(app.fake_domains.values()):
+        if domain.klass != 'AppVM' or domain.state != 'Halted':
+            continue
+        yield 'events', domain.name, 'domain-pre-start', {}
+        yield 'events', domain.name, 'domain-start', {'start_guid': 'True'}
+        yield 'stats', domain.name, 'vm-stats', \
+            {'memory_kb': '400000', 'cpu_usage': '12'}
+        yield 'events', domain.name, 'domain-pre-shutdown', {}
+        yield 'events', domain.name, 'domain-shutdown', {}
+
+
+@benchmark
+class DomainTrayStartup(Benchmark):
+    name = 'DomainTray.startup'
+
+    def setup(self):
+        super().setup()
+        self.dispatcher = fake_qubesadmin.FakeEventsDispatcher(self.app)
+        self.stats_dispatcher = fake_qubesadmin.FakeEventsDispatcher(
+            self.app, api_method='admin.vm.Stats')
+
+    def run(self):
+        self.tray = domains.DomainTray(
+            'org.qubes.qui.tray.Domains', self.app, self.dispatcher,
+            self.stats_dispatcher)
+        self.tray.run()
+
+
+@benchmark
+class DomainTrayEvents(DomainTrayStartup):
+    name = 'DomainTray.update_domain_item'
+
+    def setup(self):
+        super().setup()
+        super().run()
+
+    def run(self):
+        dispatchers = {'events': self.dispatcher,
+                       'stats': self.stats_dispatcher}
+        return [dispatchers[name].emit(subject, event, **kwargs)
+                for name, subject, event, kwargs in domain_cycle(self.app)]
+
+
+@benchmark
+class DevicesTrayStartup(Benchmark):
+    name = 'DevicesTray.startup'
+
+    def setup(self):
+        super().setup()
+        self.dispatcher = fake_qubesadmin.FakeEventsDispatcher(self.app)
+
+    def run(self):
+        self.tray = devices.DevicesTray(
+            'org.qubes.qui.tray.Devices', self.app, self.dispatcher)
+
+
+@benchmark
+class DevicesTrayEvents(DevicesTrayStartup):
+    name = 'DevicesTray.device_list_update'
+
+    def setup(self):
+        super().setup()
+        super().run()
+
+    def run(self):
+        backend = self.app.fake_domains['sys-usb']
+        usb_devices = backend.devices['usb']
+        latencies = []
+        for i in range(max(1, self.config.devices)):
+            ident = '3-{}'.format(i)
+            usb_devices[ident] = 'Hotplugged-device-{}'.format(i)
+            latencies.append(self.dispatcher.emit(
+                'sys-usb', 'device-list-change:usb'))
+            latencies.append(self.dispatcher.emit(
+                'sys-firewall', 'device-attach:usb',
+                device='sys-usb:' + ident, options='{}'))
+            latencies.append(self.dispatcher.emit(
+                'sys-firewall', 'device-detach:usb',
+                device='sys-usb:' + ident))
+            del usb_devices[ident]
+            latencies.append(self.dispatcher.emit(
+                'sys-usb', 'device-list-change:usb'))
+        return latencies
+
+
+@benchmark
+class UpdatesTrayStartup(Benchmark):
+    name = 'UpdatesTray.startup'
+
+    def setup(self):
+        super().setup()
+        self.dispatcher = fake_qubesadmin.FakeEventsDispatcher(self.app)
+
+    def run(self):
+        self.tray = updates.UpdatesTray(
+            'org.qubes.qui.tray.Updates', self.app, self.dispatcher)
+        self.tray.run()
+
+
+@benchmark
+class UpdatesTrayEvents(UpdatesTrayStartup):
+    name = 'UpdatesTray.feature_change'
+
+    def setup(self):
+        super().setup()
+        super().run()
+
+    def run(self):
+        latencies = []
+        for domain in self.app.fake_domains.values():
+            if domain.klass != 'TemplateVM':
+                continue
+            latencies.append(self.dispatcher.emit(
+                domain.name, 'domain-feature-set:updates-available',
+                feature='updates-available', value='1'))
+            latencies.append(self.dispatcher.emit(
+                domain.name, 'domain-feature-delete:updates-available',
+                feature='updates-available'))
+        return latencies
+
+
+@benchmark
+class PoolUsage(Benchmark):
+    name = 'PoolUsageData'
+
+    def run(self):
+        disk_space.PoolUsageData(self.app)
+
+
+@benchmark
+class UpdaterVMList(Benchmark):
+    name = 'QubesUpdater.populate_vm_list'
+
+    def setup(self):
+        super().setup()
+        self.updater = updater.QubesUpdater(self.app)
+        # the window without the list, which is what is measured
+        with unittest.mock.patch.object(self.updater, 'populate_vm_list'):
+            self.updater.perform_setup()
+
+    def run(self):
+        self.updater.populate_vm_list()
+        run_main_loop()
+
+
+class Replay(Benchmark):
+    ''' Not in :data:`BENCHMARKS`: only run with --replay '''
+    name = 'replay'
+
+    def setup(self):
+        super().setup()
+        self.records = event_recording.load(self.config.replay)
+        # the domains of the recording exist before it starts
+        for record in self.records:
+            if record.subject:
+                self.app.ensure_domain(record.subject)
+        self.dispatcher = fake_qubesadmin.FakeEventsDispatcher(self.app)
+        self.stats_dispatcher = fake_qubesadmin.FakeEventsDispatcher(
+            self.app, api_method='admin.vm.Stats')
+        self.trays = [
+            domains.DomainTray(
+                'org.qubes.qui.tray.Domains', self.app, self.dispatcher,
+                self.stats_dispatcher),
+            devices.DevicesTray(
+                'org.qubes.qui.tray.Devices', self.app, self.dispatcher),
+            updates.UpdatesTray(
+                'org.qubes.qui.tray.Updates', self.app, self.dispatcher)]
+        self.trays[0].run()
+        self.trays[2].run()
+        run_main_loop()
+
+    def run(self):
+        latencies = asyncio.get_event_loop().run_until_complete(
+            event_recording.replay(
+                self.records,
+                {'admin.Events': self.dispatcher.emit,
+                 'admin.vm.Stats': self.stats_dispatcher.emit},
+                speed=self.config.speed))
+        run_main_loop()
+        return [seconds for _event, seconds in latencies]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the widgets against a fake qubesd.")
+    parser.add_argument('--domains', type=int, default=100,
+                        help="number of domains, dom0 included")
+    parser.add_argument('--devices', type=int, default=20,
+                        help="number of devices exposed by sys-usb")
+    parser.add_argument('--pools', type=int, default=2,
+                        help="number of storage pools")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds every qubesd call takes")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="skip measuring memory")
+    parser.add_argument('--replay', metavar='RECORDING',
+                        help="replay this recording instead of running the "
+                             "benchmarks")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="replay speed, 0 for as fast as possible")
+    parser.add_argument('--output', metavar='FILE',
+                        help="write the results there instead of stdout")
+    parser.add_argument('benchmarks', metavar='BENCHMARK', nargs='*',
+                        help="benchmarks to run (default: all): {}".format(
+                            ', '.join(b.name for b in BENCHMARKS)))
+    config = parser.parse_args()
+
+    results = []
+    # the snapshots of the real widgets are neither used nor overwritten
+    with unittest.mock.patch.object(
+            state_snapshot.StateSnapshot, 'load', return_value=None), \
+            unittest.mock.patch.object(state_snapshot.StateSnapshot, 'save'):
+        for benchmark_class in [Replay] if config.replay else BENCHMARKS:
+            if config.benchmarks and not config.replay and \
+                    benchmark_class.name not in config.benchmarks:
+                continue
+            result = benchmark_class(config).measure()
+            result['name'] = benchmark_class.name
+            results.append(result)
+
+    output = json.dumps({
+        'config': {'domains': config.domains,
+                   'devices': config.devices,
+                   'pools': config.pools,
+                   'latency': config.latency,
+                   'replay': config.replay,
+                   'speed': config.speed},
+        'time': time.time(),
+        'results': results}, indent=2, sort_keys=True)
+    if config.output:
+        with open(config.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+# pylint: disable=import-error
+''' A fake qubesd, for benchmarks and load tests of the widgets without
+dom0. :class:`FakeQubes` is a real :class:`qubesadmin.app.QubesBase` whose
+Admin API calls are answered from a simulated system instead of qubesd, so
+that the widgets run the same qubesadmin code, and make the same calls, as
+on a real system. '''
+
+import asyncio
+import collections
+import time
+
+import qubesadmin.app
+import qubesadmin.events
+
+LABELS = ['red', 'orange', 'yellow', 'green', 'gray', 'blue', 'purple',
+          'black']
+TEMPLATES = ['fedora-30', 'debian-10']
+SERVICE_VMS = ['sys-net', 'sys-firewall', 'sys-usb']
+DEVICE_CLASSES = ['usb', 'block']
+
+GB = 1024 ** 3
+
+
+class FakeDomain:
+    ''' State of a simulated domain '''
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name, klass, state, label, properties=None,
+                 features=None):
+        self.name = name
+        self.klass = klass
+        self.state = state
+        self.properties = {'label': ('label', label)}
+        self.properties.update(properties or {})
+        self.features = dict(features or {})
+        # devclass -> {ident: description}
+        self.devices = {devclass: {} for devclass in DEVICE_CLASSES + ['mic']}
+        # devclass -> [(backend name, ident)]
+        self.attached = {devclass: [] for devclass in self.devices}
+
+
+class FakeQubes(qubesadmin.app.QubesBase):
+    ''' qubesadmin app of a simulated system with domains domains (dom0
+    included), devices devices exposed by sys-usb and pools storage pools.
+    Every call takes latency seconds and is counted in :attr:`calls` by
+    method. '''
+
+    def __init__(self, domains=20, devices=10, pools=2, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.fake_domains = collections.OrderedDict()
+        self.fake_pools = collections.OrderedDict()
+        self.populate(domains, devices, pools)
+
+    def populate(self, domains, devices, pools):
+        self.add_fake_domain(FakeDomain(
+            'dom0', 'AdminVM', 'Running', 'black',
+            {'updateable': ('bool', 'True')},
+            {'updates-available': '1'}))
+        for i, name in enumerate(TEMPLATES):
+            self.add_fake_domain(FakeDomain(
+                name, 'TemplateVM', 'Halted', 'black',
+                {'updateable': ('bool', 'True'),
+                 'netvm': ('vm', '')},
+                {'updates-available': '1'} if i % 2 == 0 else {}))
+        for name in SERVICE_VMS:
+            self.add_appvm(name, 'Running', 'red')
+        i = 0
+        while len(self.fake_domains) < domains:
+            self.add_appvm('vm-{:04d}'.format(i),
+                           'Running' if i % 2 == 0 else 'Halted',
+                           LABELS[i % len(LABELS)])
+            i += 1
+
+        backend = self.fake_domains['sys-usb']
+        frontends = [domain for domain in self.fake_domains.values()
+                     if domain.klass == 'AppVM' and domain.state == 'Running'
+                     and domain.name not in SERVICE_VMS]
+        for i in range(devices):
+            devclass = DEVICE_CLASSES[i % len(DEVICE_CLASSES)]
+            ident = '2-{}'.format(i) if devclass == 'usb' \
+                else 'sd{}'.format(chr(ord('a') + i % 26) + str(i))
+            backend.devices[devclass][ident] = '{}-device-{}'.format(
+                devclass.upper(), i)
+            if frontends and i % 4 == 0:
+                frontends[i % len(frontends)].attached[devclass].append(
+                    (backend.name, ident))
+        self.fake_domains['dom0'].devices['mic']['mic'] = 'Microphone'
+
+        for i in range(pools):
+            self.fake_pools['pool-{}'.format(i)] = {
+                'driver': 'lvm_thin',
+                'volume_group': 'qubes_dom0',
+                'thin_pool': 'pool{:02d}'.format(i),
+                'size': str(100 * GB),
+                'usage': str((50 + 45 * (i % 2)) * GB)}
+
+    def add_fake_domain(self, domain):
+        self.fake_domains[domain.name] = domain
+
+    def add_appvm(self, name, state, label):
+        self.add_fake_domain(FakeDomain(
+            name, 'AppVM', state, label,
+            {'template': ('vm', TEMPLATES[len(self.fake_domains) %
+                                          len(TEMPLATES)]),
+             'netvm': ('vm', '' if name == 'sys-net' else
+                       'sys-net' if name == 'sys-firewall' else
+                       'sys-firewall'),
+             'updateable': ('bool', 'False')}))
+
+    def apply_event(self, subject, event, **kwargs):
+        ''' Update the simulated system as the event says it changed, as
+        qubesd would have before sending it. Domains unknown to the
+        simulation are added as AppVMs. '''
+        # pylint: disable=too-many-branches
+        power_states = {'domain-pre-start': 'Transient',
+                        'domain-start': 'Running',
+                        'domain-start-failed': 'Halted',
+                        'domain-paused': 'Paused',
+                        'domain-unpaused': 'Running',
+                        'domain-pre-shutdown': 'Transient',
+                        'domain-shutdown': 'Halted',
+                        'domain-shutdown-failed': 'Running'}
+        if event == 'domain-add':
+            self.ensure_domain(kwargs['vm'])
+        elif event == 'domain-delete':
+            self.fake_domains.pop(kwargs['vm'], None)
+        if not subject:
+            return
+        domain = self.ensure_domain(subject)
+        if event in power_states:
+            domain.state = power_states[event]
+        elif event.startswith('domain-feature-set:'):
+            domain.features[kwargs['feature']] = kwargs['value']
+        elif event.startswith('domain-feature-delete:'):
+            domain.features.pop(kwargs['feature'], None)
+        elif event == 'property-set:label':
+            domain.properties['label'] = ('label', kwargs['newvalue'])
+        elif event.startswith('device-') and 'device' in kwargs:
+            devclass = event.partition(':')[2]
+            backend, _, ident = kwargs['device'].partition(':')
+            backend = self.ensure_domain(backend)
+            backend.devices.setdefault(devclass, {}).setdefault(
+                ident, 'Recorded-device-' + ident)
+            attached = domain.attached.setdefault(devclass, [])
+            if event.startswith('device-attach:'):
+                attached.append((backend.name, ident))
+            elif event.startswith('device-detach:') and \
+                    (backend.name, ident) in attached:
+                attached.remove((backend.name, ident))
+
+    def ensure_domain(self, name):
+        if name not in self.fake_domains:
+            self.add_appvm(name, 'Halted', LABELS[0])
+        return self.fake_domains[name]
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def qubesd_call(self, dest, method, arg=None, payload=None,
+                    payload_stream=None):
+        # pylint: disable=unused-argument
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._parse_qubesd_response(self.answer(dest, method, arg))
+
+    def run_service(self, dest, service, **kwargs):
+        raise NotImplementedError(
+            'the fake backend cannot run {} in {}'.format(service, dest))
+
+    def answer(self, dest, method, arg):
+        # pylint: disable=too-many-return-statements,too-many-branches
+        domain = self.fake_domains.get(dest)
+        if method == 'admin.vm.List':
+            domains = [domain] if domain else self.fake_domains.values()
+            return ok(''.join('{} class={} state={}\n'.format(
+                vm.name, vm.klass, vm.state) for vm in domains))
+        if method == 'admin.label.List':
+            return ok(''.join(label + '\n' for label in LABELS))
+        if method == 'admin.label.Get':
+            return ok('0x{:06x}'.format(LABELS.index(arg) * 0x111111))
+        if method == 'admin.label.Index':
+            return ok(str(LABELS.index(arg) + 1))
+        if method == 'admin.pool.List':
+            return ok(''.join(name + '\n' for name in self.fake_pools))
+        if method == 'admin.pool.Info':
+            return ok(''.join('{}={}\n'.format(key, value)
+                              for key, value in self.fake_pools[arg].items()))
+        if method == 'admin.pool.UsageDetails':
+            pool = self.fake_pools[arg]
+            return ok('data_size={}\ndata_usage={}\n'
+                      'metadata_size={}\nmetadata_usage={}\n'.format(
+                          pool['size'], pool['usage'], GB, GB // 10))
+        if domain is None:
+            return error('QubesVMNotFoundError', 'No such domain')
+
+        if method == 'admin.vm.CurrentState':
+            return ok('mem=0 mem_static_max=0 cputime=0 power_state={}'.format(
+                domain.state))
+        if method == 'admin.vm.property.Get':
+            if arg not in domain.properties:
+                return error('QubesNoSuchPropertyError', 'Invalid property')
+            prop_type, value = domain.properties[arg]
+            return ok('default=False type={} {}'.format(prop_type, value))
+        if method == 'admin.vm.feature.Get':
+            if arg not in domain.features:
+                return error('QubesFeatureNotFoundError', 'Feature not set')
+            return ok(domain.features[arg])
+        if method == 'admin.vm.volume.List':
+            return ok('root\nprivate\nvolatile\nkernel\n')
+        if method == 'admin.vm.volume.Info':
+            size = 2 * GB if arg == 'private' else 10 * GB
+            return ok('pool=pool-0\nvid=qubes_dom0/vm-{}-{}\nsize={}\n'
+                      'usage={}\nrw=True\nsource=\nsave_on_stop=True\n'
+                      'snap_on_start=False\nrevisions_to_keep=0\n'
+                      'is_outdated=False\n'.format(
+                          domain.name, arg, size, size // 4))
+        if method.startswith('admin.vm.device.'):
+            devclass, action = method.split('.')[3:5]
+            if action == 'Available':
+                return ok(''.join(
+                    '{} description={}\n'.format(ident, description)
+                    for ident, description
+                    in domain.devices[devclass].items()))
+            if action == 'List':
+                return ok(''.join(
+                    '{}+{} persistent=no\n'.format(backend, ident)
+                    for backend, ident in domain.attached[devclass]))
+        return error('QubesException', 'Not simulated: ' + method)
+
+
+def ok(response):
+    return b'0\x00' + response.encode()
+
+
+def error(exc_type, message):
+    return '2\x00{}\x00\x00{}\x00'.format(exc_type, message).encode()
+
+
+class FakeEventsDispatcher(qubesadmin.events.EventsDispatcher):
+    ''' Dispatcher with no connection to qubesd: events are injected with
+    :meth:`emit`, applied to the simulated system and then go through the
+    usual :meth:`handle`. '''
+
+    async def listen_for_events(self, vm=None, reconnect=True):
+        await asyncio.Future()  # forever
+
+    def emit(self, subject, event, **kwargs):
+        ''' Handle an event as received from qubesd (all arguments as
+        strings, subject '' for global events); returns the seconds taken
+        by the handlers. '''
+        self.app.apply_event(subject, event, **kwargs)
+        start = time.perf_counter()
+        self.handle(subject or None, event, **kwargs)
+        return time.perf_counter() - start
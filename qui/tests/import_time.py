@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+''' Import time of the gui_scripts entry points of setup.py, checked against
+a startup budget, in a fresh interpreter every time (python 3.7 or later,
+for -X importtime):
+
+    PYTHONPATH=. python3 qui/tests/import_time.py
+
+exits with 1 if an entry point takes longer than its budget to import. With
+--report, the modules taking the most time to import are listed for every
+entry point, to find what to defer. '''
+
+import argparse
+import ast
+import collections
+import os
+import subprocess
+import sys
+
+SETUP_PY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'setup.py')
+
+# seconds the module of an entry point may take to import; Gtk alone takes
+# most of it
+DEFAULT_BUDGET = 0.5
+BUDGETS = {
+    'qubes-update-gui': 0.6,
+}
+
+# how many times every entry point is imported; the fastest counts, the
+# others being slowed down by whatever else runs
+RUNS = 3
+
+ModuleTime = collections.namedtuple(
+    'ModuleTime', ['module', 'self_seconds', 'cumulative_seconds', 'depth'])
+
+
+def gui_scripts(setup_py=SETUP_PY):
+    ''' [(entry point name, module)] of the gui_scripts in setup_py '''
+    with open(setup_py) as setup_file:
+        tree = ast.parse(setup_file.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.keyword) and node.arg == 'entry_points':
+            entry_points = ast.literal_eval(node.value)
+            break
+    else:
+        raise ValueError('No entry_points in {}'.format(setup_py))
+    scripts = []
+    for entry_point in entry_points['gui_scripts']:
+        name, _, target = entry_point.partition('=')
+        scripts.append((name.strip(), target.split(':')[0].strip()))
+    return scripts
+
+
+def parse_importtime(output):
+    ''' [ModuleTime] from the -X importtime output (on stderr) '''
+    times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except (IndexError, ValueError):
+            continue  # the header
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append(ModuleTime(name.strip(), self_us / 1000000,
+                                cumulative_us / 1000000, depth))
+    return times
+
+
+def import_times(statement):
+    ''' [ModuleTime] of a fresh interpreter running statement '''
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=False)
+    if process.returncode != 0:
+        raise RuntimeError('{} failed:\n{}'.format(statement, process.stderr))
+    return parse_importtime(process.stderr)
+
+
+def measure(module, runs=RUNS):
+    ''' Seconds module takes to import, with the [ModuleTime] of that run;
+    the modules imported by the interpreter itself, before, do not
+    count. '''
+    startup = {time.module for time in import_times('pass')}
+    best = None
+    for _ in range(runs):
+        times = [time for time in import_times('import ' + module)
+                 if time.module not in startup]
+        seconds = sum(time.cumulative_seconds for time in times
+                      if time.depth == 0)
+        if best is None or seconds < best[0]:
+            best = (seconds, times)
+    return best
+
+
+def report(times, top):
+    lines = ['{:>9} {:>11}  module'.format('self ms', 'cumulative')]
+    for time in sorted(times, key=lambda time: time.self_seconds,
+                       reverse=True)[:top]:
+        lines.append('{:9.1f} {:11.1f}  {}{}'.format(
+            time.self_seconds * 1000, time.cumulative_seconds * 1000,
+            '  ' * time.depth, time.module))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the import time of the widgets against their "
+                    "startup budget.")
+    parser.add_argument('--report', action='store_true',
+                        help="list the modules taking the most time to "
+                             "import")
+    parser.add_argument('--top', type=int, default=25,
+                        help="number of modules listed by --report")
+    parser.add_argument('--runs', type=int, default=RUNS,
+                        help="imports of every entry point, the fastest "
+                             "counting")
+    parser.add_argument('entry_points', metavar='ENTRY_POINT', nargs='*',
+                        help="entry points to measure (default: all)")
+    args = parser.parse_args()
+
+    over_budget = False
+    for name, module in gui_scripts():
+        if args.entry_points and name not in args.entry_points:
+            continue
+        seconds, times = measure(module, args.runs)
+        budget = BUDGETS.get(name, DEFAULT_BUDGET)
+        over_budget = over_budget or seconds > budget
+        print('{:<18} {:6.3f}s (budget {:.3f}s){}'.format(
+            name, seconds, budget, '  OVER BUDGET' if seconds > budget else ''))
+        if args.report:
+            print(report(times, args.top) + '\n')
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
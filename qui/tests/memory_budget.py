@@ -0,0 +1,315 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+# pylint: disable=wrong-import-position,import-error
+''' Memory footprint of the widgets against the fake qubesd of
+:mod:`fake_qubesadmin`, checked against a budget. Like the benchmarks, it
+needs Gtk but no dom0:
+
+    PYTHONPATH=. python3 qui/tests/memory_budget.py --domains 300 \\
+        --devices 100 --output memory.json
+
+Every widget is started in a fresh process, as in dom0, once with few
+domains and devices, once with more domains and once with more devices:
+the differences in memory retained (traced by tracemalloc) give the cost of
+every domain and every device, overall and by the class of qui allocating
+it (``domains.DomainMenuItem``, ``devices.Device``,
+``decorators.DomainDecorator.VMName``...). A last, untraced run with many
+domains and devices gives the RSS of the widget. Only memory allocated by
+Python is traced: the part of Gtk widgets allocated by Gtk only shows in the
+RSS. Exits with 1 if a widget is over its budget. '''
+
+import argparse
+import ast
+import collections
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tracemalloc
+import unittest.mock
+
+import fake_qubesadmin
+from benchmark import run_main_loop
+from qui import state_snapshot
+from qui.tray import devices
+from qui.tray import disk_space
+from qui.tray import domains
+from qui.tray import updates
+
+KB = 1024
+MB = 1024 * KB
+
+# domains and devices of the runs the others are compared to
+BASE_DOMAINS = 20
+BASE_DEVICES = 5
+
+# frames kept for every allocation, enough to reach the qui code from Gtk
+# and qubesadmin
+TRACE_FRAMES = 30
+
+# bytes of Python memory per domain and per device, and RSS of the widget
+# with the domains and devices of the run
+BUDGETS = {
+    'domains': {'per_domain': 16 * KB, 'per_device': 1 * KB, 'rss': 90 * MB},
+    'devices': {'per_domain': 4 * KB, 'per_device': 8 * KB, 'rss': 80 * MB},
+    'updates': {'per_domain': 2 * KB, 'per_device': 1 * KB, 'rss': 70 * MB},
+    'disk-space': {'per_domain': 1 * KB, 'per_device': 1 * KB,
+                   'rss': 70 * MB},
+}
+
+
+def start_domains(app):
+    tray = domains.DomainTray(
+        'org.qubes.qui.tray.Domains', app,
+        fake_qubesadmin.FakeEventsDispatcher(app),
+        fake_qubesadmin.FakeEventsDispatcher(app, api_method='admin.vm.Stats'))
+    tray.run()
+    return tray
+
+
+def start_devices(app):
+    return devices.DevicesTray(
+        'org.qubes.qui.tray.Devices', app,
+        fake_qubesadmin.FakeEventsDispatcher(app))
+
+
+def start_updates(app):
+    tray = updates.UpdatesTray(
+        'org.qubes.qui.tray.Updates', app,
+        fake_qubesadmin.FakeEventsDispatcher(app))
+    tray.run()
+    return tray
+
+
+def start_disk_space(app):
+    with unittest.mock.patch.object(disk_space, 'Qubes', return_value=app):
+        return disk_space.DiskSpace()
+
+
+WIDGETS = collections.OrderedDict([
+    ('domains', start_domains),
+    ('devices', start_devices),
+    ('updates', start_updates),
+    ('disk-space', start_disk_space),
+])
+
+
+class Owners:
+    ''' Names the code allocating memory: the class (or function) of qui
+    nearest to the allocation in its traceback '''
+
+    def __init__(self):
+        self.qui_dir = os.path.dirname(os.path.abspath(devices.__file__))
+        self.qui_dir = os.path.dirname(self.qui_dir)
+        self.tests_dir = os.path.join(self.qui_dir, 'tests')
+        # filename -> [(first line, last line, name)], innermost last
+        self.definitions = {}
+
+    def get_definitions(self, filename):
+        if filename not in self.definitions:
+            module = os.path.splitext(os.path.basename(filename))[0]
+            with open(filename) as source:
+                tree = ast.parse(source.read())
+            definitions = []
+            self.add_definitions(tree, [module], False, definitions)
+            self.definitions[filename] = definitions
+        return self.definitions[filename]
+
+    def add_definitions(self, node, path, in_function, definitions):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.ClassDef) and not in_function:
+                child_path, child_in_function = path + [child.name], False
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) \
+                    and not in_function:
+                # methods belong to their class
+                child_path = path if len(path) > 1 else path + [child.name]
+                child_in_function = True
+            else:
+                self.add_definitions(child, path, in_function, definitions)
+                continue
+            last_line = max(getattr(descendant, 'lineno', 0)
+                            for descendant in ast.walk(child))
+            definitions.append(
+                (child.lineno, last_line, '.'.join(child_path)))
+            self.add_definitions(child, child_path, child_in_function,
+                                 definitions)
+
+    def owner(self, traceback):
+        for frame in reversed(list(traceback)):
+            filename = os.path.abspath(frame.filename)
+            if not filename.startswith(self.qui_dir + os.sep) or \
+                    filename.startswith(self.tests_dir + os.sep):
+                continue
+            name = os.path.splitext(os.path.basename(filename))[0]
+            for first, last, definition in self.get_definitions(filename):
+                if first <= frame.lineno <= last:
+                    name = definition
+            return name
+        return 'other'
+
+
+def get_rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def measure(widget, domain_count, device_count, trace):
+    ''' Memory retained by widget started against domain_count domains and
+    device_count devices: RSS, and if trace, Python memory, overall and by
+    owner '''
+    app = fake_qubesadmin.FakeQubes(domains=domain_count,
+                                    devices=device_count)
+    gc.collect()
+    if trace:
+        tracemalloc.start(TRACE_FRAMES)
+        before = tracemalloc.take_snapshot()
+    started = WIDGETS[widget](app)
+    run_main_loop()
+    gc.collect()
+    result = {'rss_bytes': get_rss()}
+    if trace:
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        ignored = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        by_owner = collections.Counter()
+        owners = Owners()
+        for diff in after.filter_traces(ignored).compare_to(
+                before.filter_traces(ignored), 'traceback'):
+            by_owner[owners.owner(diff.traceback)] += diff.size_diff
+        result['python_bytes'] = sum(by_owner.values())
+        result['by_owner'] = dict(by_owner)
+    del started
+    return result
+
+
+def run_child(widget, domain_count, device_count, trace):
+    args = [sys.executable, os.path.abspath(__file__), '--child', widget,
+            '--domains', str(domain_count), '--devices', str(device_count)]
+    if not trace:
+        args.append('--no-trace')
+    process = subprocess.run(args, stdout=subprocess.PIPE, check=True,
+                             universal_newlines=True)
+    # the result is the last line, after anything the widget printed
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def per_item(result, base, count):
+    ''' Python memory of result more than of base, for each of count more
+    domains or devices '''
+    owners = set(result['by_owner']) | set(base['by_owner'])
+    by_owner = {
+        owner: (result['by_owner'].get(owner, 0) -
+                base['by_owner'].get(owner, 0)) / count
+        for owner in owners}
+    return {
+        'bytes': (result['python_bytes'] - base['python_bytes']) / count,
+        'by_owner': collections.OrderedDict(sorted(
+            ((owner, size) for owner, size in by_owner.items()
+             if abs(size) >= 1),
+            key=lambda item: -item[1]))}
+
+
+def profile(widget, config):
+    base = run_child(widget, BASE_DOMAINS, BASE_DEVICES, True)
+    more_domains = run_child(widget, config.domains, BASE_DEVICES, True)
+    more_devices = run_child(widget, BASE_DOMAINS, config.devices, True)
+    untraced = run_child(widget, config.domains, config.devices, False)
+
+    result = {
+        'name': widget,
+        'per_domain': per_item(more_domains, base,
+                               config.domains - BASE_DOMAINS),
+        'per_device': per_item(more_devices, base,
+                               config.devices - BASE_DEVICES),
+        'rss_bytes': untraced['rss_bytes']}
+
+    budget = dict(BUDGETS[widget])
+    for key in budget:
+        if getattr(config, 'max_' + key) is not None:
+            budget[key] = getattr(config, 'max_' + key)
+    result['budget'] = budget
+    result['over_budget'] = [
+        key for key, measured in [
+            ('per_domain', result['per_domain']['bytes']),
+            ('per_device', result['per_device']['bytes']),
+            ('rss', result['rss_bytes'])]
+        if measured > budget[key]]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the memory footprint of the widgets against "
+                    "their budget.")
+    parser.add_argument('--domains', type=int, default=200,
+                        help="number of domains, dom0 included")
+    parser.add_argument('--devices', type=int, default=50,
+                        help="number of devices exposed by sys-usb")
+    parser.add_argument('--max-per-domain', type=int, metavar='BYTES',
+                        help="budget of every widget for a domain")
+    parser.add_argument('--max-per-device', type=int, metavar='BYTES',
+                        help="budget of every widget for a device")
+    parser.add_argument('--max-rss', type=int, metavar='BYTES',
+                        help="RSS budget of every widget")
+    parser.add_argument('--output', metavar='FILE',
+                        help="write the results there instead of stdout")
+    parser.add_argument('--child', choices=list(WIDGETS),
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--no-trace', dest='trace', action='store_false',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('widgets', metavar='WIDGET', nargs='*',
+                        help="widgets to profile (default: all): {}".format(
+                            ', '.join(WIDGETS)))
+    config = parser.parse_args()
+
+    if config.child:
+        # the snapshots of the real widgets are neither used nor overwritten
+        with unittest.mock.patch.object(
+                state_snapshot.StateSnapshot, 'load', return_value=None), \
+                unittest.mock.patch.object(
+                    state_snapshot.StateSnapshot, 'save'):
+            print(json.dumps(measure(config.child, config.domains,
+                                     config.devices, config.trace)))
+        return 0
+
+    if config.domains <= BASE_DOMAINS or config.devices <= BASE_DEVICES:
+        parser.error('--domains and --devices must be more than {} and '
+                     '{}'.format(BASE_DOMAINS, BASE_DEVICES))
+
+    results = [profile(widget, config) for widget in WIDGETS
+               if not config.widgets or widget in config.widgets]
+    output = json.dumps({
+        'config': {'domains': config.domains, 'devices': config.devices},
+        'results': results}, indent=2)
+    if config.output:
+        with open(config.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    for result in results:
+        for key in result['over_budget']:
+            print('{} is over its {} budget'.format(result['name'], key),
+                  file=sys.stderr)
+    return 1 if any(result['over_budget'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import os
+import tempfile
+import unittest
+from qui import clipboard_history
+
+
+class ClipboardHistoryTest(unittest.TestCase):
+
+    def test_00_states(self):
+        history = clipboard_history.ClipboardHistory()
+        history.record_copy('work', 10, 'aa')
+        history.record_copy('work', 10, 'aa')  # same transfer reported again
+        history.record_paste()
+        history.record_copy('personal', 20, 'bb')
+        history.record_copy('dom0', 30, 'cc')
+
+        self.assertEqual(
+            [(t.source, t.state) for t in history.recent(10)],
+            [('dom0', 'copied'), ('personal', 'wiped'), ('work', 'pasted')])
+
+    def test_01_bounded(self):
+        history = clipboard_history.ClipboardHistory(max_entries=3)
+        for i in range(10):
+            history.record_copy('vm{}'.format(i), i, str(i))
+
+        self.assertEqual([t.source for t in history.recent(10)],
+                         ['vm9', 'vm8', 'vm7'])
+
+    def test_02_journal(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal')
+            history = clipboard_history.ClipboardHistory(path)
+            history.record_copy('work', 10, 'aa')
+            history.record_paste()
+            history.record_copy('personal', 20, 'bb')
+
+            restored = clipboard_history.ClipboardHistory(path)
+            self.assertEqual(list(restored.entries), list(history.entries))
+
+    def test_03_hash_file(self):
+        with tempfile.NamedTemporaryFile() as contents:
+            contents.write(b'clipboard')
+            contents.flush()
+            self.assertEqual(
+                clipboard_history.hash_file(contents.name),
+                'a78c94675455b6203686c7f220c225c9'
+                '0d386a52a623c547bfce8bbbac94c31c')
+
+if __name__ == "__main__":
+    unittest.main()
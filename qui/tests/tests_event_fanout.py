@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+import unittest.mock
+import qubesadmin.events
+from qui import event_fanout
+
+
+class EventFanoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmpdir.name, 'events.sock')
+
+        self.fanout = event_fanout.FanoutDispatcher(unittest.mock.Mock())
+        self.server = self.loop.run_until_complete(asyncio.start_unix_server(
+            self.fanout.serve_client, self.socket_path))
+
+        self.handled = []
+        self.local = event_fanout.LocalEventsDispatcher(
+            unittest.mock.Mock(), socket_path=self.socket_path)
+        self.local.handle = lambda *args, **kwargs: \
+            self.handled.append((args, kwargs))
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        self.tmpdir.cleanup()
+
+    def run_loop(self):
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+
+    def connect(self, *patterns):
+        for pattern in patterns:
+            self.local.add_handler(pattern, lambda *args, **kwargs: None)
+        listener = asyncio.ensure_future(
+            self.local.listen_for_events(reconnect=False))
+        self.run_loop()
+        return listener
+
+    def disconnect(self, listener):
+        self.run_loop()
+        listener.cancel()
+        self.run_loop()
+
+    def test_00_filtered_events(self):
+        listener = self.connect('domain-start', 'device-*')
+        self.fanout.handle('work', 'domain-start', start_guid='True')
+        self.fanout.handle('work', 'domain-feature-set:internal')
+        self.fanout.handle('', 'device-attach:usb', device='sys-usb:2-1')
+        self.disconnect(listener)
+
+        self.assertEqual(self.handled, [
+            ((None, 'connection-established'), {}),
+            (('work', 'domain-start'), {'start_guid': 'True'}),
+            ((None, 'device-attach:usb'), {'device': 'sys-usb:2-1'})])
+
+    def test_01_subscription_update(self):
+        listener = self.connect('domain-start')
+        self.local.add_handler('domain-feature-set:*', lambda *args: None)
+        self.run_loop()
+        self.fanout.handle('work', 'domain-feature-set:internal')
+        self.disconnect(listener)
+
+        self.assertEqual(self.handled, [
+            ((None, 'connection-established'), {}),
+            (('work', 'domain-feature-set:internal'), {})])
+
+    def test_02_disconnect(self):
+        listener = self.connect('*')
+        self.assertEqual(len(self.fanout.subscribers), 1)
+        for subscriber in self.fanout.subscribers:
+            subscriber.writer.close()
+        self.run_loop()
+
+        self.assertTrue(listener.done())
+        self.assertFalse(self.fanout.subscribers)
+
+    def test_03_fanout_running(self):
+        self.assertTrue(event_fanout.fanout_running(self.socket_path))
+        self.assertFalse(event_fanout.fanout_running(
+            os.path.join(self.tmpdir.name, 'missing.sock')))
+
+    def listen_direct(self):
+        direct = []
+
+        async def listen_for_events(dispatcher, vm=None, reconnect=True):
+            direct.append((dispatcher, vm, reconnect))
+
+        with unittest.mock.patch.object(
+                qubesadmin.events.EventsDispatcher, 'listen_for_events',
+                listen_for_events):
+            self.loop.run_until_complete(
+                self.local.listen_for_events(reconnect=False))
+        return direct
+
+    def test_04_fallback_without_socket(self):
+        self.local.socket_path = os.path.join(self.tmpdir.name, 'missing')
+        with self.assertLogs('qui-events', 'WARNING'):
+            self.assertEqual(self.listen_direct(), [])
+        self.assertTrue(self.local.direct)
+        self.assertEqual(self.listen_direct(), [(self.local, None, False)])
+
+    def test_05_fallback_connection_refused(self):
+        # a socket left behind by a qui-events that was killed
+        self.local.socket_path = os.path.join(self.tmpdir.name, 'stale')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(stale.close)
+        stale.bind(self.local.socket_path)
+        for _ in range(event_fanout.MAX_REFUSED_CONNECTIONS - 1):
+            self.assertEqual(self.listen_direct(), [])
+            self.assertFalse(self.local.direct)
+        with self.assertLogs('qui-events', 'WARNING'):
+            self.assertEqual(self.listen_direct(), [])
+        self.assertEqual(self.listen_direct(), [(self.local, None, False)])
+
+    def test_06_back_to_fanout(self):
+        self.local.direct = True
+        listener = self.connect('domain-start')
+        self.fanout.handle('work', 'domain-start')
+        self.disconnect(listener)
+
+        self.assertFalse(self.local.direct)
+        self.assertEqual(self.handled, [
+            ((None, 'connection-established'), {}),
+            (('work', 'domain-start'), {})])
+
+    def test_07_cache_events(self):
+        listener = self.connect('device-*')
+        self.fanout.handle('work', 'property-set:label', name='label')
+        self.fanout.handle('work', 'domain-shutdown')
+        self.fanout.handle(None, 'domain-add', vm='personal')
+        self.disconnect(listener)
+
+        self.assertEqual(self.handled, [
+            ((None, 'connection-established'), {}),
+            (('work', 'property-set:label'), {'name': 'label'}),
+            (('work', 'domain-shutdown'), {}),
+            ((None, 'domain-add'), {'vm': 'personal'})])
+
+
+if __name__ == "__main__":
+    unittest.main()
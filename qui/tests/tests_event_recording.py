@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import asyncio
+import gzip
+import os
+import tempfile
+import unittest
+import unittest.mock
+from qui import event_recording
+
+
+class EventRecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'storm.json.gz')
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmpdir.cleanup()
+
+    def record(self, events):
+        recorder = event_recording.EventRecorder(self.path)
+        with unittest.mock.patch('time.monotonic') as monotonic:
+            monotonic.return_value = recorder.start
+            for seconds, stream, subject, event, kwargs in events:
+                monotonic.return_value = recorder.start + seconds
+                recorder.record(stream, subject, event, kwargs)
+        recorder.close()
+
+    def test_00_round_trip(self):
+        self.record([
+            (0, 'admin.Events', 'work', 'domain-pre-start', {}),
+            (0.5, 'admin.vm.Stats', 'work', 'vm-stats',
+             {'memory_kb': '400000', 'cpu_usage': '3'}),
+            (1.25, 'admin.Events', None, 'domain-add', {'vm': 'disp1'})])
+
+        self.assertEqual(event_recording.load(self.path), [
+            (0, 'admin.Events', 'work', 'domain-pre-start', {}),
+            (0.5, 'admin.vm.Stats', 'work', 'vm-stats',
+             {'memory_kb': '400000', 'cpu_usage': '3'}),
+            (1.25, 'admin.Events', None, 'domain-add', {'vm': 'disp1'})])
+
+    def test_01_unsupported_version(self):
+        with gzip.open(self.path, 'wt') as recording:
+            recording.write('{"version": 1000}\n')
+        with self.assertRaises(ValueError):
+            event_recording.load(self.path)
+
+    def test_02_replay(self):
+        records = [
+            event_recording.Record(0, 'admin.Events', 'work',
+                                   'domain-start', {'start_guid': 'True'}),
+            event_recording.Record(0.02, 'admin.vm.Stats', 'work',
+                                   'vm-stats', {'cpu_usage': '3'}),
+            event_recording.Record(0.04, 'admin.Events', 'work',
+                                   'domain-shutdown', {})]
+        received = []
+
+        def handler(subject, event, **kwargs):
+            received.append((self.loop.time() - start, subject, event,
+                             kwargs))
+
+        start = self.loop.time()
+        latencies = self.loop.run_until_complete(event_recording.replay(
+            records, {'admin.Events': handler}, speed=2))
+
+        self.assertEqual([event for event, _seconds in latencies],
+                         ['domain-start', 'domain-shutdown'])
+        self.assertEqual([event[1:] for event in received], [
+            ('work', 'domain-start', {'start_guid': 'True'}),
+            ('work', 'domain-shutdown', {})])
+        self.assertGreaterEqual(received[1][0], 0.02)
+
+    def test_03_replay_as_fast_as_possible(self):
+        records = [event_recording.Record(3600 * i, 'admin.Events', 'work',
+                                          'domain-paused', {})
+                   for i in range(3)]
+        handler = unittest.mock.Mock()
+
+        latencies = self.loop.run_until_complete(asyncio.wait_for(
+            event_recording.replay(records, {'admin.Events': handler},
+                                   speed=0), 5))
+
+        self.assertEqual(len(latencies), 3)
+        self.assertEqual(handler.call_count, 3)
+        handler.assert_called_with('work', 'domain-paused')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import asyncio
+import unittest
+import unittest.mock
+from qui import event_stream
+
+
+class FakeDispatcher:
+    def __init__(self, connections):
+        # for every connection: the seconds it lasts, or an exception
+        self.connections = list(connections)
+        self.handlers = {}
+
+    def add_handler(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def handle(self, event):
+        for handler in self.handlers.get(event, []):
+            handler(None, event)
+
+    async def listen_for_events(self, reconnect=True):
+        assert not reconnect
+        if not self.connections:
+            raise asyncio.CancelledError
+        connection = self.connections.pop(0)
+        if isinstance(connection, Exception):
+            raise connection
+        self.handle('connection-established')
+        await asyncio.sleep(connection)
+
+
+class EventStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.delays = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def listen(self, dispatcher):
+        real_sleep = asyncio.sleep
+
+        async def sleep(delay):
+            if delay in (0.02, 0.04, 0.08, 0.1):
+                self.delays.append(delay)
+                delay = 0
+            await real_sleep(delay)
+
+        with unittest.mock.patch('asyncio.sleep', sleep):
+            with self.assertRaises(asyncio.CancelledError):
+                self.loop.run_until_complete(event_stream.listen_for_events(
+                    dispatcher, min_delay=0.02, max_delay=0.1))
+
+    def test_00_backoff(self):
+        self.listen(FakeDispatcher([ConnectionRefusedError()] * 5))
+        self.assertEqual(self.delays, [0.02, 0.04, 0.08, 0.1, 0.1])
+
+    def test_01_backoff_reset(self):
+        self.listen(FakeDispatcher(
+            [ConnectionRefusedError(), ConnectionRefusedError(), 0.15,
+             ConnectionRefusedError()]))
+        self.assertEqual(self.delays, [0.02, 0.04, 0.02, 0.04])
+
+    def test_02_handler_error(self):
+        with self.assertRaises(KeyError):
+            self.loop.run_until_complete(event_stream.listen_for_events(
+                FakeDispatcher([KeyError()])))
+
+    def test_03_on_reconnect(self):
+        dispatcher = FakeDispatcher([])
+        resyncs = []
+        event_stream.on_reconnect(dispatcher, lambda: resyncs.append(True))
+        dispatcher.handle('connection-established')
+        self.assertEqual(resyncs, [])
+        dispatcher.handle('connection-established')
+        dispatcher.handle('connection-established')
+        self.assertEqual(resyncs, [True, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
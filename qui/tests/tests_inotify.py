@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import asyncio
+import os
+import tempfile
+import unittest
+from qui import inotify
+
+
+class InotifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.events = []
+        self.inotify = inotify.Inotify(
+            self.loop, lambda *event: self.events.append(event))
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'source')
+
+    def tearDown(self):
+        self.inotify.close()
+        self.loop.close()
+        self.tmpdir.cleanup()
+
+    def run_loop(self):
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+
+    def test_00_directory_events(self):
+        watch_descriptor = self.inotify.add_watch(
+            self.tmpdir.name, inotify.IN_CREATE | inotify.IN_DELETE)
+        with open(self.path, 'w'):
+            pass
+        os.unlink(self.path)
+        self.run_loop()
+
+        self.assertEqual(self.events, [
+            (watch_descriptor, inotify.IN_CREATE, 'source'),
+            (watch_descriptor, inotify.IN_DELETE, 'source')])
+
+    def test_01_only_masked_events(self):
+        with open(self.path, 'w'):
+            pass
+        watch_descriptor = self.inotify.add_watch(
+            self.path, inotify.IN_CLOSE_WRITE)
+        with open(self.path) as source:
+            source.read()
+        with open(self.path, 'w') as source:
+            source.write('work')
+        self.inotify.rm_watch(watch_descriptor)
+        self.run_loop()
+
+        self.assertEqual(self.events, [
+            (watch_descriptor, inotify.IN_CLOSE_WRITE, None),
+            (watch_descriptor, inotify.IN_IGNORED, None)])
+
+    def test_02_watched_file_deleted(self):
+        with open(self.path, 'w'):
+            pass
+        watch_descriptor = self.inotify.add_watch(
+            self.path, inotify.IN_CLOSE_WRITE | inotify.IN_DELETE_SELF)
+        os.unlink(self.path)
+        self.run_loop()
+
+        self.assertEqual(self.events, [
+            (watch_descriptor, inotify.IN_DELETE_SELF, None),
+            (watch_descriptor, inotify.IN_IGNORED, None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
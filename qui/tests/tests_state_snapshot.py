@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import json
+import os
+import tempfile
+import unittest
+from qui import state_snapshot
+
+
+class StateSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.boot_id_path = os.path.join(self.tmpdir.name, 'boot_id')
+        self.set_boot_id('first')
+        self.snapshot = state_snapshot.StateSnapshot(
+            'domains', directory=os.path.join(self.tmpdir.name, 'qui'),
+            boot_id_path=self.boot_id_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def set_boot_id(self, boot_id):
+        with open(self.boot_id_path, 'w') as boot_id_file:
+            boot_id_file.write(boot_id + '\n')
+
+    def test_00_save_load(self):
+        self.assertIsNone(self.snapshot.load())
+        state = {'domains': [{'name': 'work', 'state': 'Running'}]}
+        self.snapshot.save(state)
+        self.assertEqual(self.snapshot.load(), state)
+
+    def test_01_previous_boot(self):
+        self.snapshot.save({'warning': []})
+        self.set_boot_id('second')
+        self.assertIsNone(self.snapshot.load())
+        self.assertEqual(self.snapshot.load(any_boot=True), {'warning': []})
+
+    def test_02_unusable(self):
+        os.makedirs(os.path.dirname(self.snapshot.path))
+        with open(self.snapshot.path, 'w') as snapshot_file:
+            snapshot_file.write('{"version": 1, "state"')
+        self.assertIsNone(self.snapshot.load())
+
+        with open(self.snapshot.path, 'w') as snapshot_file:
+            json.dump({'version': state_snapshot.VERSION + 1,
+                       'boot_id': 'first', 'state': {}}, snapshot_file)
+        self.assertIsNone(self.snapshot.load())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import unittest
+import unittest.mock
+from qui import systemd_notify
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.handled = []
+
+    def handle(self, subject, event, **kwargs):
+        self.handled.append((subject, event, kwargs))
+
+
+class SystemdNotifyTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = unittest.mock.patch.object(systemd_notify, 'daemon')
+        self.daemon = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = unittest.mock.patch.object(systemd_notify, 'GLib')
+        self.glib = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_00_not_run_by_systemd(self):
+        with unittest.mock.patch.dict('os.environ', {}, clear=True):
+            self.assertIsNone(systemd_notify.start())
+        self.glib.idle_add.assert_not_called()
+
+    def test_01_ready_and_status(self):
+        dispatcher = FakeDispatcher()
+        with unittest.mock.patch.dict(
+                'os.environ', {'NOTIFY_SOCKET': '/run/notify'}, clear=True):
+            notifier = systemd_notify.start(lambda: '3 qubes', [dispatcher])
+        self.glib.idle_add.assert_called_once_with(notifier.ready)
+        self.glib.timeout_add.assert_called_once_with(
+            systemd_notify.STATUS_INTERVAL * 1000, notifier.keep_alive)
+
+        dispatcher.handle('work', 'domain-start', start_guid='True')
+        self.assertEqual(dispatcher.handled,
+                         [('work', 'domain-start', {'start_guid': 'True'})])
+        self.assertEqual(notifier.events, 1)
+
+        self.assertFalse(notifier.ready())
+        message = self.daemon.notify.call_args[0][0]
+        self.assertTrue(message.startswith('READY=1\nSTATUS=3 qubes, '))
+        self.assertTrue(message.endswith(' events/s'))
+        self.assertEqual(notifier.events, 0)
+
+        self.assertTrue(notifier.keep_alive())
+        self.assertTrue(self.daemon.notify.call_args[0][0].startswith(
+            'STATUS=3 qubes, 0.0 events/s'))
+
+    def test_02_watchdog(self):
+        with unittest.mock.patch.dict(
+                'os.environ', {'NOTIFY_SOCKET': '/run/notify',
+                               'WATCHDOG_USEC': '4000000'}, clear=True):
+            notifier = systemd_notify.start()
+        self.glib.timeout_add.assert_called_once_with(
+            2000, notifier.keep_alive)
+        notifier.keep_alive()
+        self.assertTrue(self.daemon.notify.call_args[0][0].startswith(
+            'WATCHDOG=1\nSTATUS=0.0 events/s'))
+
+
+if __name__ == "__main__":
+    unittest.main()
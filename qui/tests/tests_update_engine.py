@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+from qubesadmin import exc
+from qui import update_engine
+
+
+class MockVM:
+    def __init__(self, name, klass='AppVM', updateable=False,
+                 updates_available=False, provides_network=False,
+                 netvm=None, running=False, log=None):
+        self.name = name
+        self.klass = klass
+        self.updateable = updateable
+        self.features = {'updates-available': updates_available}
+        self.provides_network = provides_network
+        self.netvm = netvm
+        self.running = running
+        # shared by the qubes of a test, to check the order of the calls
+        self.log = log if log is not None else []
+        self.start_error = None
+
+    def is_running(self):
+        return self.running
+
+    def get_power_state(self):
+        return 'Running' if self.running else 'Halted'
+
+    def shutdown(self, force=False):
+        self.log.append(('shutdown', self.name, force))
+        self.running = False
+
+    def start(self):
+        self.log.append(('start', self.name))
+        if self.start_error:
+            raise exc.QubesException(self.start_error)
+        self.running = True
+
+    def __str__(self):
+        return self.name
+
+
+class RecordingListener(update_engine.UpdateListener):
+    ''' Records the progress reported, from any thread '''
+
+    def __init__(self):
+        self.engine = None
+        self.lines = []
+        self.finished = {}
+        self.restart_statuses = []
+        self.lock = threading.Lock()
+
+    def vm_update_output(self, vm, line, log_offset):
+        self.lines.append(line)
+
+    def vm_update_finished(self, vm, status, exit_status, duration,
+                           error=None):
+        with self.lock:
+            self.finished[vm.name] = (status, exit_status, error)
+
+    def vm_restart_status(self, vm, status, error=None):
+        with self.lock:
+            self.restart_statuses.append((vm.name, status, error))
+
+
+class CancellingListener(RecordingListener):
+    ''' Cancels the update at its first line of output '''
+
+    def vm_update_output(self, vm, line, log_offset):
+        super().vm_update_output(vm, line, log_offset)
+        self.engine.cancel()
+
+
+class FakeUpdates:
+    ''' Stands for run_update_command: records the qubes updated and how
+    many ran at once, and returns the exit status given by qube name '''
+
+    def __init__(self, exit_statuses=None, errors=None):
+        self.exit_statuses = exit_statuses or {}
+        self.errors = errors or {}
+        self.started = []
+        self.running = set()
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, vm, command):
+        with self.lock:
+            self.started.append(vm.name)
+            self.running.add(vm.name)
+            self.max_running = max(self.max_running, len(self.running))
+        try:
+            time.sleep(0.05)
+            if vm.name in self.errors:
+                raise self.errors[vm.name]
+            return self.exit_statuses.get(vm.name, 0)
+        finally:
+            with self.lock:
+                self.running.discard(vm.name)
+
+
+class UpdateEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.listener = CancellingListener()
+        self.engine = update_engine.UpdateEngine(
+            self.listener, max_concurrency=2, log_dir=self.tmpdir.name,
+            history_path=os.path.join(self.tmpdir.name, 'history.json'))
+        self.listener.engine = self.engine
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_00_process_tree(self):
+        proc = subprocess.Popen(['sh', '-c', 'sleep 5 & wait'])
+        try:
+            deadline = time.monotonic() + 5
+            while len(update_engine.get_process_tree(proc.pid)) < 2:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+            self.assertEqual(update_engine.get_process_tree(proc.pid)[0],
+                             proc.pid)
+        finally:
+            update_engine.signal_process_tree(proc.pid, signal.SIGKILL)
+            proc.wait()
+
+    def test_01_cancel_without_waiting_for_output(self):
+        # the command exits on cancel, but a descendant left running keeps
+        # the output open
+        def signal_command_only(pid, signum):
+            os.kill(pid, signum)
+
+        command = ['sh', '-c', 'sleep 3 & echo started; wait']
+        start_time = time.monotonic()
+        with unittest.mock.patch.object(update_engine, 'signal_process_tree',
+                                        signal_command_only):
+            exit_status = self.engine.run_update_command(
+                MockVM('test-vm'), command)
+        self.assertLess(time.monotonic() - start_time, 2)
+        self.assertEqual(exit_status, -signal.SIGTERM)
+        self.assertEqual(self.listener.lines, ['started\n'])
+
+    def test_02_cancelled_before_start(self):
+        self.engine.cancel()
+        self.assertIsNone(self.engine.run_update_command(
+            MockVM('test-vm'), ['true']))
+
+    def test_03_kill_after_timeout(self):
+        # ignores SIGTERM, as do its descendants
+        command = ['sh', '-c', 'trap "" TERM; echo started; sleep 5']
+        start_time = time.monotonic()
+        with unittest.mock.patch.object(
+                update_engine, 'CANCEL_KILL_TIMEOUT', 0.2):
+            exit_status = self.engine.run_update_command(
+                MockVM('test-vm'), command)
+        self.assertLess(time.monotonic() - start_time, 3)
+        self.assertEqual(exit_status, -signal.SIGKILL)
+
+    def test_04_output_and_log(self):
+        vm = MockVM('test-vm')
+        listener = RecordingListener()
+        self.engine.listener = listener
+        exit_status = self.engine.run_update_command(
+            vm, ['printf', '\\033[32mok\\033[0m\\nlast'])
+        self.assertEqual(exit_status, 0)
+        self.assertEqual(listener.lines, ['ok\n', 'last\n'])
+        with open(self.engine.log_files['test-vm']) as log:
+            self.assertEqual(log.read(), 'ok\nlast\n')
+
+
+class UpdateStagesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.listener = RecordingListener()
+        self.engine = update_engine.UpdateEngine(
+            self.listener, max_concurrency=2, log_dir=self.tmpdir.name,
+            history_path=os.path.join(self.tmpdir.name, 'history.json'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def update(self, vms, fake_updates):
+        with unittest.mock.patch.object(
+                self.engine, 'run_update_command', fake_updates):
+            return self.engine.update(vms)
+
+    def test_00_update_targets(self):
+        qapp = unittest.mock.Mock()
+        qapp.domains = [
+            MockVM('dom0', klass='AdminVM'),
+            MockVM('fedora-30', klass='TemplateVM', updateable=True,
+                   updates_available=True),
+            MockVM('work'),
+            MockVM('standalone', klass='StandaloneVM', updateable=True)]
+
+        self.assertEqual(
+            [(vm.name, updates_available) for vm, updates_available in
+             update_engine.get_update_targets(qapp)],
+            [('dom0', False), ('fedora-30', True), ('standalone', False)])
+
+    def test_01_update_command(self):
+        self.assertIn('--dom0-only', update_engine.get_update_command(
+            MockVM('dom0', klass='AdminVM')))
+        self.assertIn('--targets=work', update_engine.get_update_command(
+            MockVM('work')))
+
+    def test_02_stages(self):
+        vms = [MockVM('sys-net', provides_network=True),
+               MockVM('sys-firewall', provides_network=True),
+               MockVM('work'), MockVM('personal'), MockVM('vault'),
+               MockVM('fedora-30', klass='TemplateVM'),
+               MockVM('dom0', klass='AdminVM')]
+        fake_updates = FakeUpdates()
+
+        self.assertEqual(self.update(vms, fake_updates), ['success'] * 7)
+        self.assertEqual(fake_updates.started[0], 'dom0')
+        self.assertEqual(fake_updates.started[1], 'fedora-30')
+        self.assertEqual(set(fake_updates.started[1:5]),
+                         {'fedora-30', 'work', 'personal', 'vault'})
+        self.assertEqual(fake_updates.started[5:],
+                         ['sys-net', 'sys-firewall'])
+        self.assertEqual(fake_updates.max_running, 2)
+
+    def test_03_failures(self):
+        vms = [MockVM('work'), MockVM('personal'), MockVM('vault'),
+               MockVM('untrusted')]
+        fake_updates = FakeUpdates(
+            exit_statuses={'personal': 20},
+            errors={'vault': exc.QubesException('vault is gone'),
+                    'untrusted': OSError('no qubesctl')})
+
+        self.assertEqual(self.update(vms, fake_updates),
+                         ['success', 'failure', 'failure', 'failure'])
+        self.assertEqual(self.listener.finished, {
+            'work': ('success', 0, None),
+            'personal': ('failure', 20, 'qubesctl exited with code 20'),
+            'vault': ('failure', None, 'vault is gone'),
+            'untrusted': ('failure', None, 'no qubesctl')})
+        self.assertIsNotNone(self.engine.history.last_success('work'))
+        self.assertIsNone(self.engine.history.last_success('personal'))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmpdir.name, 'history.json')))
+
+    def test_04_cancelled(self):
+        vms = [MockVM('dom0', klass='AdminVM'), MockVM('work')]
+        fake_updates = FakeUpdates(exit_statuses={'dom0': -15})
+
+        def cancel_first(vm, command):
+            self.engine.cancel()
+            return fake_updates(vm, command)
+
+        self.assertEqual(self.update(vms, cancel_first),
+                         ['cancelled', 'cancelled'])
+        self.assertEqual(fake_updates.started, ['dom0'])
+        self.assertEqual(self.listener.finished, {
+            'dom0': ('cancelled', -15, None),
+            'work': ('cancelled', None, None)})
+
+    def test_05_running_template_shut_down(self):
+        log = []
+        template = MockVM('fedora-30', klass='TemplateVM', running=True,
+                          log=log)
+
+        self.assertEqual(self.update([template], FakeUpdates()),
+                         ['success'])
+        self.assertEqual(log, [('shutdown', 'fedora-30', False)])
+
+
+class RestartTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.listener = RecordingListener()
+        self.engine = update_engine.UpdateEngine(
+            self.listener, log_dir=self.tmpdir.name,
+            history_path=os.path.join(self.tmpdir.name, 'history.json'))
+        self.log = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_00_clients_before_netvm(self):
+        sys_net = MockVM('sys-net', provides_network=True, running=True,
+                         log=self.log)
+        work = MockVM('work', netvm=sys_net, running=True, log=self.log)
+
+        self.assertEqual(self.engine.restart([sys_net, work]),
+                         ['success', 'success'])
+        self.assertEqual(self.log, [
+            ('shutdown', 'work', False), ('shutdown', 'sys-net', True),
+            ('start', 'sys-net'), ('start', 'work')])
+        self.assertTrue(work.running and sys_net.running)
+        self.assertEqual(
+            [status for name, status, _error in self.listener.restart_statuses
+             if name == 'work'],
+            ['shutting-down', 'starting', 'success'])
+
+    def test_01_failures(self):
+        work = MockVM('work', running=True, log=self.log)
+        work.start_error = 'not enough memory'
+        stuck = MockVM('stuck', running=True, log=self.log)
+
+        def shutdown_vm(vm, force=False):
+            if vm is stuck:
+                raise exc.QubesException('Timed out')
+            vm.shutdown(force)
+
+        with unittest.mock.patch.object(update_engine, 'shutdown_vm',
+                                        shutdown_vm):
+            self.assertEqual(self.engine.restart([work, stuck]),
+                             ['failure', 'failure'])
+        # a qube which could not be shut down is not started again
+        self.assertEqual(self.log, [('shutdown', 'work', False),
+                                    ('start', 'work')])
+        self.assertIn(('work', 'failure', 'not enough memory'),
+                      self.listener.restart_statuses)
+        self.assertIn(('stuck', 'failure', 'Timed out'),
+                      self.listener.restart_statuses)
+
+
+if __name__ == "__main__":
+    unittest.main()
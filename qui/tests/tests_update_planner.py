@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import unittest
+from qui import update_planner
+
+
+class MockVM:
+    def __init__(self, name, klass='AppVM', template=None, netvm=None,
+                 provides_network=False, running=False):
+        self.name = name
+        self.klass = klass
+        self.template = template
+        self.netvm = netvm
+        self.provides_network = provides_network
+        self.running = running
+
+    def is_running(self):
+        return self.running
+
+    def __str__(self):
+        return self.name
+
+
+class UpdatePlannerTest(unittest.TestCase):
+
+    def test_00_update_stages(self):
+        dom0 = MockVM('dom0', klass='AdminVM')
+        fedora = MockVM('fedora', klass='TemplateVM')
+        debian = MockVM('debian', klass='TemplateVM')
+        standalone = MockVM('standalone', klass='StandaloneVM')
+        sys_net = MockVM('sys-net', klass='StandaloneVM',
+                         provides_network=True)
+
+        stages = update_planner.plan_update_stages(
+            [standalone, sys_net, fedora, dom0, debian], 4)
+
+        self.assertEqual(stages, [
+            ([dom0], 1),
+            ([fedora, debian, standalone], 4),
+            ([sys_net], 1)])
+
+    def test_01_update_stages_skip_empty(self):
+        fedora = MockVM('fedora', klass='TemplateVM')
+        self.assertEqual(update_planner.plan_update_stages([fedora], 2),
+                         [([fedora], 2)])
+
+    def test_02_outdated_vms(self):
+        fedora = MockVM('fedora', klass='TemplateVM')
+        debian = MockVM('debian', klass='TemplateVM')
+        work = MockVM('work', template=fedora, running=True)
+        halted = MockVM('halted', template=fedora)
+        other = MockVM('other', template=debian, running=True)
+        dvm = MockVM('disp1', klass='DispVM', template=work, running=True)
+
+        domains = [fedora, debian, work, halted, other, dvm]
+        updated = update_planner.get_updated_templates(
+            [fedora, debian], ['success', 'failure'])
+
+        self.assertEqual(updated, [fedora])
+        self.assertEqual(
+            update_planner.get_outdated_vms(domains, updated), [work])
+
+    def test_03_restart_clients_before_netvm(self):
+        sys_net = MockVM('sys-net', provides_network=True)
+        sys_firewall = MockVM('sys-firewall', netvm=sys_net,
+                              provides_network=True)
+        work = MockVM('work', netvm=sys_firewall)
+        personal = MockVM('personal', netvm=sys_firewall)
+        offline = MockVM('offline')
+
+        batches = update_planner.plan_restart(
+            [sys_net, work, sys_firewall, offline, personal])
+
+        self.assertEqual(batches, [
+            [work, offline, personal],
+            [sys_firewall],
+            [sys_net]])
+
+    def test_04_restart_netvm_outside_of_set(self):
+        sys_firewall = MockVM('sys-firewall', provides_network=True)
+        work = MockVM('work', netvm=sys_firewall)
+
+        self.assertEqual(update_planner.plan_restart([work]), [[work]])
+
+    def test_05_update_stages_longest_first(self):
+        fedora = MockVM('fedora', klass='TemplateVM')
+        debian = MockVM('debian', klass='TemplateVM')
+        standalone = MockVM('standalone', klass='StandaloneVM')
+        new = MockVM('new', klass='StandaloneVM')
+        estimates = {'fedora': 100, 'debian': 300, 'standalone': 150,
+                     'new': None}
+
+        # new is estimated at the mean of the others, 183.3
+        self.assertEqual(
+            update_planner.plan_update_stages(
+                [fedora, debian, standalone, new], 2, estimates),
+            [([debian, new, standalone, fedora], 2)])
+        # without concurrency there is nothing to gain
+        self.assertEqual(
+            update_planner.plan_update_stages(
+                [fedora, debian, standalone, new], 1, estimates),
+            [([fedora, debian, standalone, new], 1)])
+
+    def test_06_remaining_time(self):
+        dom0 = MockVM('dom0', klass='AdminVM')
+        fedora = MockVM('fedora', klass='TemplateVM')
+        debian = MockVM('debian', klass='TemplateVM')
+        standalone = MockVM('standalone', klass='StandaloneVM')
+        stages = [([dom0], 1), ([debian, fedora, standalone], 2)]
+        estimates = {'dom0': 60, 'debian': 200, 'fedora': 100,
+                     'standalone': None}
+
+        # standalone is estimated at the mean, 120, and starts once fedora
+        # is done
+        self.assertEqual(update_planner.estimate_remaining_time(
+            stages, estimates, {}, set(), 0), 60 + 100 + 120)
+        # dom0 done, debian and fedora running for 50 seconds
+        self.assertEqual(update_planner.estimate_remaining_time(
+            stages, estimates, {'debian': 0, 'fedora': 0}, {'dom0'}, 50),
+                         50 + 120)
+        # overdue updates are expected to finish any moment
+        self.assertEqual(update_planner.estimate_remaining_time(
+            stages, estimates, {'debian': 0, 'fedora': 0}, {'dom0'}, 150),
+                         120)
+        self.assertIsNone(update_planner.estimate_remaining_time(
+            stages, {'dom0': None}, {}, set(), 0))
+
+    def test_07_fresh(self):
+        self.assertFalse(update_planner.is_fresh(None, 1000, 100))
+        self.assertTrue(update_planner.is_fresh(950, 1000, 100))
+        self.assertFalse(update_planner.is_fresh(900, 1000, 100))
+        self.assertFalse(update_planner.is_fresh(950, 1000, 0))
+        # clock moved backwards
+        self.assertFalse(update_planner.is_fresh(1050, 1000, 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see <https://www.gnu.org/licenses/>.
+#
+import threading
+import traceback
+import unittest
+import unittest.mock
+from qui import watchdog
+
+
+def frame(filename, name):
+    return traceback.FrameSummary(filename, 1, name, lookup_line=False)
+
+
+class WatchdogTest(unittest.TestCase):
+
+    def test_00_find_handler(self):
+        stack = [
+            frame('/usr/bin/qui-domains', '<module>'),
+            frame('/usr/lib/python3/site-packages/qui/tray/domains.py',
+                  'main'),
+            frame('/usr/lib64/python3.8/asyncio/base_events.py',
+                  'run_until_complete'),
+            frame('/usr/lib/python3/site-packages/gbulb/glib_events.py',
+                  'run_forever'),
+            frame('/usr/lib/python3/site-packages/qubesadmin/events.py',
+                  'handle'),
+            frame('/usr/lib/python3/site-packages/qui/tray/domains.py',
+                  'update_domain_item'),
+            frame('/usr/lib/python3/site-packages/qubesadmin/app.py',
+                  'qubesd_call')]
+        self.assertEqual(watchdog.find_handler(stack).name,
+                         'update_domain_item')
+        self.assertEqual(watchdog.find_handler(stack[:-2]).name, 'handle')
+        self.assertIsNone(watchdog.find_handler(stack[:4]))
+        self.assertIsNone(watchdog.find_handler(stack[:2]))
+
+    def test_01_histogram(self):
+        histogram = watchdog.LagHistogram(buckets=(0.1, 1.0))
+        for lag in [0, 0.05, 0.1, 0.5, 3]:
+            histogram.add(lag)
+        self.assertEqual(histogram.counts, [3, 1, 1])
+        self.assertEqual(histogram.format(), '<=0.1s:3 <=1.0s:1 >1.0s:1')
+
+    def test_02_stall(self):
+        dog = watchdog.Watchdog(0.05, main_thread=threading.current_thread())
+        with self.assertLogs('qui.watchdog', 'WARNING') as logs:
+            dog.tick()
+            dog.check()
+            self.assertEqual(logs.output, [])
+            dog.last_tick -= 1
+            dog.check()
+            # reported once per stall
+            dog.check()
+            dog.tick()
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('Main loop stalled for more than', logs.output[0])
+        self.assertIn('test_02_stall', logs.output[0])
+        self.assertIn('Main loop resumed after', logs.output[1])
+        self.assertEqual(sum(dog.histogram.counts), 2)
+        self.assertEqual(dog.histogram.counts[-1], 0)
+        self.assertEqual(dog.histogram.counts[5], 1)
+
+    def test_03_environment(self):
+        with unittest.mock.patch.dict('os.environ', {}, clear=True):
+            self.assertIsNone(watchdog.start_from_environment())
+        with unittest.mock.patch.dict(
+                'os.environ', {'QUI_WATCHDOG': 'soon'}), \
+                self.assertLogs('qui.watchdog', 'WARNING'):
+            self.assertIsNone(watchdog.start_from_environment())
+        with unittest.mock.patch.dict(
+                'os.environ', {'QUI_WATCHDOG': '0.5'}), \
+                unittest.mock.patch.object(watchdog.Watchdog, 'start'):
+            self.assertEqual(watchdog.start_from_environment().threshold,
+                             0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,13 +7,18 @@ import traceback
 import gi
 gi.require_version('Gtk', '3.0')  # isort:skip
 gi.require_version('AppIndicator3', '0.1')  # isort:skip
-from gi.repository import Gtk, Gio  # isort:skip
+from gi.repository import Gtk, Gio, GLib  # isort:skip
 
 import qubesadmin
 import qubesadmin.events
 import qubesadmin.devices
 import qubesadmin.exc
 import qui.decorators
+import qui.event_fanout
+from qui import event_stream
+from qui import state_snapshot
+from qui import systemd_notify
+from qui import watchdog
 
 import gbulb
 gbulb.install()
@@ -135,6 +140,10 @@ class DeviceItem(Gtk.ImageMenuItem):
 
 
 class Device:
+    # one per device, kept for as long as the widget runs
+    __slots__ = ('dev_name', 'ident', 'description', 'devclass',
+                 'attachments', 'backend_domain', 'vm_icon')
+
     def __init__(self, dev):
         self.dev_name = str(dev)
         self.ident = dev.ident
@@ -144,6 +153,27 @@ class Device:
         self.backend_domain = dev.backend_domain.name
         self.vm_icon = dev.backend_domain.label.icon
 
+    @classmethod
+    def from_snapshot(cls, data):
+        device = cls.__new__(cls)
+        device.dev_name = data['name']
+        device.ident = data['ident']
+        device.description = data['description']
+        device.devclass = data['devclass']
+        device.attachments = set(data['attachments'])
+        device.backend_domain = data['backend_domain']
+        device.vm_icon = data['vm_icon']
+        return device
+
+    def snapshot(self):
+        return {'name': self.dev_name,
+                'ident': self.ident,
+                'description': self.description,
+                'devclass': self.devclass,
+                'attachments': sorted(self.attachments),
+                'backend_domain': self.backend_domain,
+                'vm_icon': self.vm_icon}
+
     def __str__(self):
         return self.dev_name
 
@@ -152,11 +182,26 @@ class Device:
 
 
 class VM:
+    # one per running domain
+    __slots__ = ('__hash', 'vm_name', 'icon')
+
     def __init__(self, vm):
         self.__hash = hash(vm)
         self.vm_name = vm.name
         self.icon = vm.label.icon
 
+    @classmethod
+    def from_snapshot(cls, data):
+        vm = cls.__new__(cls)
+        # domains hash like their names
+        vm.__hash = hash(data['name'])
+        vm.vm_name = data['name']
+        vm.icon = data['icon']
+        return vm
+
+    def snapshot(self):
+        return {'name': self.vm_name, 'icon': self.icon}
+
     def __str__(self):
         return self.vm_name
 
@@ -184,8 +229,17 @@ class DevicesTray(Gtk.Application):
         self.set_application_id(self.name)
         self.register()  # register Gtk Application
 
-        self.initialize_vm_data()
-        self.initialize_dev_data()
+        self.snapshot = state_snapshot.StateSnapshot('devices')
+        state = self.snapshot.load()
+        if state:
+            # the live state is read once the main loop is idle
+            self.restore_snapshot(state)
+            GLib.idle_add(self.reconcile)
+        else:
+            self.initialize_vm_data()
+            self.initialize_dev_data()
+        state_snapshot.save_periodically(self.snapshot,
+                                         self.get_snapshot_state)
 
         for devclass in DEV_TYPES:
             self.dispatcher.add_handler('device-attach:' + devclass,
@@ -201,6 +255,7 @@ class DevicesTray(Gtk.Application):
                                     self.vm_shutdown)
         self.dispatcher.add_handler('domain-start', self.vm_start)
         self.dispatcher.add_handler('property-set:label', self.on_label_changed)
+        event_stream.on_reconnect(self.dispatcher, self.resync)
 
         self.widget_icon = Gtk.StatusIcon()
         self.widget_icon.set_from_icon_name('media-removable')
@@ -240,27 +295,81 @@ class DevicesTray(Gtk.Application):
             del self.devices[dev_name]
 
     def initialize_vm_data(self):
-        for vm in self.qapp.domains:
-            if vm.klass != 'AdminVM' and vm.is_running():
-                self.vms.add(VM(vm))
+        self.vms = self.get_running_vms()
 
     def initialize_dev_data(self):
+        self.devices = self.get_devices()
+
+    def get_running_vms(self):
+        return {VM(vm) for vm in self.qapp.domains
+                if vm.klass != 'AdminVM' and vm.is_running()}
+
+    def get_devices(self):
+        devices = {}
 
         # list all devices
         for domain in self.qapp.domains:
             for devclass in DEV_TYPES:
                 for device in domain.devices[devclass]:
-                    self.devices[str(device)] = Device(device)
+                    devices[str(device)] = Device(device)
 
         # list existing device attachments
         for domain in self.qapp.domains:
             for devclass in DEV_TYPES:
                 for device in domain.devices[devclass].attached():
                     dev = str(device)
-                    if dev in self.devices:
+                    if dev in devices:
                         # occassionally ghost UnknownDevices appear when a
                         # device was removed but not detached from a VM
-                        self.devices[dev].attachments.add(domain.name)
+                        devices[dev].attachments.add(domain.name)
+        return devices
+
+    def resync(self):
+        ''' Apply the changes missed while disconnected from qubesd: started
+        and stopped qubes, added and removed devices, and attachments. '''
+        self.qapp.domains.refresh_cache(force=True)
+        running_vms = self.get_running_vms()
+        self.vms.intersection_update(running_vms)
+        self.vms.update(running_vms)
+
+        devices = self.get_devices()
+        for dev_name in [name for name in self.devices
+                         if name not in devices]:
+            self.emit_notification(
+                _("Device removed"),
+                _("Device {} is removed").format(
+                    self.devices[dev_name].description),
+                Gio.NotificationPriority.NORMAL)
+            del self.devices[dev_name]
+        for dev_name, dev in devices.items():
+            if dev_name in self.devices:
+                self.devices[dev_name].attachments = dev.attachments
+            else:
+                self.devices[dev_name] = dev
+                self.emit_notification(
+                    _("Device available"),
+                    _("Device {} is available").format(dev.description),
+                    Gio.NotificationPriority.NORMAL)
+
+    def service_status(self):
+        return '{} devices'.format(len(self.devices))
+
+    def restore_snapshot(self, state):
+        self.vms = {VM.from_snapshot(data) for data in state['vms']}
+        self.devices = {data['name']: Device.from_snapshot(data)
+                        for data in state['devices']}
+
+    def get_snapshot_state(self):
+        return {'vms': [vm.snapshot() for vm in self.vms],
+                'devices': [dev.snapshot() for dev in self.devices.values()]}
+
+    def reconcile(self):
+        ''' Replace the state restored from a snapshot with the live one,
+        which also has the changes received as events meanwhile. '''
+        self.initialize_vm_data()
+        self.initialize_dev_data()
+        self.snapshot.save(self.get_snapshot_state())
+        return False
 
     def device_attached(self, vm, _event, device, **_kwargs):
         if not vm.is_running() or device.devclass not in DEV_TYPES:
@@ -343,15 +452,18 @@ class DevicesTray(Gtk.Application):
 
 
 def main():
+    watchdog.start_from_environment()
     qapp = qubesadmin.Qubes()
-    dispatcher = qubesadmin.events.EventsDispatcher(qapp)
+    dispatcher = qui.event_fanout.get_events_dispatcher(qapp)
     app = DevicesTray(
         'org.qubes.qui.tray.Devices', qapp, dispatcher)
+    systemd_notify.start(app.service_status, [dispatcher])
 
     loop = asyncio.get_event_loop()
 
-    done, _unused = loop.run_until_complete(asyncio.ensure_future(
-        dispatcher.listen_for_events()))
+    done, _unused = loop.run_until_complete(asyncio.wait(
+        [asyncio.ensure_future(event_stream.listen_for_events(dispatcher))],
+        return_when=asyncio.FIRST_EXCEPTION))
 
     exit_code = 0
     for d in done:  # pylint: disable=invalid-name
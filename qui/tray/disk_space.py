@@ -5,6 +5,9 @@ gi.require_version('Gtk', '3.0')  # isort:skip
 from gi.repository import Gtk, GObject, Gio  # isort:skip
 from qubesadmin import Qubes
 from qubesadmin.utils import size_to_human
+from qui import state_snapshot
+from qui import systemd_notify
+from qui import watchdog
 
 import gettext
 t = gettext.translation("desktop-linux-manager", localedir="/usr/locales",
@@ -17,8 +20,9 @@ URGENT_WARN_LEVEL = 0.95
 
 
 class PoolUsageData:
-    def __init__(self):
-        self.qubes_app = Qubes()
+    def __init__(self, qubes_app=None):
+        # a new Qubes object by default, not to show cached pool usage
+        self.qubes_app = qubes_app or Qubes()
 
         self.pools = []
         self.total_size = 0
@@ -152,23 +156,43 @@ class DiskSpace(Gtk.Application):
 
         self.icon = Gtk.StatusIcon()
         self.icon.connect('button-press-event', self.make_menu)
-        self.refresh_icon()
+
+        # pool usage does not change with a reboot, so it is shown from a
+        # snapshot of any age until the pools are read
+        self.snapshot = state_snapshot.StateSnapshot('disk-space')
+        self.warning = []
+        state = self.snapshot.load(any_boot=True)
+        if state:
+            self.show_warning(state['warning'], notify=False)
+            GObject.idle_add(self.refresh_once)
+        else:
+            self.refresh_icon()
 
         GObject.timeout_add_seconds(120, self.refresh_icon)
+        state_snapshot.save_periodically(
+            self.snapshot, lambda: {'warning': self.warning})
+
+    def service_status(self):
+        return '{} pools low on space'.format(len(self.warning))
 
-        Gtk.main()
+    def refresh_once(self):
+        self.refresh_icon()
+        return False
 
     def refresh_icon(self):
         pool_data = PoolUsageData()
-        warning = pool_data.get_warning()
+        self.show_warning(pool_data.get_warning())
+        return True  # needed for Gtk to correctly loop the function
 
+    def show_warning(self, warning, notify=True):
+        self.warning = warning
         if warning:
             self.icon.set_from_icon_name("dialog-warning")
             text = _("<b>Qubes Disk Space Monitor</b>\nWARNING! You are "
                      "running out of disk space.") + ''.join(warning)
             self.icon.set_tooltip_markup(text)
 
-            if not self.warned:
+            if notify and not self.warned:
                 notification = Gio.Notification.new(_("Disk usage warning!"))
                 notification.set_priority(Gio.NotificationPriority.HIGH)
                 notification.set_body(
@@ -185,8 +209,6 @@ class DiskSpace(Gtk.Application):
                 _('<b>Qubes Disk Space Monitor</b>\nView free disk space.'))
             self.warned = False
 
-        return True  # needed for Gtk to correctly loop the function
-
     def make_menu(self, _unused, _event):
         pool_data = PoolUsageData()
 
@@ -254,8 +276,10 @@ class DiskSpace(Gtk.Application):
 
 
 def main():
+    watchdog.start_from_environment()
     app = DiskSpace()
-    app.run()
+    systemd_notify.start(app.service_status)
+    Gtk.main()
 
 
 if __name__ == '__main__':
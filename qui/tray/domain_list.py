@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position,import-error
+''' Alternative view of the domains tray for systems with many qubes: a
+popup window listing only the running qubes in a Gtk.TreeView, which renders
+just the visible rows from a list model, instead of a tree of widgets per
+qube kept in a menu. '''
+import bisect
+from html import escape
+
+from qubesadmin import exc
+
+import qui.decorators
+from qui.tray import domains
+from qui import icon_cache as pixbuf_cache
+import gi  # isort:skip
+gi.require_version('Gtk', '3.0')  # isort:skip
+from gi.repository import Gdk, GdkPixbuf, GLib, GObject  # isort:skip
+from gi.repository import Gtk, Pango  # isort:skip
+
+import gettext
+t = gettext.translation("desktop-linux-manager", localedir="/usr/locales",
+                        fallback=True)
+_ = t.gettext
+
+# list store columns
+COL_VM = 0
+COL_ICON = 1
+COL_MARKUP = 2
+COL_STATE = 3
+COL_STATUS_ICON = 4
+COL_MEMORY = 5
+COL_CPU = 6
+COL_BUSY = 7
+COL_PULSE = 8
+COL_OUTDATED = 9
+COL_UPDATES = 10
+
+# the list scrolls beyond this height
+MAX_LIST_HEIGHT = 600
+SPINNER_INTERVAL = 100
+
+STATE_COLORS = {'Paused': 'grey', 'Crashed': 'red', 'Transient': 'red'}
+
+
+def sort_key(vm):
+    return (vm.klass != 'AdminVM', vm.name)
+
+
+class DomainListWindow(Gtk.Window):
+    ''' Popup window listing the running qubes. Rows exist only for qubes
+    that are not halted; the action menu of a qube is built when it is
+    clicked and tooltips when they are shown. '''
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, app, icon_cache):
+        super().__init__(title=_("Qubes Domains"))
+        self.app = app
+        self.icon_cache = icon_cache
+
+        self.set_decorated(False)
+        self.set_resizable(False)
+        self.set_skip_taskbar_hint(True)
+        self.set_skip_pager_hint(True)
+        self.set_keep_above(True)
+        self.set_type_hint(Gdk.WindowTypeHint.POPUP_MENU)
+        self.connect('focus-out-event', self.focus_out)
+        self.connect('key-press-event', self.key_press)
+
+        self.store = Gtk.ListStore(
+            GObject.TYPE_PYOBJECT, GdkPixbuf.Pixbuf, str, str,
+            GdkPixbuf.Pixbuf, str, str, bool, int, bool, bool)
+        # row iterators by qube name; Gtk.ListStore iterators stay valid as
+        # long as their row exists
+        self.iters = {}
+        # sort keys of the rows, in the order of the rows
+        self.sort_keys = []
+        # tooltip markup by qube name, built when first shown
+        self.tooltips = {}
+
+        self.view = Gtk.TreeView(model=self.store)
+        self.view.set_fixed_height_mode(True)
+        self.view.set_has_tooltip(True)
+        self.view.connect('query-tooltip', self.query_tooltip)
+        self.view.connect('button-press-event', self.row_clicked)
+        self.add_columns()
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scrolled.set_max_content_height(MAX_LIST_HEIGHT)
+        scrolled.set_propagate_natural_height(True)
+        scrolled.add(self.view)
+
+        manager_button = Gtk.Button.new_with_label(_('Open Qube Manager'))
+        manager_button.set_image(Gtk.Image.new_from_icon_name(
+            'qubes-logo-icon', Gtk.IconSize.MENU))
+        manager_button.set_relief(Gtk.ReliefStyle.NONE)
+        manager_button.connect('clicked', domains.run_manager)
+
+        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        vbox.pack_start(scrolled, True, True, 0)
+        vbox.pack_start(Gtk.Separator(), False, False, 0)
+        vbox.pack_start(manager_button, False, False, 0)
+        self.add(vbox)
+        vbox.show_all()
+
+        self.action_menu = None
+        self.spinner_timer = None
+
+    def add_columns(self):
+        name_column = Gtk.TreeViewColumn(_('Qube'))
+        name_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        name_column.set_fixed_width(260)
+        name_column.set_expand(True)
+
+        icon = Gtk.CellRendererPixbuf()
+        name_column.pack_start(icon, False)
+        name_column.add_attribute(icon, 'pixbuf', COL_ICON)
+        name = Gtk.CellRendererText(ellipsize=Pango.EllipsizeMode.END)
+        name_column.pack_start(name, True)
+        name_column.add_attribute(name, 'markup', COL_MARKUP)
+        status_icon = Gtk.CellRendererPixbuf()
+        name_column.pack_start(status_icon, False)
+        name_column.add_attribute(status_icon, 'pixbuf', COL_STATUS_ICON)
+        spinner = Gtk.CellRendererSpinner()
+        name_column.pack_start(spinner, False)
+        name_column.add_attribute(spinner, 'active', COL_BUSY)
+        name_column.add_attribute(spinner, 'visible', COL_BUSY)
+        name_column.add_attribute(spinner, 'pulse', COL_PULSE)
+        self.view.append_column(name_column)
+
+        for title, column in ((_('RAM'), COL_MEMORY), (_('CPU'), COL_CPU)):
+            renderer = Gtk.CellRendererText(xalign=1)
+            view_column = Gtk.TreeViewColumn(title, renderer, text=column)
+            view_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            view_column.set_fixed_width(80)
+            view_column.set_alignment(1)
+            self.view.append_column(view_column)
+
+    def popup(self):
+        ''' Show the window next to the pointer, within its monitor. '''
+        display = Gdk.Display.get_default()
+        _screen, pointer_x, pointer_y = \
+            display.get_default_seat().get_pointer().get_position()
+        workarea = display.get_monitor_at_point(
+            pointer_x, pointer_y).get_workarea()
+
+        self.show()
+        width, height = self.get_size()
+        self.move(
+            max(workarea.x,
+                min(pointer_x, workarea.x + workarea.width - width)),
+            max(workarea.y,
+                min(pointer_y, workarea.y + workarea.height - height)))
+        self.present()
+
+        self.start_spinners()
+
+    def toggle(self):
+        if self.get_visible():
+            self.hide()
+        else:
+            self.popup()
+
+    def focus_out(self, *_args):
+        if self.action_menu is None or not self.action_menu.get_visible():
+            self.hide()
+
+    def key_press(self, _widget, event):
+        if event.keyval == Gdk.KEY_Escape:
+            self.hide()
+
+    def insert(self, vm):
+        updates_available = getattr(vm, 'updateable', False) and \
+            bool(vm.features.get('updates-available', False))
+
+        key = sort_key(vm)
+        position = bisect.bisect(self.sort_keys, key)
+        self.sort_keys.insert(position, key)
+        treeiter = self.store.insert(position)
+        self.store.set(treeiter, {
+            COL_VM: vm,
+            COL_ICON: self.get_label_icon(vm),
+            COL_MARKUP: escape(vm.name),
+            COL_STATE: '',
+            COL_MEMORY: '',
+            COL_CPU: '',
+            COL_BUSY: False,
+            COL_PULSE: 0,
+            COL_OUTDATED: False,
+            COL_UPDATES: updates_available})
+        self.iters[vm.name] = treeiter
+        self.update_status_icon(vm)
+        return treeiter
+
+    def remove(self, vm):
+        treeiter = self.iters.pop(vm.name, None)
+        if treeiter is not None:
+            del self.sort_keys[self.store.get_path(treeiter).get_indices()[0]]
+            self.store.remove(treeiter)
+        self.tooltips.pop(vm.name, None)
+
+    def has_vm(self, vm):
+        return getattr(vm, 'name', None) in self.iters
+
+    def get_vms(self):
+        return [row[COL_VM] for row in self.store]
+
+    def get_state(self, vm):
+        return self.store[self.iters[vm.name]][COL_STATE]
+
+    @staticmethod
+    def get_label_icon(vm):
+        try:
+            return pixbuf_cache.get_pixbuf(vm.label.icon)
+        except (GLib.Error, AttributeError):
+            return None
+
+    def set_state(self, vm, state):
+        ''' Show vm in state; halted qubes are removed from the list. '''
+        if state == 'Halted':
+            self.remove(vm)
+            return
+
+        treeiter = self.iters.get(vm.name)
+        if treeiter is None:
+            treeiter = self.insert(vm)
+
+        if state in STATE_COLORS:
+            markup = '<span color=\'{}\'>{}</span>'.format(
+                STATE_COLORS[state], escape(vm.name))
+        else:
+            markup = escape(vm.name)
+        busy = state not in ('Running', 'Paused') and \
+            getattr(vm, 'klass', None) != 'AdminVM'
+        self.store.set(treeiter, {COL_STATE: state,
+                                  COL_MARKUP: markup,
+                                  COL_BUSY: busy})
+        if busy:
+            self.start_spinners()
+
+    def update_stats(self, vm, memory_kb, cpu_usage):
+        treeiter = self.iters.get(vm.name)
+        if treeiter is None:
+            return
+        cpu_usage = int(cpu_usage)
+        self.store.set(treeiter, {
+            COL_MEMORY: '{} MB'.format(int(memory_kb) // 1024),
+            COL_CPU: '{:3d}%'.format(cpu_usage) if cpu_usage > 0 else '0%'})
+
+    def update_label(self, vm):
+        treeiter = self.iters.get(vm.name)
+        if treeiter is not None:
+            self.store.set_value(treeiter, COL_ICON, self.get_label_icon(vm))
+
+    def set_flag(self, vm, column, value):
+        treeiter = self.iters.get(vm.name)
+        if treeiter is not None:
+            self.store.set_value(treeiter, column, value)
+            self.update_status_icon(vm)
+            self.tooltips.pop(vm.name, None)
+
+    def update_status_icon(self, vm):
+        row = self.store[self.iters[vm.name]]
+        if row[COL_OUTDATED]:
+            icon = pixbuf_cache.get_pixbuf('outdated')
+        elif row[COL_UPDATES]:
+            icon = pixbuf_cache.get_pixbuf('software-update-available')
+        else:
+            icon = None
+        row[COL_STATUS_ICON] = icon
+
+    def invalidate_tooltips(self):
+        self.tooltips.clear()
+
+    def query_tooltip(self, view, tip_x, tip_y, keyboard_mode, tooltip):
+        found, _bin_x, _bin_y, model, path, treeiter = \
+            view.get_tooltip_context(tip_x, tip_y, keyboard_mode)
+        if not found:
+            return False
+        row = model[treeiter]
+        vm = row[COL_VM]
+        if vm.name not in self.tooltips:
+            template = getattr(vm, 'template', None)
+            netvm = getattr(vm, 'netvm', None)
+            is_admin = vm.klass == 'AdminVM'
+            self.tooltips[vm.name] = qui.decorators.domain_tooltip(
+                vm, str(template) if template else "None",
+                str(netvm) if netvm else "None",
+                0 if is_admin else qui.decorators.get_storage_usage(vm),
+                0 if is_admin else qui.decorators.get_storage_size(vm),
+                row[COL_OUTDATED], row[COL_UPDATES])
+        tooltip.set_markup(self.tooltips[vm.name])
+        view.set_tooltip_row(tooltip, path)
+        return True
+
+    def row_clicked(self, view, event):
+        result = view.get_path_at_pos(int(event.x), int(event.y))
+        if result is None:
+            return False
+        row = self.store[result[0]]
+        vm = row[COL_VM]
+        if vm.klass == 'AdminVM':
+            return False
+
+        self.action_menu = domains.domain_menu(
+            vm, self.app, self.icon_cache, row[COL_STATE])
+        self.action_menu.attach_to_widget(view)
+        self.action_menu.popup_at_pointer(event)
+        return True
+
+    def start_spinners(self):
+        if self.spinner_timer is None and self.get_visible():
+            self.spinner_timer = GLib.timeout_add(SPINNER_INTERVAL,
+                                                  self.pulse_spinners)
+
+    def pulse_spinners(self):
+        busy = False
+        for row in self.store:
+            if row[COL_BUSY]:
+                row[COL_PULSE] += 1
+                busy = True
+        if busy and self.get_visible():
+            return True
+        self.spinner_timer = None
+        return False
+
+
+class DomainListTray(domains.DomainTray):
+    ''' The domains tray showing :class:`DomainListWindow` instead of a
+    menu; memory use and popup time depend on the number of running qubes,
+    not of all qubes. '''
+
+    def __init__(self, app_name, qapp, dispatcher, stats_dispatcher):
+        super().__init__(app_name, qapp, dispatcher, stats_dispatcher)
+        self.window = DomainListWindow(self, self.icon_cache)
+        # filled from power states alone, the list needs no snapshot
+        self.snapshot = None
+
+    def service_status(self):
+        return '{} qubes'.format(len(self.window.get_vms()))
+
+    def show_menu(self, _unused, _event):
+        self.window.toggle()
+
+    def initialize_menu(self, vms=None):
+        for vm in self.qapp.domains if vms is None else vms:
+            self.add_domain_item(None, None, vm)
+
+    def add_domain_item(self, _submitter, event, vm, **_kwargs):
+        vm = self.qapp.domains[str(vm)]
+        if self.window.has_vm(vm):
+            return
+        state = domains.STATE_DICTIONARY.get(event) or vm.get_power_state()
+        self.window.set_state(vm, state)
+
+    def remove_domain_item(self, _submitter, _event, vm, **_kwargs):
+        self.window.remove(vm)
+
+    def update_domain_item(self, vm, event, **kwargs):
+        if event in domains.STATE_DICTIONARY:
+            state = domains.STATE_DICTIONARY[event]
+        else:
+            try:
+                state = vm.get_power_state()
+            except Exception:  # pylint: disable=broad-except
+                # it's a fragile DispVM
+                state = "Transient"
+
+        self.window.set_state(vm, state)
+
+        if event == 'domain-shutdown' and \
+                getattr(vm, 'klass', None) == 'TemplateVM':
+            for other_vm in self.window.get_vms():
+                if getattr(other_vm, 'template', None) == vm:
+                    self.window.set_flag(other_vm, COL_OUTDATED, True)
+
+    def update_stats(self, vm, _event, **kwargs):
+        self.window.update_stats(vm, kwargs['memory_kb'], kwargs['cpu_usage'])
+
+    def property_change(self, vm, event, *_args, **_kwargs):
+        if not self.window.has_vm(vm):
+            return
+        if event == 'property-set:label':
+            self.window.update_label(vm)
+        self.window.tooltips.pop(vm.name, None)
+
+    def feature_change(self, vm, *_args, **_kwargs):
+        if not self.window.has_vm(vm) or not getattr(vm, 'updateable', False):
+            return
+        self.window.set_flag(vm, COL_UPDATES, bool(
+            vm.features.get('updates-available', False)))
+
+    def resync(self):
+        self.qapp.domains.refresh_cache(force=True)
+        live_domains = {vm.name: vm for vm in self.qapp.domains}
+
+        for vm in self.window.get_vms():
+            if vm.name not in live_domains:
+                self.window.remove(vm)
+
+        for vm in live_domains.values():
+            try:
+                state = vm.get_power_state()
+            except exc.QubesException:
+                continue
+            if not self.window.has_vm(vm):
+                if state != 'Halted':
+                    self.window.set_state(vm, state)
+            elif self.window.get_state(vm) != state:
+                self.window.set_state(vm, state)
+        self.check_pause_notify(None, None)
+
+    def refresh_tooltips(self):
+        # storage use is read again when a tooltip is next shown
+        self.window.invalidate_tooltips()
+
+    def do_unpause_all(self, _vm, *_args, **_kwargs):
+        for vm in self.window.get_vms():
+            if self.window.get_state(vm) == 'Paused':
+                vm.unpause()
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=wrong-import-position,import-error
 ''' A menu listing domains '''
+import argparse
 import asyncio
 import subprocess
 import sys
@@ -14,6 +15,12 @@ import qubesadmin.events
 from qubesadmin import exc
 
 import qui.decorators
+import qui.event_fanout
+from qui import event_stream
+from qui import state_snapshot
+from qui import systemd_notify
+from qui import watchdog
+from qui import icon_cache as pixbuf_cache
 import gi  # isort:skip
 gi.require_version('Gtk', '3.0')  # isort:skip
 from gi.repository import Gio, Gtk, GObject  # isort:skip
@@ -38,6 +45,8 @@ STATE_DICTIONARY = {
 }
 
 class IconCache:
+    ''' Names of the action icons; the pixbufs themselves are kept in the
+    process-wide :mod:`qui.icon_cache` '''
     def __init__(self):
         self.icon_files = {
             'pause': 'media-playback-pause',
@@ -47,16 +56,9 @@ class IconCache:
             'shutdown': 'media-playback-stop',
             'unpause': 'media-playback-start'
         }
-        self.icons = {}
 
     def get_icon(self, icon_name):
-        if icon_name in self.icons.keys():
-            icon = self.icons[icon_name]
-        else:
-            icon = Gtk.IconTheme.get_default().load_icon(
-                self.icon_files[icon_name], 16, 0)
-            self.icons[icon_name] = icon
-        return icon
+        return pixbuf_cache.get_pixbuf(self.icon_files[icon_name])
 
 
 def show_error(title, text):
@@ -187,7 +189,7 @@ class LogItem(Gtk.ImageMenuItem):
         super().__init__()
         self.path = path
 
-        img = Gtk.Image.new_from_file(
+        img = pixbuf_cache.get_image(
             "/usr/share/icons/HighContrast/16x16/apps/logviewer.png")
 
         self.set_image(img)
@@ -272,6 +274,74 @@ class DebugMenu(Gtk.Menu):
         self.show_all()
 
 
+def domain_menu(vm, app, icon_cache, state):
+    ''' The actions menu for a domain in the given power state '''
+    if state == 'Running':
+        return StartedMenu(vm, app, icon_cache)
+    if state == 'Paused':
+        return PausedMenu(vm, icon_cache)
+    return DebugMenu(vm, icon_cache)
+
+
+class SnapshotDomain:
+    ''' Stand-in for a domain restored from a snapshot of the menu, until
+    the menu is rebuilt from the live domains. What the menu shows comes from
+    the snapshot, anything else (such as actions) from the live domain. Equal
+    to, and hashed like, the live domain of the same name. '''
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, qapp, data):
+        self.qapp = qapp
+        self.name = data['name']
+        self.klass = data['klass']
+        self.icon = data['icon']
+        self.power_state = data['state']
+        self.template = data['template']
+        self.netvm = data['netvm']
+        self.updateable = data['updates_available']
+        self.features = {'updates-available': data['updates_available']}
+        self.storage = data['storage']
+
+    def get_power_state(self):
+        return self.power_state
+
+    def is_running(self):
+        return self.power_state != 'Halted'
+
+    def get_disk_utilization(self):
+        return self.storage[0] * 1024 ** 3
+
+    @property
+    def volumes(self):
+        return {'private': PrivateVolume(self.storage[1] * 1024 ** 3)}
+
+    def __getattr__(self, name):
+        try:
+            vm = self.qapp.domains[self.name]
+        except KeyError:
+            # deleted since the snapshot was taken
+            raise AttributeError(name) from None
+        return getattr(vm, name)
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return self.name == str(other)
+
+    def __lt__(self, other):
+        return self.name < str(other)
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+class PrivateVolume:
+    # pylint: disable=too-few-public-methods
+    def __init__(self, size):
+        self.size = size
+
+
 def run_manager(_item):
     subprocess.Popen(['qubes-qube-manager'])
 
@@ -296,6 +366,8 @@ class DomainMenuItem(Gtk.ImageMenuItem):
         self.vm = vm
         self.app = app
         self.icon_cache = icon_cache
+        self.state = None
+        self.icon_name = None
         # set vm := None to make this output headers.
         # Header menu item reuses the domain menu item code
         #   so headers are aligned with the columns.
@@ -339,15 +411,23 @@ class DomainMenuItem(Gtk.ImageMenuItem):
             self.set_label_icon()
 
     def set_label_icon(self):
+        self.icon_name = self.decorator.icon_name()
         self.set_image(self.decorator.icon())
 
+    def snapshot(self):
+        ''' What the item shows, to restore it with :class:`SnapshotDomain`
+        '''
+        return {'name': self.vm.name,
+                'klass': getattr(self.vm, 'klass', None),
+                'icon': self.icon_name,
+                'state': self.state,
+                'template': self.name.template_name,
+                'netvm': self.name.netvm_name,
+                'updates_available': bool(self.name.updates_available),
+                'storage': [self.name.cur_storage, self.name.max_storage]}
+
     def _set_submenu(self, state):
-        if state == 'Running':
-            submenu = StartedMenu(self.vm, self.app, self.icon_cache)
-        elif state == 'Paused':
-            submenu = PausedMenu(self.vm, self.icon_cache)
-        else:
-            submenu = DebugMenu(self.vm, self.icon_cache)
+        submenu = domain_menu(self.vm, self.app, self.icon_cache, state)
         # This is a workaround for a bug in Gtk which occurs when a
         # submenu is replaced while it is open.
         # see https://gitlab.gnome.org/GNOME/gtk/issues/885
@@ -368,6 +448,7 @@ class DomainMenuItem(Gtk.ImageMenuItem):
         self.spinner.hide()
 
     def update_state(self, state):
+        self.state = state
         try:
             vm_klass = self.vm.klass
         except AttributeError:
@@ -427,6 +508,8 @@ class DomainTray(Gtk.Application):
 
         self.menu_items = {}
 
+        self.snapshot = state_snapshot.StateSnapshot('domains')
+
         self.unpause_all_action = Gio.SimpleAction.new('do-unpause-all', None)
         self.unpause_all_action.connect('activate', self.do_unpause_all)
         self.add_action(self.unpause_all_action)
@@ -479,6 +562,8 @@ class DomainTray(Gtk.Application):
 
         self.stats_dispatcher.add_handler('vm-stats', self.update_stats)
 
+        event_stream.on_reconnect(self.dispatcher, self.resync)
+
     def show_menu(self, _unused, _event):
         self.tray_menu.popup_at_pointer(None)  # None means current event
 
@@ -562,7 +647,8 @@ class DomainTray(Gtk.Application):
          are created in alphabetical order. Otherwise, this method will
          attempt to sort menu items correctly."""
         # check if it already exists
-        vm = self.qapp.domains[str(vm)]
+        if not isinstance(vm, SnapshotDomain):
+            vm = self.qapp.domains[str(vm)]
         if vm in self.menu_items:
             return
 
@@ -665,16 +751,54 @@ class DomainTray(Gtk.Application):
         self.menu_items[vm].update_stats(
             kwargs['memory_kb'], kwargs['cpu_usage'])
 
-    def initialize_menu(self):
+    def resync(self):
+        ''' Apply the changes missed while disconnected from qubesd: added
+        and removed domains, and changed power states. Items of domains that
+        did not change are left as they are. '''
+        self.qapp.domains.refresh_cache(force=True)
+        live_domains = {vm.name: vm for vm in self.qapp.domains}
+
+        for vm in list(self.menu_items):
+            if vm.name not in live_domains:
+                self.remove_domain_item(None, None, vm)
+
+        added = set()
+        for vm in live_domains.values():
+            if vm not in self.menu_items:
+                self.add_domain_item(None, 'domain-add', vm)
+                added.add(vm)
+
+        for vm, item in self.menu_items.items():
+            # items restored from a snapshot may still hold stand-ins
+            vm = live_domains[vm.name]
+            if vm.klass == 'AdminVM':
+                continue
+            try:
+                state = vm.get_power_state()
+            except exc.QubesException:
+                continue
+            if vm in added or state != item.state:
+                item.update_state(state)
+                if state == 'Halted':
+                    item.hide()
+                else:
+                    item.show_all()
+        self.check_pause_notify(None, None)
+
+    def initialize_menu(self, vms=None):
+        ''' Fill the menu with vms, by default all the live domains '''
+        if vms is None:
+            vms = list(self.qapp.domains)
+
         self.tray_menu.add(DomainMenuItem(None, self, self.icon_cache))
 
         # Add AdminVMS
-        for vm in sorted([vm for vm in self.qapp.domains
+        for vm in sorted([vm for vm in vms
                           if vm.klass == "AdminVM"]):
             self.add_domain_item(None, None, vm)
 
         # and the rest of them
-        for vm in sorted([vm for vm in self.qapp.domains
+        for vm in sorted([vm for vm in vms
                           if vm.klass != 'AdminVM']):
             self.add_domain_item(None, None, vm)
 
@@ -688,10 +812,42 @@ class DomainTray(Gtk.Application):
         self.tray_menu.add(Gtk.SeparatorMenuItem())
         self.tray_menu.add(QubesManagerItem())
 
+    def run(self):  # pylint: disable=arguments-differ
+        state = self.snapshot.load() if self.snapshot else None
+        if state:
+            # show what was running at once, and the live state once the
+            # main loop is idle
+            self.initialize_menu([SnapshotDomain(self.qapp, data)
+                                  for data in state['domains']])
+            GObject.idle_add(self.reconcile)
+        else:
+            self.initialize_menu()
+        if self.snapshot:
+            state_snapshot.save_periodically(
+                self.snapshot, self.get_snapshot_state)
+
         self.connect('shutdown', self._disconnect_signals)
 
-    def run(self):  # pylint: disable=arguments-differ
+    def reconcile(self):
+        ''' Rebuild the menu restored from a snapshot from the live
+        domains, dropping those removed since. Events received meanwhile
+        already updated the restored items, and are reflected in the live
+        state. '''
+        for item in self.tray_menu.get_children():
+            self.tray_menu.remove(item)
+        self.menu_items.clear()
         self.initialize_menu()
+        self.snapshot.save(self.get_snapshot_state())
+        return False
+
+    def service_status(self):
+        return '{} qubes'.format(len(self.menu_items))
+
+    def get_snapshot_state(self):
+        ''' The domains not halted, as shown in the menu '''
+        return {'domains': [
+            item.snapshot() for item in self.menu_items.values()
+            if getattr(item.vm, 'klass', None) and item.state != 'Halted']}
 
     def _disconnect_signals(self, _event):
         self.dispatcher.remove_handler('domain-pre-start',
@@ -745,18 +901,34 @@ class DomainTray(Gtk.Application):
 
 def main():
     ''' main function '''
+    parser = argparse.ArgumentParser(description=_("Qubes Domains widget."))
+    parser.add_argument(
+        '--list-view', action='store_true',
+        help=_("show running qubes in a scrolling list instead of a menu; "
+               "lighter on systems with hundreds of qubes"))
+    args = parser.parse_args()
+    watchdog.start_from_environment()
+
     qapp = qubesadmin.Qubes()
-    dispatcher = qubesadmin.events.EventsDispatcher(qapp)
+    dispatcher = qui.event_fanout.get_events_dispatcher(qapp)
     stats_dispatcher = qubesadmin.events.EventsDispatcher(
         qapp, api_method='admin.vm.Stats')
-    app = DomainTray(
+    if args.list_view:
+        # imported here, as it builds on this module
+        from qui.tray import domain_list  # pylint: disable=cyclic-import
+        tray_class = domain_list.DomainListTray
+    else:
+        tray_class = DomainTray
+    app = tray_class(
         'org.qubes.qui.tray.Domains', qapp, dispatcher, stats_dispatcher)
     app.run()
+    systemd_notify.start(app.service_status, [dispatcher, stats_dispatcher])
 
     loop = asyncio.get_event_loop()
     tasks = [
-        asyncio.ensure_future(dispatcher.listen_for_events()),
-        asyncio.ensure_future(stats_dispatcher.listen_for_events()),
+        asyncio.ensure_future(event_stream.listen_for_events(dispatcher)),
+        asyncio.ensure_future(
+            event_stream.listen_for_events(stats_dispatcher)),
     ]
 
     done, _unused = loop.run_until_complete(asyncio.wait(
@@ -12,6 +12,11 @@ import qubesadmin
 import qubesadmin.events
 from qubesadmin import exc
 
+import qui.event_fanout
+from qui import event_stream
+from qui import systemd_notify
+from qui import watchdog
+
 import gi  # isort:skip
 gi.require_version('Gtk', '3.0')  # isort:skip
 from gi.repository import Gtk, Gio  # isort:skip
@@ -53,6 +58,9 @@ class UpdatesTray(Gtk.Application):
 
         self.update_indicator_state()
 
+    def service_status(self):
+        return '{} qubes with updates'.format(len(self.vms_needing_update))
+
     def setup_menu(self):
         title_label = Gtk.Label(xalign=0)
         title_label.set_markup(_("<b>Qube Updates Available</b>"))
@@ -95,10 +103,20 @@ class UpdatesTray(Gtk.Application):
 
     def check_vms_needing_update(self):
         self.vms_needing_update.clear()
-        for vm in self.qapp.domains:
-            if vm.features.get('updates-available', False) and \
-                    (getattr(vm, 'updateable', False) or vm.klass == 'AdminVM'):
-                self.vms_needing_update.add(vm.name)
+        self.vms_needing_update.update(self.get_vms_needing_update())
+
+    def get_vms_needing_update(self):
+        return {vm.name for vm in self.qapp.domains
+                if vm.features.get('updates-available', False) and
+                (getattr(vm, 'updateable', False) or vm.klass == 'AdminVM')}
+
+    def resync(self):
+        ''' Apply the changes missed while disconnected from qubesd. '''
+        self.qapp.domains.refresh_cache(force=True)
+        vms_needing_update = self.get_vms_needing_update()
+        self.vms_needing_update.intersection_update(vms_needing_update)
+        self.vms_needing_update.update(vms_needing_update)
+        self.update_indicator_state()
 
     def connect_events(self):
         self.dispatcher.add_handler('domain-feature-set:updates-available',
@@ -107,6 +125,7 @@ class UpdatesTray(Gtk.Application):
                                     self.feature_unset)
         self.dispatcher.add_handler('domain-add', self.domain_added)
         self.dispatcher.add_handler('domain-delete', self.domain_removed)
+        event_stream.on_reconnect(self.dispatcher, self.resync)
 
     def domain_added(self, _submitter, _event, vm, *_args, **_kwargs):
         try:
@@ -154,16 +173,19 @@ class UpdatesTray(Gtk.Application):
 
 
 def main():
+    watchdog.start_from_environment()
     qapp = qubesadmin.Qubes()
-    dispatcher = qubesadmin.events.EventsDispatcher(qapp)
+    dispatcher = qui.event_fanout.get_events_dispatcher(qapp)
     app = UpdatesTray(
         'org.qubes.qui.tray.Updates', qapp, dispatcher)
     app.run()
+    systemd_notify.start(app.service_status, [dispatcher])
 
     loop = asyncio.get_event_loop()
 
-    done, _unused = loop.run_until_complete(asyncio.ensure_future(
-        dispatcher.listen_for_events()))
+    done, _unused = loop.run_until_complete(asyncio.wait(
+        [asyncio.ensure_future(event_stream.listen_for_events(dispatcher))],
+        return_when=asyncio.FIRST_EXCEPTION))
 
     exit_code = 0
 
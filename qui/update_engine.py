@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+''' Update engine shared by qubes-update-gui and qubes-update-headless.
+It runs qubesctl for the selected qubes and reports progress to a listener;
+it must not import Gtk, so that the headless updater starts quickly. '''
+
+import collections
+import concurrent.futures
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+
+from qubesadmin import exc
+from qui import update_history
+from qui import update_planner
+
+# number of qubes (other than dom0) updated at the same time; each update
+# starts the target qube and a management DispVM, so keep this modest
+DEFAULT_MAX_CONCURRENCY = 4
+
+# seconds a cancelled update has to exit after SIGTERM before it is killed
+CANCEL_KILL_TIMEOUT = 10
+
+# seconds a qube has to shut down before an update or restart fails
+SHUTDOWN_TIMEOUT = 120
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'qubes-update')
+LOG_DIR = os.path.join(CACHE_DIR, 'logs')
+HISTORY_FILE = os.path.join(CACHE_DIR, 'history.json')
+
+ANSI_ESCAPE = re.compile(r'(\x9B|\x1B\[)[0-?]*[ -/]*[@-~]')
+
+
+def get_update_targets(qapp):
+    ''' Yields (vm, updates_available) for dom0 and every updateable qube.
+    Lazy, so that callers can show the first qubes before the state of all
+    of them has been fetched from qubesd. '''
+    for vm in qapp.domains:
+        if vm.klass == 'AdminVM' or getattr(vm, 'updateable', False):
+            yield vm, vm.features.get('updates-available', False)
+
+
+def get_distribution(vm):
+    ''' Name of the distribution a qube runs, used to predict update times
+    of qubes never updated before; None if it cannot be told. '''
+    if vm.klass == 'AdminVM':
+        return 'dom0'
+    distribution = vm.features.get('os-distribution', None)
+    if not distribution and vm.klass == 'TemplateVM':
+        # templates are named after their distribution, e.g. fedora-30
+        distribution = vm.name.split('-')[0]
+    return distribution
+
+
+def get_update_command(vm):
+    if vm.klass == 'AdminVM':
+        return ['sudo', 'qubesctl', '--dom0-only', '--no-color',
+                'pkg.upgrade', 'refresh=True']
+    return ['sudo', 'qubesctl', '--skip-dom0', '--targets=' + vm.name,
+            '--show-output', 'state.sls', 'update.qubes-vm']
+
+
+def read_log_tail(path, max_bytes):
+    ''' Read at most max_bytes from the end of a log, starting at a line
+    boundary. Returns the text and the size of the log. '''
+    with open(path, 'rb') as log:
+        size = log.seek(0, os.SEEK_END)
+        start = max(0, size - max_bytes)
+        log.seek(start)
+        data = log.read(size - start)
+    if start > 0:
+        data = data[data.find(b'\n') + 1:]
+    return data.decode(errors='replace'), size
+
+
+def shutdown_vm(vm, force=False, timeout=SHUTDOWN_TIMEOUT):
+    ''' Shut down vm and wait until it is halted. Raises
+    :class:`qubesadmin.exc.QubesException` on failure. '''
+    vm.shutdown(force=force)
+    deadline = time.monotonic() + timeout
+    while vm.get_power_state() != 'Halted':
+        if time.monotonic() > deadline:
+            raise exc.QubesException(
+                'Timed out waiting for {} to shut down'.format(vm.name))
+        time.sleep(1)
+
+
+def get_process_tree(pid):
+    ''' pid and the pids of all its descendants, found in /proc '''
+    children = collections.defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', entry, 'stat')) as stat:
+                # the name of the command, in parentheses, may contain spaces
+                ppid = int(stat.read().rpartition(')')[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue  # exited meanwhile
+        children[ppid].append(int(entry))
+
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children[parent])
+    return tree
+
+
+def signal_process_tree(pid, signum):
+    ''' Send signum to pid and all its descendants. The update commands run
+    qubesctl as root through sudo, which does not relay SIGKILL, so the
+    processes the user may not signal are signalled through sudo. '''
+    denied = []
+    for tree_pid in get_process_tree(pid):
+        try:
+            os.kill(tree_pid, signum)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            denied.append(str(tree_pid))
+    if denied:
+        try:
+            subprocess.call(['sudo', '-n', 'kill', '-{}'.format(int(signum)),
+                             '--'] + denied,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+        except OSError:
+            pass
+
+
+class UpdateListener:
+    ''' Receives progress of an :class:`UpdateEngine` run. All methods are
+    called from worker threads. '''
+    # pylint: disable=unused-argument
+
+    def vm_update_started(self, vm):
+        pass
+
+    def vm_update_output(self, vm, line, log_offset):
+        ''' A line of update output, already written to the qube's log,
+        which is log_offset bytes long afterwards. '''
+
+    def vm_update_finished(self, vm, status, exit_status, duration,
+                           error=None):
+        ''' status is one of 'success', 'failure' and 'cancelled';
+        exit_status is None if qubesctl was never started. '''
+
+    def vm_restart_status(self, vm, status, error=None):
+        ''' status is one of 'shutting-down', 'starting', 'success' and
+        'failure'. '''
+
+
+class UpdateEngine:
+    ''' Updates qubes with qubesctl in the stages planned by
+    :func:`qui.update_planner.plan_update_stages`, and restarts the qubes
+    affected by the updates. '''
+
+    def __init__(self, listener, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 log_dir=LOG_DIR, history_path=HISTORY_FILE):
+        self.listener = listener
+        self.max_concurrency = max(1, max_concurrency)
+        self.log_dir = log_dir
+        self.history = update_history.UpdateHistory(history_path)
+        # distributions of the qubes, by qube name
+        self.distributions = {}
+
+        self.cancelled = False
+        # update processes still running, with the event set at the end of
+        # their output; guarded by process_lock
+        self.running_processes = {}
+        self.process_lock = threading.Lock()
+
+        # log files of qubes whose update has started, by qube name
+        self.log_files = {}
+
+    def get_distribution(self, vm):
+        if vm.name not in self.distributions:
+            self.distributions[vm.name] = get_distribution(vm)
+        return self.distributions[vm.name]
+
+    def get_estimates(self, vms):
+        ''' Expected update durations in seconds (None if unknown) based on
+        past updates, by qube name. '''
+        return {vm.name: self.history.estimate(vm.name,
+                                               self.get_distribution(vm))
+                for vm in vms}
+
+    def plan(self, vms, estimates=None):
+        ''' Stages in which :meth:`update` updates vms; see
+        :func:`qui.update_planner.plan_update_stages`. '''
+        if estimates is None:
+            estimates = self.get_estimates(vms)
+        return update_planner.plan_update_stages(
+            vms, self.max_concurrency, estimates)
+
+    def update(self, vms, stages=None):
+        ''' Update vms in the given stages (planned with :meth:`plan` if
+        not given), blocking until all are done. Returns the final status of
+        every qube, in the order of vms. '''
+        if stages is None:
+            stages = self.plan(vms)
+        statuses = {}
+
+        for stage, concurrency in stages:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=concurrency) as executor:
+                for vm, status in zip(stage,
+                                      executor.map(self.update_vm, stage)):
+                    statuses[vm] = status
+
+        try:
+            self.history.save()
+        except OSError:
+            pass  # only predictions of the next update are affected
+
+        return [statuses[vm] for vm in vms]
+
+    def update_vm(self, vm):
+        ''' Update a single qube. Returns the final status. '''
+        if self.cancelled:
+            self.listener.vm_update_finished(vm, 'cancelled', None, 0)
+            return 'cancelled'
+
+        self.listener.vm_update_started(vm)
+        start_time = time.monotonic()
+        error = None
+
+        try:
+            if vm.klass == 'TemplateVM' and vm.is_running():
+                # so that qubes based on it are restarted with the result of
+                # this update only
+                shutdown_vm(vm)
+            exit_status = self.run_update_command(vm, get_update_command(vm))
+        except (OSError, exc.QubesException) as ex:
+            exit_status = None
+            status = 'failure'
+            error = str(ex)
+        else:
+            if exit_status == 0:
+                status = 'success'
+            elif self.cancelled:
+                status = 'cancelled'
+            else:
+                status = 'failure'
+                error = 'qubesctl exited with code {}'.format(exit_status)
+
+        duration = time.monotonic() - start_time
+        if status == 'success':
+            self.history.record(vm.name, self.get_distribution(vm), duration)
+
+        self.listener.vm_update_finished(
+            vm, status, exit_status, duration, error)
+        return status
+
+    def run_update_command(self, vm, command):
+        ''' Run command, saving its output to the qube's log file and passing
+        it to the listener line by line as it is produced. Returns the exit
+        code of the command, or None if the update was cancelled before the
+        command could start. Once the update is cancelled, only the command
+        itself is waited for, not the end of its output. '''
+        os.makedirs(self.log_dir, exist_ok=True)
+        log_path = os.path.join(self.log_dir, vm.name + '.log')
+        log = open(log_path, 'wb', buffering=0)
+        self.log_files[vm.name] = log_path
+
+        with self.process_lock:
+            if self.cancelled:
+                log.close()
+                return None
+            # in its own session, so that a Ctrl-C in the terminal of
+            # qubes-update-headless reaches qubesctl only through cancel()
+            try:
+                proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        start_new_session=True)
+            except OSError:
+                log.close()
+                raise
+            # set at the end of the output, or on cancel
+            output_done = threading.Event()
+            self.running_processes[proc] = output_done
+
+        # read in another thread: descendants of qubesctl that survive a
+        # cancel may keep the output open long after qubesctl has exited
+        reader = threading.Thread(
+            target=self.read_update_output,
+            args=(vm, proc, log, output_done), daemon=True)
+        reader.start()
+        try:
+            output_done.wait()
+            return proc.wait()
+        finally:
+            with self.process_lock:
+                del self.running_processes[proc]
+
+    def read_update_output(self, vm, proc, log, output_done):
+        ''' Write the output of proc to log and pass it to the listener,
+        until it ends or the update is cancelled. '''
+        log_offset = 0
+        try:
+            with proc.stdout, log:
+                for line in iter(proc.stdout.readline, b''):
+                    if self.cancelled:
+                        break
+                    line = ANSI_ESCAPE.sub('', line.decode(errors='replace'))
+                    if not line.endswith('\n'):
+                        line += '\n'
+                    log_offset += log.write(line.encode())
+                    self.listener.vm_update_output(vm, line, log_offset)
+        finally:
+            output_done.set()
+
+    def signal_running_updates(self, signum):
+        ''' Send signum to all running updates and their descendants. '''
+        with self.process_lock:
+            processes = list(self.running_processes)
+        for proc in processes:
+            signal_process_tree(proc.pid, signum)
+
+    def cancel(self):
+        ''' Stop the running updates and skip the remaining ones, without
+        waiting for them. Processes that do not exit on SIGTERM are killed
+        after CANCEL_KILL_TIMEOUT seconds. '''
+        with self.process_lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            for output_done in self.running_processes.values():
+                output_done.set()
+
+        self.signal_running_updates(signal.SIGTERM)
+        kill_timer = threading.Timer(
+            CANCEL_KILL_TIMEOUT, self.signal_running_updates,
+            [signal.SIGKILL])
+        kill_timer.daemon = True
+        kill_timer.start()
+
+    def restart(self, vms):
+        ''' Restart vms, shutting down clients before their netvm and
+        starting them in the reverse order; the qubes within a batch are
+        handled in parallel. Blocks until done and returns the final status
+        of every qube, in the order of vms. '''
+        batches = update_planner.plan_restart(vms)
+        statuses = {}
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_concurrency) as executor:
+            for batch in batches:
+                for vm, status in zip(
+                        batch, executor.map(self.restart_shutdown_vm, batch)):
+                    statuses[vm] = status
+
+            for batch in reversed(batches):
+                batch = [vm for vm in batch if statuses[vm] != 'failure']
+                for vm, status in zip(
+                        batch, executor.map(self.restart_start_vm, batch)):
+                    statuses[vm] = status
+
+        return [statuses[vm] for vm in vms]
+
+    def restart_shutdown_vm(self, vm):
+        self.listener.vm_restart_status(vm, 'shutting-down')
+        try:
+            # a netvm may still serve qubes that are not restarted; qubesd
+            # connects them again once it is started
+            shutdown_vm(vm, force=getattr(vm, 'provides_network', False))
+        except exc.QubesException as ex:
+            self.listener.vm_restart_status(vm, 'failure', str(ex))
+            return 'failure'
+        return 'halted'
+
+    def restart_start_vm(self, vm):
+        self.listener.vm_restart_status(vm, 'starting')
+        try:
+            vm.start()
+        except exc.QubesException as ex:
+            self.listener.vm_restart_status(vm, 'failure', str(ex))
+            return 'failure'
+        self.listener.vm_restart_status(vm, 'success')
+        return 'success'
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+''' Small local record of past qube updates, used to predict how long the
+next ones will take. '''
+
+import json
+import os
+import threading
+import time
+
+# durations kept for every qube and for every distribution
+MAX_SAMPLES = 10
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+class UpdateHistory:
+    ''' Durations of successful updates by qube name and by distribution,
+    and when each qube was last updated successfully, stored as JSON in
+    path. A missing or damaged file is treated as an empty
+    history. Safe to use from several threads. '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.qubes = {}
+        self.distributions = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as history_file:
+                data = json.load(history_file)
+            self.qubes = dict(data.get('qubes', {}))
+            self.distributions = dict(data.get('distributions', {}))
+        except (OSError, ValueError, AttributeError):
+            self.qubes = {}
+            self.distributions = {}
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({'qubes': self.qubes,
+                               'distributions': self.distributions})
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as history_file:
+            history_file.write(data)
+        os.replace(temp_path, self.path)
+
+    def record(self, vm_name, distribution, duration):
+        ''' Record a successful update of vm_name, taking duration seconds;
+        distribution may be None if it is not known. '''
+        with self.lock:
+            qube = self.qubes.setdefault(vm_name, {})
+            qube['durations'] = \
+                (qube.get('durations', []) + [duration])[-MAX_SAMPLES:]
+            qube['last_success'] = time.time()
+            if distribution:
+                self.distributions[distribution] = \
+                    (self.distributions.get(distribution, []) +
+                     [duration])[-MAX_SAMPLES:]
+
+    def estimate(self, vm_name, distribution):
+        ''' Expected duration in seconds of an update of vm_name, based on
+        its own history or else on its distribution's; None if unknown. '''
+        with self.lock:
+            durations = self.qubes.get(vm_name, {}).get('durations')
+            if not durations and distribution:
+                durations = self.distributions.get(distribution)
+            if not durations:
+                return None
+            return median(durations)
+
+    def last_success(self, vm_name):
+        ''' When vm_name was last updated successfully, as returned by
+        :func:`time.time`; None if never. '''
+        with self.lock:
+            return self.qubes.get(vm_name, {}).get('last_success')
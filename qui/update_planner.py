@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+''' Decides in which order qubes are updated and how the running qubes
+affected by an update are restarted afterwards. Only looks at qube
+properties; running the plan is up to :mod:`qui.update_engine`. '''
+
+import heapq
+
+# qubes updated successfully less than this many seconds ago are skipped in
+# bulk updates, unless updates are known to be available for them
+FRESH_UPDATE_AGE = 24 * 3600
+
+
+def plan_update_stages(vms, max_concurrency, estimates=None):
+    ''' Split vms into stages that are updated one after another. Returns a
+    list of (vms, concurrency) tuples, skipping empty stages:
+
+    - dom0, alone, as its updates may change the tools used for the rest;
+    - templates and other qubes; templates go first, since the qubes based
+      on them have to be restarted afterwards;
+    - qubes providing network, one at a time and after everything else, as
+      updating one may interrupt the network used by the other updates.
+
+    If estimates (expected durations by qube name) are given and several
+    qubes are updated at once, the longest updates of a stage are started
+    first, which shortens the total time.
+    '''
+    admin_vms = []
+    templates = []
+    other_vms = []
+    network_vms = []
+    for vm in vms:
+        if vm.klass == 'AdminVM':
+            admin_vms.append(vm)
+        elif vm.klass == 'TemplateVM':
+            templates.append(vm)
+        elif getattr(vm, 'provides_network', False):
+            network_vms.append(vm)
+        else:
+            other_vms.append(vm)
+
+    pool_vms = templates + other_vms
+    default = get_default_estimate(estimates or {})
+    if default is not None and max_concurrency > 1:
+        # stable, so templates still go first among equal estimates
+        pool_vms.sort(key=lambda vm: -_get_estimate(estimates, vm, default))
+
+    stages = [(admin_vms, 1),
+              (pool_vms, max_concurrency),
+              (network_vms, 1)]
+    return [(stage, concurrency) for stage, concurrency in stages if stage]
+
+
+def get_default_estimate(estimates):
+    ''' Estimate used for qubes without history: the mean of the known
+    estimates, or None if there are none. '''
+    known = [estimate for estimate in estimates.values()
+             if estimate is not None]
+    if not known:
+        return None
+    return sum(known) / len(known)
+
+
+def _get_estimate(estimates, vm, default):
+    estimate = estimates.get(vm.name)
+    return default if estimate is None else estimate
+
+
+def estimate_remaining_time(stages, estimates, start_times, finished, now):
+    ''' Expected number of seconds until all stages are done, or None if no
+    estimates are known.
+
+    :param stages: as returned by :func:`plan_update_stages`
+    :param estimates: expected update durations (or None) by qube name
+    :param start_times: start times of the started updates, by qube name
+    :param finished: names of qubes whose update has finished
+    :param now: current time, comparable to start_times
+    '''
+    default = get_default_estimate(estimates)
+    if default is None:
+        return None
+
+    remaining = 0
+    for stage, concurrency in stages:
+        # times at which the workers of this stage become free
+        workers = []
+        pending = []
+        for vm in stage:
+            if vm.name in finished:
+                continue
+            estimate = _get_estimate(estimates, vm, default)
+            if vm.name in start_times:
+                workers.append(max(estimate - (now - start_times[vm.name]), 0))
+            else:
+                pending.append(estimate)
+        workers.extend([0] * (concurrency - len(workers)))
+        heapq.heapify(workers)
+        # the engine starts pending updates in stage order, each on the
+        # first worker to become free
+        for estimate in pending:
+            heapq.heappush(workers, heapq.heappop(workers) + estimate)
+        remaining += max(workers)
+    return remaining
+
+
+def is_fresh(last_success, now, max_age=FRESH_UPDATE_AGE):
+    ''' Whether a qube last updated successfully at last_success (None if
+    never) was updated recently enough not to be updated again in bulk.
+    A max_age of 0 disables the policy. '''
+    return last_success is not None and 0 <= now - last_success < max_age
+
+
+def get_updated_templates(vms, statuses):
+    ''' Templates among vms updated successfully, given the statuses
+    returned by :meth:`qui.update_engine.UpdateEngine.update`. '''
+    return [vm for vm, status in zip(vms, statuses)
+            if vm.klass == 'TemplateVM' and status == 'success']
+
+
+def get_outdated_vms(domains, updated_templates):
+    ''' Running AppVMs based on one of updated_templates, which have to be
+    restarted to use the updated root filesystem. DispVMs are left out, as
+    restarting one would destroy it. '''
+    updated_names = {str(template) for template in updated_templates}
+    return [vm for vm in domains
+            if vm.klass == 'AppVM'
+            and str(getattr(vm, 'template', None)) in updated_names
+            and vm.is_running()]
+
+
+def plan_restart(vms):
+    ''' Split vms into batches to shut down one after another, so that every
+    qube is stopped before the netvm it is connected to. The qubes can be
+    started again by going through the batches in reverse order. '''
+    names = {vm.name for vm in vms}
+    clients = {vm.name: [] for vm in vms}
+    for vm in vms:
+        netvm = getattr(vm, 'netvm', None)
+        if netvm is not None and str(netvm) in names:
+            clients[str(netvm)].append(vm)
+
+    # a qube's batch is one after the last batch of its clients
+    levels = {}
+
+    def get_level(vm, visiting=()):
+        if vm.name not in levels:
+            if vm.name in visiting:  # netvm loop, should not happen
+                return 0
+            levels[vm.name] = max(
+                [get_level(client, visiting + (vm.name,)) + 1
+                 for client in clients[vm.name]] or [0])
+        return levels[vm.name]
+
+    batches = []
+    for vm in vms:
+        level = get_level(vm)
+        while len(batches) <= level:
+            batches.append([])
+        batches[level].append(vm)
+    return batches
@@ -2,15 +2,20 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=wrong-import-position,import-error
 
-import re
-import time
+import argparse
+import collections
+import itertools
+import os
 import threading
-import subprocess
-import pkg_resources
+import time
 import gi  # isort:skip
 gi.require_version('Gtk', '3.0')  # isort:skip
 from gi.repository import Gtk, Gdk, GObject, Gio  # isort:skip
 from qubesadmin import Qubes
+from qui import icon_cache
+from qui import update_engine
+from qui import update_planner
+from qui import watchdog
 
 # using locale.gettext is necessary for Gtk.Builder translation support to work
 # in most cases gettext is better, but it cannot handle Gtk.Builder/glade files
@@ -19,35 +24,81 @@ from locale import gettext as _
 locale.bindtextdomain("desktop-linux-manager", "/usr/locales/")
 locale.textdomain('desktop-linux-manager')
 
-class QubesUpdater(Gtk.Application):
+# number of qubes added to the qube list per main loop iteration
+VM_LIST_BATCH_SIZE = 10
+
+# update output is collected from the worker threads and added to the details
+# view at most once per this many milliseconds
+OUTPUT_FLUSH_INTERVAL = 200
+
+# the details view keeps only this many most recent lines
+MAX_VIEW_LINES = 2000
+# at most this much of the end of a qube's log is loaded when it is selected
+MAX_LOG_VIEW_BYTES = 256 * 1024
+
+
+class QubesUpdater(Gtk.Application, update_engine.UpdateListener):
     # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, qapp):
+    def __init__(self, qapp,
+                 max_concurrency=update_engine.DEFAULT_MAX_CONCURRENCY):
         super(QubesUpdater, self).__init__(
             application_id="org.gnome.example",
             flags=Gio.ApplicationFlags.FLAGS_NONE)
 
         self.qapp = qapp
+        self.max_concurrency = max(1, max_concurrency)
 
         self.primary = False
         self.connect("activate", self.do_activate)
 
+        # whether at least one VM has updates available, known once the qube
+        # list is complete
+        self.updates_available = False
+        self.vm_list_placeholder = None
+        # hidden when the window is set up
+        self.details_visible = True
+
+        self.update_thread = None
+        self.exit_after_update = False
+        # progress rows by qube name
+        self.progress_rows = {}
+
+        # what the overall ETA is computed from; only used in the main thread
+        self.update_stages = []
+        self.estimates = {}
+        self.start_times = {}
+        self.finished_vms = set()
+
+        # running qubes based on updated templates and their rows
+        self.outdated_vms = []
+        self.restart_rows = {}
+        self.restart_thread = None
+
+        self.pending_output = []
+        self.output_lock = threading.Lock()
+
+        # most recent lines of all qubes, shown when no row is selected
+        self.output_tail = collections.deque(maxlen=MAX_VIEW_LINES)
+        # qube whose log is shown and how much of that log the view contains
+        self.shown_vm = None
+        self.shown_offset = 0
+
     def perform_setup(self, *_args, **_kwargs):
         # pylint: disable=attribute-defined-outside-init
         self.builder = Gtk.Builder()
         self.builder.set_translation_domain("desktop-linux-manager")
-        self.builder.add_from_file(pkg_resources.resource_filename(
-            __name__, 'updater.glade'))
+        # installed next to this module (package_data); pkg_resources would
+        # find it too, but takes longer to import than the rest of the updater
+        self.builder.add_from_file(os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'updater.glade'))
 
         self.main_window = self.builder.get_object("main_window")
 
         self.vm_list = self.builder.get_object("vm_list")
 
-        self.updates_available = self.populate_vm_list()
-
         self.no_updates_available_label = \
             self.builder.get_object("no_updates_available")
-        self.no_updates_available_label.set_visible(not self.updates_available)
 
         self.allow_update_unavailable_check = \
             self.builder.get_object("allow_update_unavailable")
@@ -56,6 +107,7 @@ class QubesUpdater(Gtk.Application):
 
         self.next_button = self.builder.get_object("button_next")
         self.next_button.connect("clicked", self.next_clicked)
+        self.next_button.set_sensitive(False)
 
         self.cancel_button = self.builder.get_object("button_cancel")
         self.cancel_button.connect("clicked", self.cancel_updates)
@@ -69,10 +121,16 @@ class QubesUpdater(Gtk.Application):
         self.progress_textview = self.builder.get_object("progress_textview")
         self.progress_scrolled_window = self.builder.get_object(
             "progress_scrolled_window")
+        self.restart_page = self.builder.get_object("restart_page")
         self.progress_listview = self.builder.get_object("progress_listview")
+        self.progress_listview.connect("row-activated", self.show_row_log)
+        self.restart_listview = self.builder.get_object("restart_listview")
+        self.restart_listview.connect("row-activated",
+                                      self.toggle_restart_selection)
 
-        self.details_visible = True
         self.details_icon = self.builder.get_object("details_icon")
+        self.details_label = self.builder.get_object("details_label")
+        self.eta_label = self.builder.get_object("eta_label")
         self.builder.get_object("details_icon_events").connect(
             "button-press-event", self.toggle_details)
         self.builder.get_object("details_label_events").connect(
@@ -83,8 +141,9 @@ class QubesUpdater(Gtk.Application):
         self.main_window.show_all()
         self.toggle_details()
 
-        self.update_thread = None
-        self.exit_triggered = False
+        self.engine = update_engine.UpdateEngine(
+            self, max_concurrency=self.max_concurrency)
+        self.populate_vm_list()
 
     def do_activate(self, *_args, **_kwargs):
         if not self.primary:
@@ -112,21 +171,37 @@ class QubesUpdater(Gtk.Application):
             Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
 
     def populate_vm_list(self):
-        result = False  # whether at least one VM has updates available
-        for vm in self.qapp.domains:
-            if vm.klass == 'AdminVM':
-                state = vm.features.get('updates-available', False)
-                result = result or state
-                self.vm_list.add(VMListBoxRow(vm, state))
-
-        for vm in self.qapp.domains:
-            if getattr(vm, 'updateable', False) and vm.klass != 'AdminVM':
-                state = vm.features.get('updates-available', False)
-                result = result or state
-                self.vm_list.add(VMListBoxRow(vm, state))
-
+        """Fill the qube list in batches from the main loop, so that the
+        window is usable while qubesd is queried."""
+        self.vm_list_placeholder = Gtk.Label(_("Loading qubes..."))
+        self.vm_list_placeholder.show()
+        self.vm_list.set_placeholder(self.vm_list_placeholder)
+        self.vm_list.set_sort_func(sort_vm_rows)
         self.vm_list.connect("row-activated", self.toggle_row_selection)
-        return result
+
+        GObject.idle_add(self.add_vm_rows,
+                         update_engine.get_update_targets(self.qapp))
+
+    def add_vm_rows(self, targets):
+        added = 0
+        for vm, state in itertools.islice(targets, VM_LIST_BATCH_SIZE):
+            row = VMListBoxRow(vm, state,
+                               self.engine.history.last_success(vm.name))
+            if not state and self.allow_update_unavailable_check.get_active():
+                row.set_sensitive(True)
+                row.checkbox.set_active(not row.fresh)
+            self.vm_list.add(row)
+            row.show_all()
+            self.updates_available = self.updates_available or state
+            added += 1
+
+        if added == VM_LIST_BATCH_SIZE:
+            return True  # there may be more, continue in the next iteration
+
+        self.vm_list_placeholder.set_text('')
+        self.no_updates_available_label.set_visible(not self.updates_available)
+        self.toggle_row_selection(None, None)
+        return False
 
     def toggle_row_selection(self, _emitter, row):
         if row:
@@ -139,36 +214,100 @@ class QubesUpdater(Gtk.Application):
             self.next_button.set_sensitive(False)
 
     def set_update_available(self, _emitter):
+        """Enable qubes without known available updates and select those
+        not updated recently; recently updated ones can still be selected by
+        hand."""
         for vm_row in self.vm_list:
             if not vm_row.updates_available:
                 vm_row.set_sensitive(
                     self.allow_update_unavailable_check.get_active())
-                if not vm_row.get_sensitive():
-                    vm_row.checkbox.set_active(False)
+                vm_row.checkbox.set_active(
+                    vm_row.get_sensitive() and not vm_row.fresh)
+        self.toggle_row_selection(None, None)
 
     def next_clicked(self, _emitter):
         if self.stack.get_visible_child() == self.list_page:
             self.stack.set_visible_child(self.progress_page)
 
+            vms_to_update = []
             for row in self.vm_list:
                 if row.checkbox.get_active():
-                    self.progress_listview.add(ProgressListBoxRow(row.vm))
+                    progress_row = ProgressListBoxRow(row.vm)
+                    self.progress_listview.add(progress_row)
+                    self.progress_rows[row.vm.name] = progress_row
+                    vms_to_update.append(row.vm)
 
             self.progress_listview.show_all()
 
             self.next_button.set_sensitive(False)
             self.next_button.set_label(_("Finish"))
 
-            # pylint: disable=attribute-defined-outside-init
-            self.update_thread = threading.Thread(target=self.perform_update)
+            self.update_thread = threading.Thread(target=self.perform_update,
+                                                  args=(vms_to_update,))
             self.update_thread.start()
+            GObject.timeout_add(OUTPUT_FLUSH_INTERVAL, self.flush_output)
 
         elif self.stack.get_visible_child() == self.progress_page:
-            self.cancel_updates()
+            if self.outdated_vms:
+                self.show_restart_page()
+            else:
+                self.cancel_updates()
+
+        elif self.stack.get_visible_child() == self.restart_page:
+            if self.restart_thread is None:
+                self.start_restart()
+            else:
+                self.exit_updater()
+
+    def show_restart_page(self):
+        self.stack.set_visible_child(self.restart_page)
+
+        for vm in self.outdated_vms:
+            row = RestartListBoxRow(vm)
+            self.restart_listview.add(row)
+            self.restart_rows[vm.name] = row
+        self.restart_listview.show_all()
+
+        self.next_button.set_label(_("Restart"))
+        self.cancel_button.set_label(_("Skip"))
+        self.cancel_button.set_sensitive(True)
+        self.cancel_button.set_visible(True)
+
+    @staticmethod
+    def toggle_restart_selection(_emitter, row):
+        if row.checkbox.get_sensitive():
+            row.checkbox.set_active(not row.checkbox.get_active())
+
+    def start_restart(self):
+        vms = [row.vm for row in self.restart_rows.values()
+               if row.checkbox.get_active()]
+        if not vms:
+            self.exit_updater()
             return
 
+        for row in self.restart_rows.values():
+            row.checkbox.set_sensitive(False)
+        self.next_button.set_sensitive(False)
+        self.next_button.set_label(_("Finish"))
+        self.cancel_button.set_visible(False)
+
+        self.restart_thread = threading.Thread(target=self.perform_restart,
+                                               args=(vms,))
+        self.restart_thread.start()
+
+    def perform_restart(self, vms):
+        self.engine.restart(vms)
+        GObject.idle_add(self.next_button.set_sensitive, True)
+
+    def vm_restart_status(self, vm, status, error=None):
+        row = self.restart_rows[vm.name]
+        if status in ('shutting-down', 'starting'):
+            status = 'in-progress'
+        if error:
+            GObject.idle_add(row.set_tooltip_text, error)
+        GObject.idle_add(row.set_status, status)
+
     def toggle_details(self, *_args, **_kwargs):
-        # pylint: disable=attribute-defined-outside-init
         self.details_visible = not self.details_visible
         self.progress_textview.set_visible(self.details_visible)
 
@@ -188,62 +327,160 @@ class QubesUpdater(Gtk.Application):
 
     def append_text_view(self, text):
         buffer = self.progress_textview.get_buffer()
-        buffer.insert(buffer.get_end_iter(), text + '\n')
-
-    def perform_update(self):
-        for row in self.progress_listview:
-            if self.exit_triggered:
-                GObject.idle_add(row.set_status, 'failure')
-                GObject.idle_add(
-                    self.append_text_view,
-                    _("Cancelled update for {}\n").format(row.vm.name))
-                continue
-
-            GObject.idle_add(
-                self.append_text_view, _("Updating {}\n").format(row.vm.name))
-            GObject.idle_add(row.set_status, 'in-progress')
-
-            try:
-                if row.vm.klass == 'AdminVM':
-                    output = subprocess.check_output(
-                        ['sudo', 'qubesctl', '--dom0-only', '--no-color',
-                         'pkg.upgrade', 'refresh=True'],
-                        stderr=subprocess.STDOUT).decode()
-                    ansi_escape = re.compile(r'(\x9B|\x1B\[)[0-?]*[ -/]*[@-~]')
-                    output = ansi_escape.sub('', output)
-                else:
-                    output = subprocess.check_output(
-                        ['sudo', 'qubesctl', '--skip-dom0',
-                         '--targets=' + row.vm.name, '--show-output',
-                         'state.sls', 'update.qubes-vm'],
-                        stderr=subprocess.STDOUT).decode()
-
-                GObject.idle_add(self.append_text_view, output)
-                GObject.idle_add(row.set_status, 'success')
-
-            except subprocess.CalledProcessError as ex:
-                GObject.idle_add(
-                    self.append_text_view,
-                    _("Error on updating {}: {}\n{}").format(
-                        row.vm.name, str(ex), ex.output.decode()))
-                GObject.idle_add(row.set_status, 'failure')
+        buffer.insert(buffer.get_end_iter(), text)
+
+        excess_lines = buffer.get_line_count() - MAX_VIEW_LINES
+        if excess_lines > 0:
+            buffer.delete(buffer.get_start_iter(),
+                          buffer.get_iter_at_line(excess_lines))
+
+    def post_output(self, text, vm_name=None, log_offset=None):
+        """Queue text for the details view; safe to call from any thread.
+        Output of a qube is passed with the qube name and the size of its log
+        file after the text was written there."""
+        with self.output_lock:
+            self.pending_output.append((text, vm_name, log_offset))
+
+    def flush_output(self):
+        """Move all queued text to the details view in a single insert.
+        Runs periodically in the main loop until the update thread ends."""
+        # check before draining, so nothing posted by the thread is lost
+        updating = self.update_thread.is_alive()
+        with self.output_lock:
+            pending = self.pending_output
+            self.pending_output = []
+
+        shown_text = []
+        for text, vm_name, log_offset in pending:
+            if vm_name is not None:
+                # skip what was already loaded from the log of the shown qube
+                if vm_name == self.shown_vm and log_offset > self.shown_offset:
+                    shown_text.append(text)
+                    self.shown_offset = log_offset
+                # outputs of concurrent updates are interleaved here
+                text = '{}: {}'.format(vm_name, text)
+            self.output_tail.append(text)
+            if self.shown_vm is None:
+                shown_text.append(text)
+
+        if shown_text:
+            self.append_text_view(''.join(shown_text))
+        return updating
+
+    def show_row_log(self, _emitter, row):
+        """Show the log of the activated qube, or the output of all qubes if
+        the qube already shown is activated again."""
+        if row.vm.name == self.shown_vm:
+            self.progress_listview.unselect_all()
+            self.shown_vm = None
+            self.details_label.set_text(_("Details"))
+            text = ''.join(self.output_tail)
+        else:
+            self.shown_vm = row.vm.name
+            self.details_label.set_text(_("Details: {}").format(row.vm.name))
+            log_path = self.engine.log_files.get(row.vm.name)
+            if log_path:
+                text, self.shown_offset = update_engine.read_log_tail(
+                    log_path, MAX_LOG_VIEW_BYTES)
+            else:
+                text, self.shown_offset = _("Update not started yet.\n"), 0
+
+        self.progress_textview.get_buffer().set_text('')
+        self.append_text_view(text)
+
+    def perform_update(self, vms):
+        # reading features may take a while with many qubes
+        estimates = self.engine.get_estimates(vms)
+        stages = self.engine.plan(vms, estimates)
+        GObject.idle_add(self.show_estimates, stages, estimates)
+
+        results = self.engine.update(vms, stages)
+
+        outdated_vms = []
+        updated_templates = update_planner.get_updated_templates(vms, results)
+        if updated_templates and not self.engine.cancelled:
+            outdated_vms = update_planner.get_outdated_vms(
+                self.qapp.domains, updated_templates)
+
+        GObject.idle_add(self.update_finished, results, outdated_vms)
+
+    def show_estimates(self, stages, estimates):
+        self.update_stages = stages
+        self.estimates = estimates
+        for name, estimate in estimates.items():
+            self.progress_rows[name].set_estimate(estimate)
+        self.update_eta()
+
+    def update_eta(self):
+        remaining = update_planner.estimate_remaining_time(
+            self.update_stages, self.estimates, self.start_times,
+            self.finished_vms, time.monotonic())
+        if remaining is None:
+            self.eta_label.set_text('')
+        else:
+            self.eta_label.set_text(_("About {} left").format(
+                format_duration(remaining)))
+
+    def update_vm_started(self, vm_name, start_time):
+        self.start_times[vm_name] = start_time
+        self.progress_rows[vm_name].set_status('in-progress')
+        self.update_eta()
+
+    def update_vm_finished(self, vm_name, status, duration):
+        self.finished_vms.add(vm_name)
+        row = self.progress_rows[vm_name]
+        row.set_status(status)
+        if status != 'cancelled':
+            row.set_duration(duration)
+        self.update_eta()
+
+    def update_finished(self, results, outdated_vms):
+        self.outdated_vms = outdated_vms
+        self.eta_label.set_text('')
+        if outdated_vms:
+            self.next_button.set_label(_("Next"))
+        self.next_button.set_sensitive(True)
+        self.cancel_button.set_visible(False)
+
+        self.post_output(_(
+            "Update finished. Succeeded: {success}, failed: {failure}, "
+            "cancelled: {cancelled}\n").format(
+                success=results.count('success'),
+                failure=results.count('failure'),
+                cancelled=results.count('cancelled')))
+        self.flush_output()
+
+        if self.exit_after_update:
+            self.exit_updater()
 
-        GObject.idle_add(self.next_button.set_sensitive, True)
-        GObject.idle_add(self.cancel_button.set_visible, False)
+    def vm_update_started(self, vm):
+        self.post_output(_("Updating {}\n").format(vm.name) + '\n')
+        GObject.idle_add(self.update_vm_started, vm.name, time.monotonic())
+
+    def vm_update_output(self, vm, line, log_offset):
+        self.post_output(line, vm.name, log_offset)
+
+    def vm_update_finished(self, vm, status, exit_status, duration,
+                           error=None):
+        if status == 'cancelled':
+            self.post_output(
+                _("Cancelled update for {}\n").format(vm.name) + '\n')
+        elif status == 'failure':
+            if exit_status is not None:
+                error = _("qubesctl exited with code {}").format(exit_status)
+            self.post_output(_("Error on updating {}: {}\n").format(
+                vm.name, error) + '\n')
+        GObject.idle_add(self.update_vm_finished, vm.name, status, duration)
 
     def cancel_updates(self, *_args, **_kwargs):
-        # pylint: disable=attribute-defined-outside-init
+        """Stop the running updates and skip the remaining ones, without
+        waiting for them; update_finished reports the partial results."""
         if self.update_thread and self.update_thread.is_alive():
-            self.exit_triggered = True
-            dialog = Gtk.MessageDialog(
-                self.main_window, Gtk.DialogFlags.MODAL, Gtk.MessageType.OTHER,
-                Gtk.ButtonsType.NONE, _("Cancelling remaining updates..."))
-            dialog.show()
-            while self.update_thread.is_alive():
-                while Gtk.events_pending():
-                    Gtk.main_iteration()
-                time.sleep(1)
-            dialog.hide()
+            if self.engine.cancelled:
+                return
+            self.cancel_button.set_sensitive(False)
+            self.post_output(_("Cancelling remaining updates...\n"))
+            self.engine.cancel()
         else:
             self.exit_updater()
 
@@ -252,9 +489,14 @@ class QubesUpdater(Gtk.Application):
             self.cancel_updates()
 
     def window_close(self, *_args, **_kwargs):
-        if self.stack.get_visible_child() == self.progress_page:
+        if self.update_thread and self.update_thread.is_alive():
+            # keep running until the cancelled updates are cleaned up
+            self.exit_after_update = True
             self.cancel_updates()
+            self.main_window.hide()
+            return True
         self.exit_updater()
+        return False
 
     def exit_updater(self, _emitter=None):
         if self.primary:
@@ -262,13 +504,28 @@ class QubesUpdater(Gtk.Application):
 
 
 def get_domain_icon(vm):
-    icon_vm = Gtk.IconTheme.get_default().load_icon(vm.label.icon, 16, 0)
-    icon_img = Gtk.Image.new_from_pixbuf(icon_vm)
-    return icon_img
+    return icon_cache.get_image(vm.label.icon)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return _("{}s").format(seconds)
+    if seconds < 3600:
+        return _("{}m {}s").format(seconds // 60, seconds % 60)
+    return _("{}h {}m").format(seconds // 3600, seconds % 3600 // 60)
+
+
+def sort_vm_rows(row1, row2):
+    """Sort function for the qube list: dom0, then qubes with updates
+    available, then the rest and finally the recently updated ones, each by
+    name."""
+    return (row1.sort_key > row2.sort_key) - (row1.sort_key < row2.sort_key)
 
 
 class VMListBoxRow(Gtk.ListBoxRow):
-    def __init__(self, vm, updates_available, **properties):
+    def __init__(self, vm, updates_available, last_success=None,
+                 **properties):
         super().__init__(**properties)
         self.vm = vm
 
@@ -276,9 +533,18 @@ class VMListBoxRow(Gtk.ListBoxRow):
 
         self.label_text = vm.name
         self.updates_available = updates_available
+        # updated recently, so not selected when updating all qubes
+        now = time.time()
+        self.fresh = not updates_available and \
+            update_planner.is_fresh(last_success, now)
+        self.sort_key = (vm.klass != 'AdminVM', not updates_available,
+                         self.fresh, vm.name)
         if self.updates_available:
             self.label_text = _("{vm} (updates available)").format(
                 vm=self.label_text)
+        elif self.fresh:
+            self.label_text = _("{vm} (updated {age} ago)").format(
+                vm=self.label_text, age=format_duration(now - last_success))
         self.label = Gtk.Label()
         self.icon = get_domain_icon(self.vm)
 
@@ -320,9 +586,15 @@ class ProgressListBoxRow(Gtk.ListBoxRow):
 
         self.progress_box = Gtk.HBox(orientation=Gtk.Orientation.HORIZONTAL)
 
+        # expected duration of the update, then how long it took
+        self.time_label = Gtk.Label()
+        self.time_label.get_style_context().add_class('dim-label')
+
         hbox.pack_start(self.icon, False, False, 0)
         hbox.pack_start(self.label, False, False, 0)
         hbox.pack_start(self.progress_box, False, False, 0)
+        hbox.pack_end(self.time_label, False, False, 10)
+        self.hbox = hbox
 
         self.set_status('not-started')
         self.add(hbox)
@@ -340,6 +612,9 @@ class ProgressListBoxRow(Gtk.ListBoxRow):
         elif status == 'failure':
             widget = Gtk.Image.new_from_icon_name("gtk-cancel",
                                                   Gtk.IconSize.BUTTON)
+        elif status == 'cancelled':
+            widget = Gtk.Image.new_from_icon_name("media-playback-stop",
+                                                  Gtk.IconSize.BUTTON)
         else:
             raise ValueError(_("unknown status {}").format(status))
 
@@ -350,10 +625,39 @@ class ProgressListBoxRow(Gtk.ListBoxRow):
 
         widget.show()
 
+    def set_estimate(self, estimate):
+        if estimate is not None:
+            self.time_label.set_text(_("~{}").format(
+                format_duration(estimate)))
+
+    def set_duration(self, duration):
+        self.time_label.set_text(format_duration(duration))
+
+
+class RestartListBoxRow(ProgressListBoxRow):
+    def __init__(self, vm):
+        super(RestartListBoxRow, self).__init__(vm)
+
+        self.checkbox = Gtk.CheckButton()
+        self.checkbox.set_active(True)
+        self.checkbox.set_margin_right(10)
+
+        self.hbox.pack_start(self.checkbox, False, False, 0)
+        self.hbox.reorder_child(self.checkbox, 0)
+
 
 def main():
+    parser = argparse.ArgumentParser(description=_("Update Qubes qubes."))
+    parser.add_argument(
+        '--max-concurrency', type=int,
+        default=update_engine.DEFAULT_MAX_CONCURRENCY,
+        help=_("maximum number of qubes updated at the same time "
+               "(default: %(default)s); dom0 is always updated alone"))
+    args = parser.parse_args()
+    watchdog.start_from_environment()
+
     qapp = Qubes()
-    app = QubesUpdater(qapp)
+    app = QubesUpdater(qapp, max_concurrency=args.max_concurrency)
     app.run()
 
 
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=import-error
+''' Headless qube updater. Uses the same qube selection and update engine as
+qubes-update-gui, but reports progress as newline-delimited JSON on stdout
+instead of starting Gtk. '''
+
+import argparse
+import json
+import signal
+import sys
+import threading
+import time
+
+from qubesadmin import Qubes
+from qui import update_engine
+from qui import update_planner
+
+import gettext
+t = gettext.translation("desktop-linux-manager", localedir="/usr/locales",
+                        fallback=True)
+_ = t.gettext
+
+
+class JSONProgressWriter(update_engine.UpdateListener):
+    ''' Writes one JSON object per line for every progress event. '''
+
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        # events come from several worker threads
+        self.lock = threading.Lock()
+
+    def emit(self, event, **kwargs):
+        kwargs['event'] = event
+        kwargs['time'] = time.time()
+        line = json.dumps(kwargs, sort_keys=True)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def vm_update_started(self, vm):
+        self.emit('started', qube=vm.name)
+
+    def vm_update_output(self, vm, line, log_offset):
+        # pylint: disable=unused-argument
+        self.emit('output', qube=vm.name, text=line)
+
+    def vm_update_finished(self, vm, status, exit_status, duration,
+                           error=None):
+        self.emit('finished', qube=vm.name, status=status,
+                  exit_status=exit_status, duration=round(duration, 3),
+                  error=error)
+
+    def vm_restart_status(self, vm, status, error=None):
+        self.emit('restart', qube=vm.name, status=status, error=error)
+
+
+def select_vms(qapp, args, history):
+    ''' Select qubes the way qubes-update-gui pre-selects them, adjusted by
+    the command line options. Returns the selected qubes and those left out
+    by --all because they were updated recently. '''
+    targets = set(args.targets.split(',')) if args.targets else None
+    skip = set(args.skip.split(',')) if args.skip else set()
+    now = time.time()
+
+    selected = []
+    fresh = []
+    for vm, updates_available in update_engine.get_update_targets(qapp):
+        if vm.name in skip:
+            continue
+        if targets is not None:
+            if vm.name in targets:
+                selected.append(vm)
+        elif updates_available:
+            selected.append(vm)
+        elif args.all:
+            if update_planner.is_fresh(history.last_success(vm.name), now,
+                                       args.fresh_age):
+                fresh.append(vm)
+            else:
+                selected.append(vm)
+    return selected, fresh
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=_("Update qubes without a graphical interface, "
+                      "reporting progress as JSON lines."))
+    parser.add_argument(
+        '--max-concurrency', type=int,
+        default=update_engine.DEFAULT_MAX_CONCURRENCY,
+        help=_("maximum number of qubes updated at the same time "
+               "(default: %(default)s); dom0 is always updated alone"))
+    parser.add_argument(
+        '--all', action='store_true',
+        help=_("also update qubes without known available updates, "
+               "unless updated recently (see --fresh-age)"))
+    parser.add_argument(
+        '--fresh-age', type=int, metavar='SECONDS',
+        default=update_planner.FRESH_UPDATE_AGE,
+        help=_("with --all, skip qubes updated successfully less than this "
+               "long ago (default: %(default)s; 0 to update all of them)"))
+    parser.add_argument(
+        '--targets', metavar='QUBE,...',
+        help=_("update only these qubes, whether updates are known to be "
+               "available or not"))
+    parser.add_argument(
+        '--skip', metavar='QUBE,...', help=_("never update these qubes"))
+    parser.add_argument(
+        '--restart', action='store_true',
+        help=_("afterwards, restart running qubes based on updated "
+               "templates"))
+    args = parser.parse_args()
+
+    writer = JSONProgressWriter()
+    qapp = Qubes()
+    engine = update_engine.UpdateEngine(
+        writer, max_concurrency=args.max_concurrency)
+    vms, fresh_vms = select_vms(qapp, args, engine.history)
+
+    estimates = engine.get_estimates(vms)
+    stages = engine.plan(vms, estimates)
+    remaining = update_planner.estimate_remaining_time(
+        stages, estimates, {}, set(), 0)
+    writer.emit('selected', qubes=[vm.name for vm in vms],
+                skipped_fresh=[vm.name for vm in fresh_vms],
+                estimates=estimates,
+                estimated_duration=None if remaining is None
+                else round(remaining))
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_args: engine.cancel())
+
+    statuses = engine.update(vms, stages)
+    writer.emit('done', success=statuses.count('success'),
+                failure=statuses.count('failure'),
+                cancelled=statuses.count('cancelled'))
+
+    if args.restart and not engine.cancelled:
+        updated_templates = update_planner.get_updated_templates(
+            vms, statuses)
+        outdated_vms = update_planner.get_outdated_vms(
+            qapp.domains, updated_templates) if updated_templates else []
+        writer.emit('restart-planned', qubes=[vm.name for vm in outdated_vms])
+        statuses += engine.restart(outdated_vms)
+
+    if all(status == 'success' for status in statuses):
+        return 0
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
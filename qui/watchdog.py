@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position,import-error
+''' Opt-in watchdog of the widgets' main loop. A GLib timeout ticks on the
+main loop, and a thread notices when it has not ticked for longer than a
+threshold: the main thread is stuck, usually in a blocking qubesd call made
+by a signal handler or an event handler. The stack of the main thread and
+the handler running are then logged, and the lag of every tick is counted
+in a histogram, logged with every stall and on exit.
+
+Enabled by setting QUI_WATCHDOG to the threshold in seconds, e.g.::
+
+    QUI_WATCHDOG=0.5 qui-domains
+'''
+
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import gi  # isort:skip
+gi.require_version('Gtk', '3.0')  # isort:skip
+from gi.repository import GLib  # isort:skip
+
+ENVIRONMENT_VARIABLE = 'QUI_WATCHDOG'
+
+# seconds between ticks of the main loop, and checks of the thread
+TICK_INTERVAL = 0.1
+
+# upper bounds, in seconds, of the lag histogram buckets; the last one is
+# open-ended
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# frames of these packages belong to the event loop, not to a handler
+LOOP_PACKAGES = ('asyncio', 'gbulb', 'gi')
+
+log = logging.getLogger('qui.watchdog')
+
+
+def is_loop_frame(frame):
+    return any('/{}/'.format(package) in frame.filename
+               for package in LOOP_PACKAGES)
+
+
+def find_handler(stack):
+    ''' The frame, in stack (a list of :class:`traceback.FrameSummary`,
+    outermost first), of the handler the event loop called: the first frame
+    of qui after the loop, or the first frame after the loop if there is
+    none. None if the stack is not in a handler. '''
+    loop_frames = [i for i, frame in enumerate(stack) if is_loop_frame(frame)]
+    if not loop_frames or loop_frames[-1] + 1 >= len(stack):
+        return None
+    handler_stack = stack[loop_frames[-1] + 1:]
+    for frame in handler_stack:
+        if '/qui/' in frame.filename:
+            return frame
+    return handler_stack[0]
+
+
+class LagHistogram:
+    ''' Count of loop lags by duration '''
+
+    def __init__(self, buckets=LAG_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+
+    def add(self, lag):
+        for i, bound in enumerate(self.buckets):
+            if lag <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def format(self):
+        bounds = ['<={}s'.format(bound) for bound in self.buckets] + \
+            ['>{}s'.format(self.buckets[-1])]
+        return ' '.join('{}:{}'.format(bound, count)
+                        for bound, count in zip(bounds, self.counts))
+
+
+class Watchdog:
+    ''' Reports when the main loop has not ticked for more than threshold
+    seconds. :meth:`tick` runs on the main loop and :meth:`check` in the
+    watchdog thread. '''
+
+    def __init__(self, threshold, main_thread=None):
+        self.threshold = threshold
+        self.main_thread = main_thread or threading.main_thread()
+        self.histogram = LagHistogram()
+        self.last_tick = time.monotonic()
+        # the tick the stall being reported started from
+        self.reported_tick = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        GLib.timeout_add(int(TICK_INTERVAL * 1000), self.tick)
+        thread = threading.Thread(
+            target=self.watch, name='qui-watchdog', daemon=True)
+        thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.stopped.set()
+        log.info('Main loop lag histogram: %s', self.histogram.format())
+
+    def tick(self):
+        now = time.monotonic()
+        lag = max(0.0, now - self.last_tick - TICK_INTERVAL)
+        self.histogram.add(lag)
+        if lag > self.threshold:
+            log.warning('Main loop resumed after %.2f seconds', lag)
+        self.last_tick = now
+        return True
+
+    def watch(self):
+        while not self.stopped.wait(TICK_INTERVAL):
+            self.check()
+
+    def check(self):
+        last_tick = self.last_tick
+        stalled = time.monotonic() - last_tick - TICK_INTERVAL
+        if stalled <= self.threshold or self.reported_tick == last_tick:
+            return
+        self.reported_tick = last_tick
+
+        frame = sys._current_frames().get(  # pylint: disable=protected-access
+            self.main_thread.ident)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        handler = find_handler(stack)
+        log.warning(
+            'Main loop stalled for more than %.2f seconds in %s\n%s'
+            'Lag histogram: %s',
+            stalled,
+            '{} ({}:{})'.format(handler.name, handler.filename,
+                                handler.lineno) if handler else 'unknown',
+            ''.join(traceback.format_list(stack)),
+            self.histogram.format())
+
+
+def start_from_environment():
+    ''' Start a watchdog if QUI_WATCHDOG is set; returns it, or None '''
+    value = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not value:
+        return None
+    try:
+        threshold = float(value)
+    except ValueError:
+        threshold = 0
+    if threshold <= 0:
+        log.warning('Ignoring %s=%s: not a number of seconds',
+                    ENVIRONMENT_VARIABLE, value)
+        return None
+    logging.basicConfig(level=logging.INFO)
+    watchdog = Watchdog(threshold)
+    watchdog.start()
+    return watchdog
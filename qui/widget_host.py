@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position,import-error
+''' Runs several qui widgets in a single process, on one event loop, sharing
+one Qubes client and one admin.Events stream, instead of a process (with
+its own interpreter, Gtk and copy of the domain state) per widget. '''
+import argparse
+import asyncio
+import sys
+import traceback
+
+import qubesadmin
+import qubesadmin.events
+
+import qui.event_fanout
+from qui import event_stream
+from qui import systemd_notify
+from qui import watchdog
+
+import gi  # isort:skip
+gi.require_version('Gtk', '3.0')  # isort:skip
+from gi.repository import Gtk  # isort:skip
+
+import gbulb
+gbulb.install()
+
+import gettext
+t = gettext.translation("desktop-linux-manager", localedir="/usr/locales",
+                        fallback=True)
+_ = t.gettext
+
+WIDGETS = ('domains', 'devices', 'disk-space', 'updates', 'clipboard')
+
+
+class WidgetHost:
+    ''' The widgets started in this process and what they share. Every
+    widget is only imported when it is started. '''
+
+    def __init__(self):
+        self.qapp = qubesadmin.Qubes()
+        self.dispatcher = qui.event_fanout.get_events_dispatcher(self.qapp)
+        # event streams to listen to; only opened if a widget needs them
+        self.dispatchers = []
+        self.apps = []
+
+    def use_dispatcher(self, dispatcher):
+        if dispatcher not in self.dispatchers:
+            self.dispatchers.append(dispatcher)
+        return dispatcher
+
+    def start(self, widget):
+        getattr(self, 'start_' + widget.replace('-', '_'))()
+
+    def start_domains(self):
+        from qui.tray import domains
+        stats_dispatcher = self.use_dispatcher(
+            qubesadmin.events.EventsDispatcher(
+                self.qapp, api_method='admin.vm.Stats'))
+        app = domains.DomainTray(
+            'org.qubes.qui.tray.Domains', self.qapp,
+            self.use_dispatcher(self.dispatcher), stats_dispatcher)
+        app.run()
+        self.apps.append(app)
+
+    def start_devices(self):
+        from qui.tray import devices
+        self.apps.append(devices.DevicesTray(
+            'org.qubes.qui.tray.Devices', self.qapp,
+            self.use_dispatcher(self.dispatcher)))
+
+    def start_disk_space(self):
+        from qui.tray import disk_space
+        self.apps.append(disk_space.DiskSpace())
+
+    def start_updates(self):
+        from qui.tray import updates
+        app = updates.UpdatesTray(
+            'org.qubes.qui.tray.Updates', self.qapp,
+            self.use_dispatcher(self.dispatcher))
+        app.run()
+        self.apps.append(app)
+
+    def start_clipboard(self):
+        from qui import clipboard
+        app = clipboard.NotificationApp()
+        clipboard.EventHandler(loop=asyncio.get_event_loop(), gtk_app=app)
+        self.apps.append(app)
+
+    def service_status(self):
+        return '; '.join(app.service_status() for app in self.apps
+                         if hasattr(app, 'service_status'))
+
+    def run(self):
+        ''' Run until a handler of an event stream fails (connections lost
+        are reopened), or forever if no widget needs one. Returns the exit
+        code. '''
+        loop = asyncio.get_event_loop()
+        if not self.dispatchers:
+            loop.run_forever()
+            return 0
+
+        tasks = [
+            asyncio.ensure_future(event_stream.listen_for_events(dispatcher))
+            for dispatcher in self.dispatchers]
+        done, _unused = loop.run_until_complete(asyncio.wait(
+            tasks, return_when=asyncio.FIRST_EXCEPTION))
+
+        exit_code = 0
+        for d in done:  # pylint: disable=invalid-name
+            try:
+                d.result()
+            except Exception:  # pylint: disable=broad-except
+                exc_type, exc_value = sys.exc_info()[:2]
+                dialog = Gtk.MessageDialog(
+                    None, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.OK)
+                dialog.set_title(_("Houston, we have a problem..."))
+                dialog.set_markup(_(
+                    "<b>Whoops. A critical error in Qubes widgets has "
+                    "occured.</b> This is most likely a bug in the widgets. "
+                    "To restart them, run 'qui-widgets' in dom0."))
+                dialog.format_secondary_markup(
+                    "\n<b>{}</b>: {}\n{}".format(
+                        exc_type.__name__, exc_value,
+                        traceback.format_exc(limit=10)))
+                dialog.run()
+                exit_code = 1
+        return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=_("Run several Qubes widgets in a single process."))
+    parser.add_argument(
+        'widgets', metavar='WIDGET', nargs='*',
+        help=_("widgets to run: {} (default: all)").format(
+            ', '.join(WIDGETS)))
+    args = parser.parse_args()
+    for widget in args.widgets:
+        if widget not in WIDGETS:
+            parser.error(_("unknown widget: {}").format(widget))
+    watchdog.start_from_environment()
+
+    host = WidgetHost()
+    for widget in WIDGETS:
+        if not args.widgets or widget in args.widgets:
+            host.start(widget)
+    systemd_notify.start(host.service_status, host.dispatchers)
+    return host.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -40,7 +40,12 @@ setuptools.setup(name='qui',
               'qui-disk-space = qui.tray.disk_space:main',
               'qui-updates = qui.tray.updates:main',
               'qubes-update-gui = qui.updater:main',
-              'qui-clipboard = qui.clipboard:main'
+              'qui-clipboard = qui.clipboard:main',
+              'qui-widgets = qui.widget_host:main'
+          ],
+          'console_scripts': [
+              'qubes-update-headless = qui.updater_headless:main',
+              'qui-events = qui.event_fanout:main'
           ]
       },
       package_data={'qui': ["updater.glade"]},